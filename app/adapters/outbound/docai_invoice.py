@@ -1,43 +1,171 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 from app.config import settings
-from app.domain.models import InvoiceExtraction, Entity  
+from app.domain.models import EXTRACTION_SCHEMA_VERSION, BatchResult, InvoiceExtraction, Entity
+from app.shared.metrics import docai_documents, docai_pages, docai_queue_seconds, docai_retries
+from app.shared.ratelimit import AdaptiveRateLimiter, call_with_retry
+from google.api_core import exceptions as gexc
 from google.cloud import documentai
+from pypdf import PdfReader, PdfWriter
+
+log = logging.getLogger("docai")
+
+# 429 / RESOURCE_EXHAUSTED: bajar la tasa; el resto, solo reintentar
+_THROTTLE_ERRORS = (gexc.ResourceExhausted, gexc.TooManyRequests)
+_TRANSIENT_ERRORS = (gexc.ServiceUnavailable, gexc.DeadlineExceeded, gexc.InternalServerError, gexc.Aborted)
+
+def _page_of(e, offset: int) -> Optional[int]:
+    refs = getattr(getattr(e, "page_anchor", None), "page_refs", None)
+    if not refs:
+        return None
+    return int(refs[0].page or 0) + offset
+
+def _to_entity(e, page_offset: int = 0) -> Entity:
+    return Entity(
+        type=e.type_,
+        text=e.mention_text or "",
+        confidence=float(e.confidence or 0.0),
+        properties=[_to_entity(p, page_offset) for p in getattr(e, "properties", [])],
+        page=_page_of(e, page_offset),
+    )
+
+def _to_extraction(doc, mode: str = "online", page_offset: int = 0) -> InvoiceExtraction:
+    docai_documents.inc(mode=mode)
+    docai_pages.inc(len(getattr(doc, "pages", [])), mode=mode)
+    # Extrae entidades (ajusta a tu modelo si es distinto)
+    ents = [_to_entity(e, page_offset) for e in getattr(doc, "entities", [])]
+    return InvoiceExtraction(schema_version=EXTRACTION_SCHEMA_VERSION, entities=ents)
+
+def _split_pdf(content: bytes, pages_per_chunk: int) -> Optional[List[Tuple[int, bytes]]]:
+    """Parte el PDF en rangos de páginas: [(página inicial, bytes)]. None = no partir."""
+    try:
+        reader = PdfReader(io.BytesIO(content))
+        total = len(reader.pages)
+    except Exception as e:  # PDF cifrado/dañado: que lo intente DocAI entero
+        log.warning("pdf_split_unreadable", extra={"error": str(e)})
+        return None
+    if total <= pages_per_chunk:
+        return None
+    chunks = []
+    for start in range(0, total, pages_per_chunk):
+        writer = PdfWriter()
+        for i in range(start, min(start + pages_per_chunk, total)):
+            writer.add_page(reader.pages[i])
+        buf = io.BytesIO()
+        writer.write(buf)
+        chunks.append((start, buf.getvalue()))
+    return chunks
 
 class DocAIInvoiceExtractor:
-    def __init__(self):
+    def __init__(
+        self,
+        client: Optional[documentai.DocumentProcessorServiceClient] = None,
+        limiter: Optional[AdaptiveRateLimiter] = None,
+    ):
         self.project_id   = settings.GOOGLE_CLOUD_PROJECT
         self.location     = settings.GOOGLE_CLOUD_REGION
         self.processor_id = settings.DOCAI_PROCESSOR_ID
+        self.processor_version = settings.DOCAI_PROCESSOR_VERSION
+        # >0: PDFs con más páginas se parten en rangos de este tamaño y se procesan en paralelo
+        self.split_pages = settings.DOCAI_SPLIT_PAGES
+        self.split_fanout = settings.DOCAI_SPLIT_FANOUT
 
         if not self.project_id or not self.processor_id:
             raise ValueError("Faltan GOOGLE_CLOUD_PROJECT o DOCAI_PROCESSOR_ID")
 
-        self.client = documentai.DocumentProcessorServiceClient()
+        self.client = client or documentai.DocumentProcessorServiceClient()
+        # compartido por todos los hilos de la instancia: cada process_document pasa por aquí
+        self.limiter = limiter
+        self.max_attempts = settings.DOCAI_MAX_ATTEMPTS
+        self.backoff = settings.DOCAI_BACKOFF_SECONDS
 
-    def extract_invoice(self, local_pdf_path: str) -> InvoiceExtraction:
-        # Nombre del procesador
-        name = self.client.processor_path(self.project_id, self.location, self.processor_id)
+    @property
+    def cache_namespace(self) -> str:
+        """Procesador + versión + formato: cambiar cualquiera invalida la caché de extracciones."""
+        return f"{self.processor_id}@{self.processor_version or 'default'}/{EXTRACTION_SCHEMA_VERSION}"
+
+    def _processor_name(self) -> str:
+        if self.processor_version:
+            return self.client.processor_version_path(
+                self.project_id, self.location, self.processor_id, self.processor_version
+            )
+        return self.client.processor_path(self.project_id, self.location, self.processor_id)
 
-        # Lee bytes del PDF local
-        with open(local_pdf_path, "rb") as f:
-            content = f.read()
+    def extract_invoice_bytes(self, content: bytes, mime_type: str = "application/pdf") -> InvoiceExtraction:
+        chunks = None
+        if self.split_pages > 0 and mime_type == "application/pdf":
+            chunks = _split_pdf(content, self.split_pages)
+        if not chunks:
+            # camino rápido: una sola llamada (facturas de pocas páginas)
+            return self._process(content, mime_type)
+        return self._extract_chunks(chunks)
 
-        # Usa RawDocument (PDF en bytes)
+    def _process(self, content: bytes, mime_type: str = "application/pdf", page_offset: int = 0) -> InvoiceExtraction:
+        # Usa RawDocument (PDF en bytes, directo desde GCS sin pasar por /tmp)
         request = documentai.ProcessRequest(
-            name=name,
-            raw_document=documentai.RawDocument(content=content, mime_type="application/pdf"),
+            name=self._processor_name(),
+            raw_document=documentai.RawDocument(content=content, mime_type=mime_type),
         )
-        result = self.client.process_document(request=request)
-        doc = result.document
-
-        # Extrae entidades (ajusta a tu modelo si es distinto)
-        ents = []
-        for e in getattr(doc, "entities", []):
-            ents.append(
-                Entity(
-                    type=e.type_, 
-                    text=e.mention_text or "",
-                    confidence=float(e.confidence or 0.0),
-                )
-            )
+        result = call_with_retry(
+            lambda: self.client.process_document(request=request),
+            self.limiter,
+            throttle_errors=_THROTTLE_ERRORS,
+            transient_errors=_TRANSIENT_ERRORS,
+            max_attempts=self.max_attempts,
+            backoff=self.backoff,
+            on_wait=docai_queue_seconds.observe,
+            on_retry=lambda kind: docai_retries.inc(kind=kind),
+        )
+        return _to_extraction(result.document, page_offset=page_offset)
+
+    def _extract_chunks(self, chunks: List[Tuple[int, bytes]]) -> InvoiceExtraction:
+        """Procesa los rangos en paralelo (hasta split_fanout a la vez) y une las entidades.
+
+        Las páginas de cada entidad se traducen al PDF original. Los campos de cabecera
+        que aparecen en varios rangos quedan todos; la normalización se queda con el de
+        mayor confianza. Si un rango falla, falla la factura completa.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(self.split_fanout, len(chunks))), thread_name_prefix="docai-split") as pool:
+            parts = list(pool.map(lambda c: self._process(c[1], page_offset=c[0]), chunks))
+        entities = [e for part in parts for e in part.entities]
+        return InvoiceExtraction(schema_version=EXTRACTION_SCHEMA_VERSION, entities=entities)
+
+    # ---------- Batch (backfill) ----------
+    def batch_submit(self, gcs_uris: List[str], output_uri: str) -> str:
+        """Lanza batch_process_documents y retorna el nombre de la operación (LRO)."""
+        documents = [documentai.GcsDocument(gcs_uri=u, mime_type="application/pdf") for u in gcs_uris]
+        request = documentai.BatchProcessRequest(
+            name=self._processor_name(),
+            input_documents=documentai.BatchDocumentsInputConfig(
+                gcs_documents=documentai.GcsDocuments(documents=documents),
+            ),
+            document_output_config=documentai.DocumentOutputConfig(
+                gcs_output_config=documentai.DocumentOutputConfig.GcsOutputConfig(gcs_uri=output_uri),
+            ),
+        )
+        operation = self.client.batch_process_documents(request=request)
+        return operation.operation.name
+
+    def batch_status(self, operation_name: str) -> BatchResult:
+        """Consulta la operación por nombre (sirve también tras reiniciar el proceso)."""
+        op = self.client.get_operation(request={"name": operation_name})
+        if not op.done:
+            return BatchResult(done=False)
+        if op.HasField("error") and op.error.code:
+            return BatchResult(done=True, error=op.error.message)
+
+        metadata = documentai.BatchProcessMetadata.deserialize(op.metadata.value)
+        result = BatchResult(done=True)
+        for st in metadata.individual_process_statuses:
+            if st.status.code:
+                result.failures[st.input_gcs_source] = st.status.message
+            else:
+                result.outputs[st.input_gcs_source] = st.output_gcs_destination
+        return result
 
-        return InvoiceExtraction(schema_version="1.0", entities=ents)
+    def extraction_from_json(self, data: bytes) -> InvoiceExtraction:
+        """Convierte un shard de salida (Document JSON) del batch en InvoiceExtraction."""
+        doc = documentai.Document.from_json(data, ignore_unknown_fields=True)
+        return _to_extraction(doc, mode="batch")
@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from google.cloud import firestore
+
+from app.domain.models import InvoiceExtraction, ObjectInfo
+from app.shared.cache import TTLCache
+
+log = logging.getLogger("extraction_cache")
+
+class ExtractionCache:
+    """Caché de extracciones DocAI direccionada por contenido.
+
+    La clave combina el hash del objeto en GCS (crc32c/md5 de los metadatos, sin
+    descargarlo), su tamaño y el procesador/versión de DocAI. Dos niveles: un LRU en
+    memoria delante de la colección Firestore `extraction_cache`. Cambiar de versión
+    de procesador cambia la clave, y `ttl_seconds` acota la vida de cada entrada.
+    """
+
+    def __init__(
+        self,
+        db: firestore.Client,
+        namespace: str,
+        ttl_seconds: int = 30 * 24 * 3600,
+        mem_items: int = 256,
+        collection: str = "extraction_cache",
+    ):
+        self.db = db
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self._mem = TTLCache(maxsize=mem_items, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+        self._counters: Counter = Counter()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    def key_for(self, info: ObjectInfo) -> Optional[str]:
+        content_hash = info.crc32c or info.md5_hash
+        if not content_hash:
+            return None
+        raw = f"{content_hash}:{info.size}:{self.namespace}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[InvoiceExtraction]:
+        hit = self._mem.get(key)
+        if hit is not None:
+            self._count("memory_hits")
+            return hit
+
+        try:
+            snap = self.db.collection(self.collection).document(key).get()
+        except Exception as e:
+            # la caché nunca debe tumbar el procesamiento: se trata como miss
+            log.warning("extraction_cache_read_failed", extra={"error": str(e)})
+            self._count("errors")
+            return None
+        data = snap.to_dict() if snap.exists else None
+        if not data or data.get("namespace") != self.namespace:
+            self._count("misses")
+            return None
+        expires_at = data.get("expiresAt")
+        if expires_at and expires_at <= datetime.now(timezone.utc):
+            self._count("expired")
+            return None
+
+        extraction = InvoiceExtraction.from_dict(data["extraction"])
+        self._mem.set(key, extraction)
+        self._count("store_hits")
+        return extraction
+
+    def put(self, key: str, extraction: InvoiceExtraction) -> None:
+        self._mem.set(key, extraction)
+        # expiresAt sirve además como campo de política TTL de Firestore
+        try:
+            self.db.collection(self.collection).document(key).set({
+                "namespace": self.namespace,
+                "extraction": extraction.to_dict(),
+                "createdAt": firestore.SERVER_TIMESTAMP,
+                "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+            })
+        except Exception as e:
+            log.warning("extraction_cache_write_failed", extra={"error": str(e)})
+            self._count("errors")
+            return
+        self._count("writes")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._counters)
+        lookups = out.get("memory_hits", 0) + out.get("store_hits", 0) + out.get("misses", 0) + out.get("expired", 0)
+        out["lookups"] = lookups
+        out["memory_size"] = len(self._mem)
+        return out
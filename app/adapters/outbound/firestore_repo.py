@@ -1,6 +1,70 @@
-from typing import Any, Dict, List, Optional, Tuple
+import base64
+import hashlib
+import json
+import random
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from google.api_core.exceptions import AlreadyExists, NotFound
 from google.cloud import firestore
 from app.config import settings
+from app.domain.models import InvoiceDTO
+from app.domain.parsing import typed_fields
+from app.domain.search import matches, query_tokens, rank, search_tokens
+from app.shared.cache import TTLCache
+from app.shared.metrics import firestore_errors, firestore_seconds, instrumented, span
+
+# Campos que lee el listado: los del DTO (+ createdAt para el cursor).
+# Evita traer raw.entities y supplierSnapshot en cada página.
+LIST_FIELDS = [f for f in InvoiceDTO.model_fields if f != "id"] + ["createdAt"]
+
+# Columnas del export (además de id y supplierId, que salen de la ruta del documento)
+EXPORT_FIELDS = [
+    "invoiceId", "status", "currency", "total", "totalTax", "netAmount", "issueDate", "dueDate",
+    "supplierName", "supplierAddress", "filePath", "createdAt",
+]
+
+# Estados que siempre aparecen en el resumen de stats
+STATUSES = ("parsed", "observed", "approved", "paid")
+
+# Montos que suman los rollups mensuales (en céntimos enteros: Increment exacto)
+ROLLUP_AMOUNTS = ("total", "totalTax", "netAmount")
+
+# Campos que hacen falta para recalcular rollups (los de texto, para facturas sin tipar)
+ROLLUP_SOURCE_FIELDS = [
+    "status", "period", "amounts", "currencyCode",
+    "total", "totalTax", "netAmount", "currency", "issueDate", "dueDate",
+]
+
+def _cents(value: Any) -> int:
+    return int(round(float(value) * 100)) if value is not None else 0
+
+def _rollup_acc() -> Dict[str, Dict[Tuple[str, str], Counter]]:
+    # {period: {(currency, status): Counter(count, totalCents, ...)}}
+    return defaultdict(lambda: defaultdict(Counter))
+
+def _add_rollup(acc: Dict[str, Dict[Tuple[str, str], Counter]], data: Optional[Dict[str, Any]], sign: int) -> None:
+    """Suma (sign=1) o resta (sign=-1) lo que aporta una factura a su rollup mensual.
+
+    Las facturas sin `period` (anteriores a los campos tipados o sin fecha legible)
+    no aportan a ningún rollup.
+    """
+    if not data or not data.get("period") or not data.get("status"):
+        return
+    amounts = data.get("amounts") or {}
+    delta = acc[data["period"]][(data.get("currencyCode") or "UNK", data["status"])]
+    delta["count"] += sign
+    for f in ROLLUP_AMOUNTS:
+        delta[f"{f}Cents"] += sign * _cents(amounts.get(f))
+
+def _with_search_tokens(supplier_id: str, invoice_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    # los guardados completos (_normalize) traen supplierName; un merge parcial sin él
+    # conserva los tokens que ya tenía el documento
+    if "supplierName" not in data:
+        return data
+    tokens = search_tokens(supplier_id, data.get("invoiceId") or invoice_id, data.get("supplierName"))
+    return {**data, "searchTokens": tokens}
 
 def _parse_doc_id(doc_id: str) -> Tuple[str, str]:
     if "/" not in doc_id:
@@ -8,17 +72,62 @@ def _parse_doc_id(doc_id: str) -> Tuple[str, str]:
     supplier_id, invoice_id = doc_id.split("/", 1)
     return supplier_id, invoice_id
 
+# Snapshots de users/{uid} compartidos por todas las instancias del repo en el proceso
+# (is_admin en cada request, get_user_snapshot al procesar). TTL corto + invalidate_user.
+user_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+# Documentos de factura completos por 'supplierId/invoiceId' (read-through de get_invoice).
+# Las escrituras de esta instancia la invalidan; con INVOICE_CACHE_LISTEN un listener
+# invalida también lo que escriben otras instancias.
+invoice_cache = TTLCache(maxsize=settings.INVOICE_CACHE_SIZE, ttl=settings.INVOICE_CACHE_TTL)
+
+def _encode_cursor(created_at: datetime, path: str) -> str:
+    # cursor opaco: createdAt + ruta completa del último documento (desempate)
+    raw = json.dumps({"t": created_at.isoformat(), "p": path})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]), data["p"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("cursor inválido")
+
+@instrumented("firestore", firestore_seconds, firestore_errors)
 class FirestoreRepo:
-    def __init__(self):
-        self.db = firestore.Client(project=settings.GOOGLE_CLOUD_PROJECT)
+    def __init__(self, db: Optional[firestore.Client] = None):
+        self.db = db or firestore.Client(project=settings.GOOGLE_CLOUD_PROJECT)
         self.suppliers_coll = getattr(settings, "FIRESTORE_SUPPLIERS_COLL", "suppliers")
         self.invoices_sub   = getattr(settings, "FIRESTORE_INVOICES_SUB", "invoices")
         self.events_sub     = getattr(settings, "FIRESTORE_EVENTS_SUB", "events")
+        # "aggregate" = count() por consulta; "counters" = contadores fragmentados en stats/{scope}
+        self.stats_mode     = settings.STATS_MODE
+        self.counter_shards = settings.STATS_COUNTER_SHARDS
+        # suppliers/{id}/rollups/{aaaa-mm}: totales por moneda y estado, al día con cada escritura
+        self.rollups_sub    = getattr(settings, "FIRESTORE_ROLLUPS_SUB", "rollups")
+        self.rollups_enabled = settings.ROLLUPS_ENABLED
+        self._invoice_watch = None
+        self._invoice_watch_timer: Optional[threading.Timer] = None
+        self._invoice_watch_lock = threading.Lock()
 
     # ---------- USUARIOS ----------
     def get_user_snapshot(self, uid: str) -> Optional[Dict[str, Any]]:
+        cached = user_cache.get(uid)
+        if cached is not None:
+            return cached or None
         doc = self.db.collection("users").document(uid).get()
-        return doc.to_dict() if doc.exists else None
+        data = doc.to_dict() if doc.exists else None
+        # también se cachea "no existe" ({}), para no releerlo en cada request
+        user_cache.set(uid, data or {})
+        return data
+
+    def invalidate_user(self, uid: Optional[str] = None) -> None:
+        """Descarta el snapshot cacheado de un usuario (o de todos si uid es None)."""
+        if uid is None:
+            user_cache.clear()
+        else:
+            user_cache.pop(uid)
 
     def is_admin(self, uid: str) -> bool:
         data = self.get_user_snapshot(uid)
@@ -42,19 +151,157 @@ class FirestoreRepo:
         return self._inv_ref(supplier_id, invoice_id).get().exists
 
     def save_invoice(self, supplier_id: str, invoice_id: str, data: Dict[str, Any]) -> None:
-        self._inv_ref(supplier_id, invoice_id).set(data, merge=True)
+        data = _with_search_tokens(supplier_id, invoice_id, data)
+        try:
+            self._inv_ref(supplier_id, invoice_id).set(data, merge=True)
+        finally:
+            invoice_cache.pop(f"{supplier_id}/{invoice_id}")
+
+    def create_invoice(self, supplier_id: str, invoice_id: str, data: Dict[str, Any], event: Dict[str, Any]) -> bool:
+        """Crea la factura solo si no existe y escribe su evento en el mismo commit.
+
+        Retorna False si ya existía (la precondición de `create` falla y no se escribe
+        nada), así dos entregas concurrentes no pueden crear la misma factura.
+        """
+        data = _with_search_tokens(supplier_id, invoice_id, data)
+        batch = self.db.batch()
+        batch.create(self._inv_ref(supplier_id, invoice_id), data)
+        batch.set(self._events_ref(invoice_id).document(), event)
+        if self.stats_mode == "counters":
+            self._increment_counters(batch, supplier_id, {data.get("status"): 1, "total": 1})
+        if self.rollups_enabled:
+            acc = _rollup_acc()
+            _add_rollup(acc, data, 1)
+            self._write_rollups(batch, supplier_id, acc)
+        try:
+            batch.commit()
+        except AlreadyExists:
+            return False
+        invoice_cache.pop(f"{supplier_id}/{invoice_id}")
+        return True
+
+    def save_invoice_with_event(self, supplier_id: str, invoice_id: str, data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        """set(merge=True) de la factura + evento en un único commit.
+
+        Con rollups activos es una transacción: hay que leer la versión anterior para
+        restar su aporte (montos, moneda o mes pueden cambiar al re-extraer).
+        """
+        data = _with_search_tokens(supplier_id, invoice_id, data)
+        if self.rollups_enabled:
+            return self._save_with_rollups(supplier_id, invoice_id, data, event)
+        batch = self.db.batch()
+        batch.set(self._inv_ref(supplier_id, invoice_id), data, merge=True)
+        batch.set(self._events_ref(invoice_id).document(), event)
+        try:
+            batch.commit()
+        finally:
+            invoice_cache.pop(f"{supplier_id}/{invoice_id}")
+
+    def _save_with_rollups(self, supplier_id: str, invoice_id: str, data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        ref = self._inv_ref(supplier_id, invoice_id)
+        event_ref = self._events_ref(invoice_id).document()
+
+        @firestore.transactional
+        def _txn(transaction) -> None:
+            snap = ref.get(transaction=transaction)
+            old = (snap.to_dict() or {}) if snap.exists else None
+            transaction.set(ref, data, merge=True)
+            transaction.set(event_ref, event)
+            acc = _rollup_acc()
+            _add_rollup(acc, old, -1)
+            _add_rollup(acc, {**(old or {}), **data}, 1)
+            self._write_rollups(transaction, supplier_id, acc)
+
+        try:
+            _txn(self.db.transaction())
+        finally:
+            invoice_cache.pop(f"{supplier_id}/{invoice_id}")
+
+    def get_many(self, doc_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Lectura batch (un get_all) de varios 'supplierId/invoiceId'; omite los inexistentes."""
+        refs = {}
+        for doc_id in doc_ids:
+            try:
+                supplier_id, invoice_id = _parse_doc_id(doc_id)
+            except ValueError:
+                continue
+            refs[self._inv_ref(supplier_id, invoice_id).path] = doc_id
+        if not refs:
+            return {}
+        snaps = self.db.get_all([self.db.document(p) for p in refs], field_paths=fields)
+        return {refs[s.reference.path]: s.to_dict() for s in snaps if s.exists}
 
     def get_invoice(self, supplier_id: str, invoice_id: str) -> Optional[Dict[str, Any]]:
+        key = f"{supplier_id}/{invoice_id}"
+        cached = invoice_cache.get(key)
+        if cached is not None:
+            return dict(cached)
         snap = self._inv_ref(supplier_id, invoice_id).get()
-        return snap.to_dict() if snap.exists else None
+        if not snap.exists:
+            return None  # los inexistentes no se cachean: pueden crearse en otra instancia
+        data = snap.to_dict() or {}
+        invoice_cache.set(key, data)
+        return dict(data)
 
-    def list_invoices(
+    def start_invoice_listener(self, window_seconds: float = settings.INVOICE_CACHE_LISTEN_WINDOW) -> None:
+        """Invalida la caché con los cambios de cualquier instancia (on_snapshot).
+
+        Escucha las facturas con updatedAt dentro de una ventana: todas las escrituras
+        lo actualizan, así que cada cambio llega como ADDED/MODIFIED y se descarta la
+        copia local. El listener retiene los documentos que calzan con la consulta, así
+        que cada `window_seconds` se reabre con un `since` nuevo (el viejo se cierra
+        después) y lo retenido no crece con la vida de la instancia. Requiere índice
+        de collection group sobre updatedAt.
+        """
+        with self._invoice_watch_lock:
+            if self._invoice_watch is not None:
+                return
+            self._invoice_watch = self._watch_invoices(datetime.now(timezone.utc))
+            self._schedule_listener_rotation(window_seconds)
+
+    def _watch_invoices(self, since: datetime):
+        def on_changes(_snapshots, changes, _read_time):
+            # solo se usa la referencia del cambio: los snapshots no se guardan
+            for change in changes:
+                ref = change.document.reference
+                invoice_cache.pop(f"{ref.parent.parent.id}/{ref.id}")
+
+        query = self.db.collection_group(self.invoices_sub).where("updatedAt", ">=", since)
+        return query.on_snapshot(on_changes)
+
+    def _schedule_listener_rotation(self, window_seconds: float) -> None:
+        timer = threading.Timer(window_seconds, self._rotate_invoice_listener, args=(window_seconds,))
+        timer.daemon = True
+        timer.start()
+        self._invoice_watch_timer = timer
+
+    def _rotate_invoice_listener(self, window_seconds: float) -> None:
+        # solape con la ventana anterior: cubre escrituras en vuelo y el desfase de reloj
+        since = datetime.now(timezone.utc) - timedelta(seconds=settings.INVOICE_CACHE_TTL)
+        with self._invoice_watch_lock:
+            if self._invoice_watch is None:
+                return
+            old, self._invoice_watch = self._invoice_watch, self._watch_invoices(since)
+            self._schedule_listener_rotation(window_seconds)
+        old.unsubscribe()
+
+    def stop_invoice_listener(self) -> None:
+        with self._invoice_watch_lock:
+            watch, self._invoice_watch = self._invoice_watch, None
+            if self._invoice_watch_timer is not None:
+                self._invoice_watch_timer.cancel()
+                self._invoice_watch_timer = None
+        if watch is not None:
+            watch.unsubscribe()
+
+    def _invoices_base(
         self,
         supplier_uid: Optional[str] = None,
         status: Optional[str] = None,
-        limit: int = 50,
-        supplier_id: Optional[str] = None,  # RUC explícito (solo admin)
-    ) -> List[Dict[str, Any]]:
+        supplier_id: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ):
         if supplier_id:
             # listado solo de ese RUC
             query = (self.db.collection(self.suppliers_coll)
@@ -69,26 +316,283 @@ class FirestoreRepo:
 
         if status:
             query = query.where("status", "==", status)
+        if created_from:
+            query = query.where("createdAt", ">=", created_from)
+        if created_to:
+            query = query.where("createdAt", "<", created_to)
+        return query
+
+    def _invoices_query(
+        self,
+        supplier_uid: Optional[str] = None,
+        status: Optional[str] = None,
+        supplier_id: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ):
+        query = self._invoices_base(
+            supplier_uid=supplier_uid, status=status, supplier_id=supplier_id,
+            created_from=created_from, created_to=created_to,
+        )
+        # Requiere índice (collectionGroup + order_by createdAt); __name__ desempata
+        return (query.order_by("createdAt", direction=firestore.Query.DESCENDING)
+                     .order_by("__name__", direction=firestore.Query.DESCENDING))
+
+    def page_invoices(
+        self,
+        supplier_uid: Optional[str] = None,
+        status: Optional[str] = None,
+        limit: int = 50,
+        supplier_id: Optional[str] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Página por keyset (start_after createdAt + ruta). Retorna (items, next_cursor)."""
+        query = self._invoices_query(supplier_uid=supplier_uid, status=status, supplier_id=supplier_id)
+        if fields:
+            query = query.select(fields)
+        if cursor:
+            created_at, path = _decode_cursor(cursor)
+            query = query.start_after({"createdAt": created_at, "__name__": self.db.document(path)})
+
+        # se pide uno extra para saber si hay página siguiente
+        docs = list(query.limit(limit + 1).stream())
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            last = docs[-1]
+            next_cursor = _encode_cursor(last.get("createdAt"), last.reference.path)
+        items = [d.to_dict() | {"id": d.id, "supplierId": d.reference.parent.parent.id} for d in docs]
+        return items, next_cursor
+
+    def iter_invoices(
+        self,
+        supplier_uid: Optional[str] = None,
+        status: Optional[str] = None,
+        supplier_id: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        fields: Optional[List[str]] = None,
+        page_size: int = 500,
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Recorre todo el resultado por páginas (keyset), sin materializarlo.
+
+        Genera listas de hasta `page_size` filas; solo hay una página en memoria a la vez.
+        """
+        query = self._invoices_query(
+            supplier_uid=supplier_uid, status=status, supplier_id=supplier_id,
+            created_from=created_from, created_to=created_to,
+        )
+        if fields:
+            # start_after(snapshot) necesita el campo de orden en la proyección
+            query = query.select(list(dict.fromkeys([*fields, "createdAt"])))
+        last = None
+        while True:
+            page = query.start_after(last) if last is not None else query
+            # el decorador de métricas no ve dentro del generador: span por página
+            with span("firestore.iter_invoices.page", histogram=firestore_seconds, label="method"):
+                docs = list(page.limit(page_size).stream())
+            if not docs:
+                return
+            yield [d.to_dict() | {"id": d.id, "supplierId": d.reference.parent.parent.id} for d in docs]
+            if len(docs) < page_size:
+                return
+            last = docs[-1]
+
+    def list_invoices(
+        self,
+        supplier_uid: Optional[str] = None,
+        status: Optional[str] = None,
+        limit: int = 50,
+        supplier_id: Optional[str] = None,  # RUC explícito (solo admin)
+    ) -> List[Dict[str, Any]]:
+        items, _ = self.page_invoices(supplier_uid=supplier_uid, status=status, limit=limit, supplier_id=supplier_id)
+        return items
+
+    def search_invoices(
+        self,
+        token: str,
+        supplier_uid: Optional[str] = None,
+        supplier_id: Optional[str] = None,
+        limit: int = 200,
+        fields: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Facturas cuyo searchTokens contiene `token`, las más recientes primero.
+
+        Requiere índices compuestos (searchTokens array-contains + createdAt desc, y
+        con supplierUid para los proveedores).
+        """
+        if supplier_id:
+            query = (self.db.collection(self.suppliers_coll)
+                        .document(supplier_id)
+                        .collection(self.invoices_sub))
+        else:
+            query = self.db.collection_group(self.invoices_sub)
+        query = query.where("searchTokens", "array_contains", token)
+        if supplier_uid:
+            query = query.where("supplierUid", "==", supplier_uid)
+        query = query.order_by("createdAt", direction=firestore.Query.DESCENDING).limit(limit)
+        if fields:
+            query = query.select(fields)
+        return [d.to_dict() | {"id": d.id, "supplierId": d.reference.parent.parent.id} for d in query.stream()]
 
-        # Requiere índice (collectionGroup + order_by createdAt)
-        docs = query.order_by("createdAt", direction=firestore.Query.DESCENDING).limit(limit).stream()
-        return [d.to_dict() | {"id": d.id, "supplierId": d.reference.parent.parent.id} for d in docs]
+    def reindex_search(self, supplier_ids: Optional[List[str]] = None, chunk_size: int = 400) -> Dict[str, int]:
+        """(Re)escribe searchTokens de las facturas existentes. Retorna {supplierId: facturas}."""
+        if supplier_ids is None:
+            supplier_ids = [ref.id for ref in self.db.collection(self.suppliers_coll).list_documents()]
+        out: Dict[str, int] = {}
+        for supplier_id in supplier_ids:
+            seen = 0
+            batch, pending = self.db.batch(), 0
+            for rows in self.iter_invoices(supplier_id=supplier_id, fields=["invoiceId", "supplierName"]):
+                for row in rows:
+                    seen += 1
+                    tokens = search_tokens(supplier_id, row.get("invoiceId") or row["id"], row.get("supplierName"))
+                    # updatedAt: el listener de cambios (filtrado por updatedAt) debe ver la reescritura
+                    batch.update(self._inv_ref(supplier_id, row["id"]), {
+                        "searchTokens": tokens,
+                        "updatedAt": firestore.SERVER_TIMESTAMP,
+                    })
+                    invoice_cache.pop(f"{supplier_id}/{row['id']}")
+                    pending += 1
+                    if pending >= chunk_size:
+                        batch.commit()
+                        batch, pending = self.db.batch(), 0
+            if pending:
+                batch.commit()
+            out[supplier_id] = seen
+        return out
 
     # ---------- EVENTOS / ESTADO ----------
     def add_event(self, invoice_id: str, event: Dict[str, Any]) -> None:
         self._events_ref(invoice_id).add(event)
 
-    def update_invoice_status(self, supplier_id: str, invoice_id: str, status: str, by_uid: Optional[str] = None):
-        # Actualiza estado en la factura y registra evento
-        self._inv_ref(supplier_id, invoice_id).update({
+    def update_invoice_status(self, supplier_id: str, invoice_id: str, status: str, by_uid: Optional[str] = None) -> bool:
+        # Actualiza estado en la factura y registra evento en un único commit.
+        # `update` exige que el documento exista: si no, no se escribe nada y retorna False.
+        if self.stats_mode == "counters" or self.rollups_enabled:
+            return self._update_status_txn(supplier_id, invoice_id, status, by_uid)
+        batch = self.db.batch()
+        batch.update(self._inv_ref(supplier_id, invoice_id), {
             "status": status,
             "updatedAt": firestore.SERVER_TIMESTAMP
         })
-        self.add_event(invoice_id, {
+        batch.set(self._events_ref(invoice_id).document(), {
             "action": f"STATUS_{status.upper()}",
             "byUid": by_uid,
             "at": firestore.SERVER_TIMESTAMP
         })
+        try:
+            batch.commit()
+        except NotFound:
+            return False
+        finally:
+            invoice_cache.pop(f"{supplier_id}/{invoice_id}")
+        return True
+
+    def _update_status_txn(self, supplier_id: str, invoice_id: str, status: str, by_uid: Optional[str]) -> bool:
+        # contadores y rollups necesitan el estado anterior: se lee dentro de la transacción
+        ref = self._inv_ref(supplier_id, invoice_id)
+        event_ref = self._events_ref(invoice_id).document()
+
+        @firestore.transactional
+        def _txn(transaction) -> bool:
+            snap = ref.get(transaction=transaction)
+            if not snap.exists:
+                return False
+            data = snap.to_dict() or {}
+            old = data.get("status")
+            transaction.update(ref, {"status": status, "updatedAt": firestore.SERVER_TIMESTAMP})
+            transaction.set(event_ref, {
+                "action": f"STATUS_{status.upper()}",
+                "byUid": by_uid,
+                "at": firestore.SERVER_TIMESTAMP
+            })
+            if old != status:
+                if self.stats_mode == "counters":
+                    self._increment_counters(transaction, supplier_id, {old: -1, status: 1})
+                if self.rollups_enabled:
+                    acc = _rollup_acc()
+                    _add_rollup(acc, data, -1)
+                    _add_rollup(acc, data | {"status": status}, 1)
+                    self._write_rollups(transaction, supplier_id, acc)
+            return True
+
+        try:
+            return _txn(self.db.transaction())
+        finally:
+            invoice_cache.pop(f"{supplier_id}/{invoice_id}")
+
+    def bulk_update_status(
+        self,
+        doc_ids: List[str],
+        status: str,
+        by_uid: Optional[str] = None,
+        chunk_size: int = 100,
+    ) -> Dict[str, str]:
+        """Cambia el estado de muchas facturas: una transacción por chunk.
+
+        Cada transacción lee el chunk con un solo get_all y escribe update + evento
+        (+ contadores y rollups, agregados por documento) de las que existen. Retorna {doc_id: "ok" | "not_found" |
+        "invalid_id" | "error"}. El chunk por defecto deja margen bajo el límite de
+        500 escrituras por commit (hasta 4 escrituras por factura).
+        """
+        results: Dict[str, str] = {}
+        targets: List[Tuple[str, str, str]] = []
+        for doc_id in dict.fromkeys(doc_ids):
+            try:
+                targets.append((doc_id, *_parse_doc_id(doc_id)))
+            except ValueError:
+                results[doc_id] = "invalid_id"
+
+        for i in range(0, len(targets), chunk_size):
+            chunk = targets[i:i + chunk_size]
+            try:
+                results.update(self._update_status_chunk(chunk, status, by_uid))
+            except Exception:
+                results.update({doc_id: "error" for doc_id, _, _ in chunk})
+            finally:
+                for doc_id, _, _ in chunk:
+                    invoice_cache.pop(doc_id)
+        return results
+
+    def _update_status_chunk(self, chunk: List[Tuple[str, str, str]], status: str, by_uid: Optional[str]) -> Dict[str, str]:
+        refs = {self._inv_ref(s, i).path: (doc_id, s, i) for doc_id, s, i in chunk}
+
+        @firestore.transactional
+        def _txn(transaction) -> Dict[str, str]:
+            out = {doc_id: "not_found" for doc_id, _, _ in chunk}
+            # contadores agregados por scope: cada shard se escribe una sola vez por commit
+            deltas: Dict[Optional[str], Counter] = defaultdict(Counter)
+            rollups: Dict[str, Dict[str, Dict[Tuple[str, str], Counter]]] = defaultdict(_rollup_acc)
+            for snap in transaction.get_all([self.db.document(p) for p in refs]):
+                if not snap.exists:
+                    continue
+                doc_id, supplier_id, invoice_id = refs[snap.reference.path]
+                transaction.update(snap.reference, {"status": status, "updatedAt": firestore.SERVER_TIMESTAMP})
+                transaction.set(self._events_ref(invoice_id).document(), {
+                    "action": f"STATUS_{status.upper()}",
+                    "byUid": by_uid,
+                    "at": firestore.SERVER_TIMESTAMP
+                })
+                data = snap.to_dict() or {}
+                old = data.get("status")
+                if old != status:
+                    for scope in (None, supplier_id):
+                        deltas[scope][old] -= 1
+                        deltas[scope][status] += 1
+                    _add_rollup(rollups[supplier_id], data, -1)
+                    _add_rollup(rollups[supplier_id], data | {"status": status}, 1)
+                out[doc_id] = "ok"
+            if self.stats_mode == "counters":
+                for scope, delta in deltas.items():
+                    self._increment_scope(transaction, self._scope(scope), delta)
+            if self.rollups_enabled:
+                for supplier_id, acc in rollups.items():
+                    self._write_rollups(transaction, supplier_id, acc)
+            return out
+
+        return _txn(self.db.transaction())
 
     # ---------- Wrappers usados por el router ----------
     def list(
@@ -106,28 +610,325 @@ class FirestoreRepo:
             suid = requester_uid
             supplier_id = None
 
-        items = self.list_invoices(
+        return self.page_invoices(
             supplier_uid=suid,
             status=status,
             limit=limit,
-            supplier_id=supplier_id
+            supplier_id=supplier_id,
+            cursor=cursor,
+            fields=LIST_FIELDS,
         )
-        return items, None
+
+    def search(
+        self,
+        q: str,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        *,
+        requester_uid: Optional[str] = None,
+        supplier_id: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Busca por nombre de proveedor, prefijo de RUC o número de factura.
+
+        Una sola consulta indexada con el token más largo (el más selectivo) trae hasta
+        SEARCH_MAX_CANDIDATES candidatos recientes; el resto de palabras se verifica
+        contra sus tokens y se ordenan por relevancia. El cursor es la posición en ese
+        ranking: cada página repite la misma consulta.
+        """
+        tokens = query_tokens(q)
+        if not tokens:
+            raise ValueError("búsqueda vacía")
+        try:
+            offset = int(cursor or 0)
+        except ValueError:
+            raise ValueError("cursor inválido")
+        if offset < 0:
+            raise ValueError("cursor inválido")
+
+        suid = None
+        if requester_uid and not self.is_admin(requester_uid):
+            suid, supplier_id = requester_uid, None
+
+        candidates = self.search_invoices(
+            max(tokens, key=len),
+            supplier_uid=suid,
+            supplier_id=supplier_id,
+            limit=settings.SEARCH_MAX_CANDIDATES,
+            fields=LIST_FIELDS + ["searchTokens"],
+        )
+        hits = [c for c in candidates if matches(tokens, c.pop("searchTokens", None))]
+        # sort estable: a igual relevancia queda el orden por createdAt desc
+        hits.sort(key=lambda c: rank(c, tokens), reverse=True)
+        page = hits[offset:offset + limit]
+        next_cursor = str(offset + limit) if offset + limit < len(hits) else None
+        return page, next_cursor
 
     def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
         supplier_id, invoice_id = _parse_doc_id(doc_id)
         return self.get_invoice(supplier_id, invoice_id)
 
-    def update_status(self, doc_id: str, status: str, by_uid: Optional[str] = None):
+    def update_status(self, doc_id: str, status: str, by_uid: Optional[str] = None) -> bool:
         supplier_id, invoice_id = _parse_doc_id(doc_id)
-        self.update_invoice_status(supplier_id, invoice_id, status, by_uid=by_uid)
+        return self.update_invoice_status(supplier_id, invoice_id, status, by_uid=by_uid)
+
+    # ---------- Leases (dedup entre instancias) ----------
+    def _lease_ref(self, key: str):
+        # la clave bucket:name:generation puede traer "/": se usa su hash como id
+        return self.db.collection("leases").document(hashlib.sha256(key.encode()).hexdigest())
+
+    def claim_lease(self, key: str, owner: str, ttl_seconds: float, reuse_done: bool = True) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Reclama el procesamiento de `key` para `owner`.
+
+        Retorna ("acquired", None), ("running", None) si otra instancia tiene un lease
+        vigente, o ("done", resultado) si ya se procesó hace poco (con reuse_done).
+        """
+        ref = self._lease_ref(key)
+
+        @firestore.transactional
+        def _txn(transaction) -> Tuple[str, Optional[Dict[str, Any]]]:
+            now = datetime.now(timezone.utc)
+            snap = ref.get(transaction=transaction)
+            data = (snap.to_dict() or {}) if snap.exists else {}
+            alive = data.get("expiresAt") and data["expiresAt"] > now
+            if alive and data.get("status") == "done" and reuse_done:
+                return "done", data.get("result")
+            if alive and data.get("status") == "running" and data.get("owner") != owner:
+                return "running", None
+            transaction.set(ref, {
+                "key": key,
+                "owner": owner,
+                "status": "running",
+                "expiresAt": now + timedelta(seconds=ttl_seconds),
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
+            return "acquired", None
+
+        return _txn(self.db.transaction())
+
+    def complete_lease(self, key: str, owner: str, result: Dict[str, Any], ttl_seconds: float) -> None:
+        # el resultado queda un rato para responder a reentregas sin reprocesar
+        self._lease_ref(key).set({
+            "key": key,
+            "owner": owner,
+            "status": "done",
+            "result": result,
+            "expiresAt": datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds),
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        })
+
+    def release_lease(self, key: str, owner: str) -> None:
+        """Libera un lease propio tras un fallo, para que el reintento no espere al TTL."""
+        ref = self._lease_ref(key)
+        snap = ref.get()
+        if snap.exists and (snap.to_dict() or {}).get("owner") == owner:
+            ref.delete()
+
+    # ---------- Backfill (progreso reanudable) ----------
+    def _backfill_ref(self, job_id: str):
+        return self.db.collection("backfills").document(job_id)
+
+    def get_backfill(self, job_id: str) -> Optional[Dict[str, Any]]:
+        snap = self._backfill_ref(job_id).get()
+        return snap.to_dict() if snap.exists else None
+
+    def save_backfill(self, job_id: str, data: Dict[str, Any]) -> None:
+        self._backfill_ref(job_id).set(data, merge=True)
+
+    def list_backfill_chunks(self, job_id: str) -> List[Dict[str, Any]]:
+        docs = self._backfill_ref(job_id).collection("chunks").order_by("index").stream()
+        return [d.to_dict() for d in docs]
+
+    def save_backfill_chunk(self, job_id: str, index: int, data: Dict[str, Any]) -> None:
+        ref = self._backfill_ref(job_id).collection("chunks").document(f"{index:06d}")
+        ref.set(data | {"index": index}, merge=True)
+
+    # ---------- Jobs asíncronos (estado compartido entre instancias) ----------
+    def _job_ref(self, job_id: str):
+        return self.db.collection("jobs").document(job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        snap = self._job_ref(job_id).get()
+        return snap.to_dict() if snap.exists else None
+
+    def save_job(self, job_id: str, data: Dict[str, Any]) -> None:
+        self._job_ref(job_id).set(data, merge=True)
+
+    def list_jobs(self, statuses: List[str], updated_before: float, limit: int = 100) -> List[Dict[str, Any]]:
+        # requiere índice compuesto (status, updatedAt)
+        q = (self.db.collection("jobs")
+             .where("status", "in", list(statuses))
+             .where("updatedAt", "<", updated_before)
+             .order_by("updatedAt")
+             .limit(limit))
+        return [d.to_dict() for d in q.stream()]
 
     # ---------- Stats (usado por /invoices/stats/summary) ----------
-    def stats(self) -> Dict[str, Any]:
-        cg = self.db.collection_group(self.invoices_sub)
-        statuses = ["parsed", "observed", "approved", "paid"]
+    def _shards_ref(self, scope: str):
+        return self.db.collection("stats").document(scope).collection("shards")
+
+    @staticmethod
+    def _scope(supplier_id: Optional[str]) -> str:
+        return f"supplier_{supplier_id}" if supplier_id else "global"
+
+    def _increment_counters(self, writer, supplier_id: str, deltas: Dict[Optional[str], int]) -> None:
+        """Suma `deltas` en un shard al azar del scope global y del proveedor.
+
+        `writer` es el batch o la transacción en curso: los contadores se confirman
+        junto con la escritura de la factura.
+        """
+        for scope in (self._scope(None), self._scope(supplier_id)):
+            self._increment_scope(writer, scope, deltas)
+
+    def _increment_scope(self, writer, scope: str, deltas: Dict[Optional[str], int]) -> None:
+        payload = {k: firestore.Increment(v) for k, v in deltas.items() if k and v}
+        if payload:
+            shard = str(random.randrange(self.counter_shards))
+            writer.set(self._shards_ref(scope).document(shard), payload, merge=True)
+
+    def _count(self, query) -> int:
+        result = query.count(alias="n").get()
+        return int(result[0][0].value)
+
+    def _stats_from_aggregation(self, supplier_id: Optional[str] = None, supplier_uid: Optional[str] = None) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for s in STATUSES:
+            out[s] = self._count(self._invoices_base(supplier_uid=supplier_uid, status=s, supplier_id=supplier_id))
+        out["total"] = self._count(self._invoices_base(supplier_uid=supplier_uid, supplier_id=supplier_id))
+        return out
+
+    def _stats_from_counters(self, supplier_id: Optional[str] = None) -> Dict[str, int]:
+        out: Dict[str, int] = {s: 0 for s in STATUSES} | {"total": 0}
+        for shard in self._shards_ref(self._scope(supplier_id)).stream():
+            for k, v in (shard.to_dict() or {}).items():
+                out[k] = out.get(k, 0) + int(v or 0)
+        return out
+
+    def stats(self, supplier_id: Optional[str] = None, supplier_uid: Optional[str] = None) -> Dict[str, Any]:
+        """Conteo por estado, global o por proveedor (RUC) / uploader.
+
+        En modo "counters" lee solo los shards del scope; en modo "aggregate" (o al
+        filtrar por uid, que no tiene contadores) usa consultas count() sin límite.
+        """
+        if self.stats_mode == "counters" and not supplier_uid:
+            return self._stats_from_counters(supplier_id)
+        return self._stats_from_aggregation(supplier_id=supplier_id, supplier_uid=supplier_uid)
+
+    def rebuild_counters(self, supplier_ids: Optional[List[str]] = None) -> Dict[str, Dict[str, int]]:
+        """Recalcula los contadores con count() y los deja en el shard 0.
+
+        Para inicializar el modo "counters" sobre datos existentes; las escrituras
+        concurrentes durante el recálculo pueden perderse, conviene correrlo en una
+        ventana tranquila.
+        """
+        if supplier_ids is None:
+            supplier_ids = [ref.id for ref in self.db.collection(self.suppliers_coll).list_documents()]
+        out: Dict[str, Dict[str, int]] = {}
+        for supplier_id in [None, *supplier_ids]:
+            counts = self._stats_from_aggregation(supplier_id=supplier_id)
+            scope = self._scope(supplier_id)
+            batch = self.db.batch()
+            for n in range(self.counter_shards):
+                ref = self._shards_ref(scope).document(str(n))
+                if n == 0:
+                    batch.set(ref, counts)
+                else:
+                    batch.delete(ref)
+            batch.commit()
+            out[scope] = counts
+        return out
+
+    # ---------- Rollups mensuales por proveedor (usado por /invoices/rollups) ----------
+    def _rollups_coll(self, supplier_id: str):
+        return self.db.collection(self.suppliers_coll).document(supplier_id).collection(self.rollups_sub)
+
+    @staticmethod
+    def _rollup_totals(groups: Dict[Tuple[str, str], Counter], value=lambda v: v) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        # {(moneda, estado): Counter} -> {moneda: {estado: {count, totalCents, ...}}}
+        totals: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(dict)
+        for (currency, status), delta in groups.items():
+            fields = {k: value(v) for k, v in delta.items() if v}
+            if fields:
+                totals[currency][status] = fields
+        return dict(totals)
+
+    def _write_rollups(self, writer, supplier_id: str, acc: Dict[str, Dict[Tuple[str, str], Counter]]) -> None:
+        """Aplica los deltas con Increment: un set(merge=True) por mes afectado.
+
+        `writer` es el batch o la transacción de la factura, así el rollup se confirma
+        en el mismo commit. Un delta neto cero (re-extracción sin cambios) no escribe.
+        """
+        for period, groups in acc.items():
+            totals = self._rollup_totals(groups, firestore.Increment)
+            if totals:
+                writer.set(self._rollups_coll(supplier_id).document(period), {
+                    "supplierId": supplier_id,
+                    "period": period,
+                    "totals": totals,
+                    "updatedAt": firestore.SERVER_TIMESTAMP,
+                }, merge=True)
+
+    def get_rollups(self, supplier_id: str, period_from: Optional[str] = None, period_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Rollups de un proveedor entre dos meses 'aaaa-mm' (ambos inclusive), en orden."""
+        query = self._rollups_coll(supplier_id)
+        if period_from:
+            query = query.where("period", ">=", period_from)
+        if period_to:
+            query = query.where("period", "<=", period_to)
+        return [d.to_dict() for d in query.order_by("period").stream()]
+
+    def is_uploader_of(self, supplier_id: str, uid: str) -> bool:
+        """True si `uid` subió alguna factura de ese RUC (acceso de proveedor a sus rollups)."""
+        query = (self.db.collection(self.suppliers_coll)
+                    .document(supplier_id)
+                    .collection(self.invoices_sub)
+                    .where("supplierUid", "==", uid)
+                    .limit(1))
+        return any(True for _ in query.stream())
+
+    def rebuild_rollups(self, supplier_ids: Optional[List[str]] = None, chunk_size: int = 400) -> Dict[str, int]:
+        """Recalcula los rollups de cada proveedor recorriendo sus facturas.
+
+        Las facturas anteriores a los campos tipados los reciben aquí (parseando sus
+        textos), para que los cambios de estado posteriores muevan su aporte. Como
+        rebuild_counters, conviene correrlo en una ventana sin escrituras.
+        Retorna {supplierId: facturas recorridas}.
+        """
+        if supplier_ids is None:
+            supplier_ids = [ref.id for ref in self.db.collection(self.suppliers_coll).list_documents()]
         out: Dict[str, int] = {}
-        for s in statuses:
-            out[s] = len(list(cg.where("status", "==", s).limit(1000).stream()))
-        out["total"] = len(list(cg.limit(1000).stream()))
+        for supplier_id in supplier_ids:
+            acc = _rollup_acc()
+            seen = 0
+            batch, pending = self.db.batch(), 0
+            for rows in self.iter_invoices(supplier_id=supplier_id, fields=ROLLUP_SOURCE_FIELDS):
+                for row in rows:
+                    seen += 1
+                    if "amounts" not in row:
+                        typed = typed_fields(row.get("total"), row.get("totalTax"), row.get("netAmount"),
+                                             row.get("currency"), row.get("issueDate"), row.get("dueDate"))
+                        batch.update(self._inv_ref(supplier_id, row["id"]), typed | {"updatedAt": firestore.SERVER_TIMESTAMP})
+                        invoice_cache.pop(f"{supplier_id}/{row['id']}")
+                        row = row | typed
+                        pending += 1
+                        if pending >= chunk_size:
+                            batch.commit()
+                            batch, pending = self.db.batch(), 0
+                    _add_rollup(acc, row, 1)
+            if pending:
+                batch.commit()
+
+            # reemplaza los documentos (sin merge) y borra los meses que ya no tienen facturas
+            batch = self.db.batch()
+            for period, groups in acc.items():
+                batch.set(self._rollups_coll(supplier_id).document(period), {
+                    "supplierId": supplier_id,
+                    "period": period,
+                    "totals": self._rollup_totals(groups),
+                    "updatedAt": firestore.SERVER_TIMESTAMP,
+                })
+            for ref in self._rollups_coll(supplier_id).list_documents():
+                if ref.id not in acc:
+                    batch.delete(ref)
+            batch.commit()
+            out[supplier_id] = seen
         return out
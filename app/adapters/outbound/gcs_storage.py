@@ -1,21 +1,52 @@
+from typing import Iterator, Optional
 from google.cloud import storage
-from pathlib import Path
-import tempfile
+
+from app.domain.models import ObjectInfo
+
+def _object_info(bucket: str, blob) -> ObjectInfo:
+    return ObjectInfo(
+        bucket=bucket,
+        name=blob.name,
+        size=int(blob.size or 0),
+        generation=str(blob.generation) if blob.generation else None,
+        crc32c=blob.crc32c,
+        md5_hash=blob.md5_hash,
+        content_type=blob.content_type,
+    )
 
 class GCSStorage:
-    def __init__(self):
-        self.client = storage.Client()
-        # obtiene un directorio temporal que sí existe en Windows y Linux
-        self.tmp_dir = Path(tempfile.gettempdir())
-
-    def download_to_tmp(self, bucket: str, name: str) -> Path:
-        """Descarga el archivo al directorio temporal compatible con cualquier SO"""
-        bucket_obj = self.client.bucket(bucket)
-        blob = bucket_obj.blob(name)
-        tmp_path = self.tmp_dir / Path(name).name
-        tmp_path.parent.mkdir(parents=True, exist_ok=True)
-        blob.download_to_filename(str(tmp_path))
-        return tmp_path
+    def __init__(self, client: Optional[storage.Client] = None):
+        self.client = client or storage.Client()
+
+    def stat(self, bucket: str, name: str) -> ObjectInfo:
+        """Lee solo los metadatos del objeto (tamaño, hashes, generación)."""
+        blob = self.client.bucket(bucket).get_blob(name)
+        if blob is None:
+            raise FileNotFoundError(f"No existe gs://{bucket}/{name}")
+        return _object_info(bucket, blob)
+
+    def list_objects(self, bucket: str, prefix: str = "") -> Iterator[ObjectInfo]:
+        """Itera los objetos bajo un prefijo (paginado por la librería)."""
+        for blob in self.client.list_blobs(bucket, prefix=prefix or None):
+            yield _object_info(bucket, blob)
+
+    def download_bytes(self, bucket: str, name: str, max_bytes: Optional[int] = None) -> bytes:
+        """Descarga el objeto directo a memoria, sin pasar por /tmp.
+
+        Si `max_bytes` está definido y el objeto lo supera, falla antes de descargar.
+        """
+        blob = self.client.bucket(bucket).blob(name)
+        if max_bytes is not None:
+            blob.reload()
+            if (blob.size or 0) > max_bytes:
+                raise ValueError(f"gs://{bucket}/{name} supera {max_bytes} bytes")
+        return blob.download_as_bytes()
+
+    def upload_bytes(self, bucket: str, name: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        self.client.bucket(bucket).blob(name).upload_from_string(data, content_type=content_type)
+
+    def delete(self, bucket: str, name: str) -> None:
+        self.client.bucket(bucket).blob(name).delete()
 
     def gcs_uri(self, bucket: str, name: str) -> str:
         """Retorna la URI gs:// completa (si solo necesitas la ruta lógica)"""
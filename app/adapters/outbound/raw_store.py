@@ -0,0 +1,50 @@
+import gzip
+import json
+from typing import Any, Dict, Tuple
+from uuid import uuid4
+
+from google.api_core.exceptions import NotFound
+
+from app.adapters.outbound.gcs_storage import GCSStorage
+from app.domain.models import InvoiceExtraction
+
+def _split_gs_uri(uri: str) -> Tuple[str, str]:
+    rest = uri[5:] if uri.startswith("gs://") else uri
+    bucket, _, name = rest.partition("/")
+    return bucket, name
+
+class GCSRawStore:
+    """Guarda la extracción cruda de DocAI como JSON gzip en GCS, fuera del documento.
+
+    La factura solo lleva `raw = {ref, entityCount, sizeBytes, schemaVersion}`; el
+    contenido se lee bajo demanda con `get(ref)`.
+    """
+
+    def __init__(self, storage: GCSStorage, bucket: str, prefix: str):
+        self.storage = storage
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/") + "/"
+
+    def put(self, supplier_id: str, invoice_id: str, version: str, extraction: InvoiceExtraction) -> Dict[str, Any]:
+        # nombre único por escritura: un duplicado o reproceso de la misma generación no
+        # pisa el blob al que apunta la factura guardada, y borrar el propio es seguro
+        name = f"{self.prefix}{supplier_id}/{invoice_id}/{version}-{uuid4().hex}.json.gz"
+        data = gzip.compress(json.dumps(extraction.to_dict(), separators=(",", ":")).encode())
+        self.storage.upload_bytes(self.bucket, name, data, content_type="application/gzip")
+        return {
+            "ref": f"gs://{self.bucket}/{name}",
+            "entityCount": len(extraction.entities),
+            "sizeBytes": len(data),
+            "schemaVersion": extraction.schema_version,
+        }
+
+    def get(self, ref: str) -> Dict[str, Any]:
+        bucket, name = _split_gs_uri(ref)
+        return json.loads(gzip.decompress(self.storage.download_bytes(bucket, name)))
+
+    def delete(self, ref: str) -> None:
+        bucket, name = _split_gs_uri(ref)
+        try:
+            self.storage.delete(bucket, name)
+        except NotFound:
+            pass
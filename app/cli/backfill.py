@@ -0,0 +1,35 @@
+"""Backfill por línea de comandos.
+
+    python -m app.cli.backfill --prefix uploads/20240101      # nuevo job
+    python -m app.cli.backfill --resume <jobId>               # retoma uno existente
+"""
+import argparse
+import dataclasses
+import json
+
+from app.config import settings
+from app.registry import registry
+from app.shared.logging import setup_logging
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Re-extrae PDFs de GCS con DocAI batch")
+    parser.add_argument("--bucket", default=settings.GCS_BUCKET)
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--job-id", default=None, help="id explícito para el job nuevo")
+    parser.add_argument("--resume", default=None, metavar="JOB_ID", help="retoma un job existente")
+    parser.add_argument("--chunk-size", type=int, default=settings.BACKFILL_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    backfill = dataclasses.replace(registry.backfill, chunk_size=args.chunk_size)
+
+    job_id = args.resume or backfill.start(args.bucket, args.prefix, job_id=args.job_id)
+    try:
+        summary = backfill.run(job_id)
+    finally:
+        registry.close()
+    print(json.dumps(summary | {"jobId": job_id}, default=str, indent=2))
+    return 0 if summary.get("status") == "done" else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -7,10 +7,105 @@ class Settings(BaseSettings):
     GOOGLE_CLOUD_PROJECT: str
     GOOGLE_CLOUD_REGION: str = "us"
     DOCAI_PROCESSOR_ID: str
+    DOCAI_PROCESSOR_VERSION: str = ""         # vacío = versión por defecto del procesador
+    DOCAI_SPLIT_PAGES: int = 0                # >0: partir PDFs con más páginas en rangos de este tamaño
+    DOCAI_SPLIT_FANOUT: int = 4               # rangos procesados a la vez por factura
+    # limitador por procesador (por instancia): tasa máxima, ráfaga, piso al recibir 429
+    DOCAI_RATE_LIMIT_RPS: float = 5.0         # 0 = sin limitador
+    DOCAI_RATE_BURST: float = 5.0
+    DOCAI_RATE_MIN_RPS: float = 0.5
+    DOCAI_RATE_MAX_WAIT: float = 30.0         # más espera que esto = 503 + Retry-After
+    DOCAI_MAX_ATTEMPTS: int = 4
+    DOCAI_BACKOFF_SECONDS: float = 1.0
     GCS_BUCKET: str
     APP_ENV: str = "dev"
     FIRESTORE_COLL: str = "invoices"
 
+    # ---- Arranque: construir clientes en el lifespan en vez de en la primera request ----
+    WARM_ON_STARTUP: bool = False
+
+    # ---- Procesamiento de facturas (pool acotado fuera del event loop) ----
+    PROCESS_WORKERS: int = 8
+    PROCESS_QUEUE_MAX: int = 32
+    PROCESS_RETRY_AFTER: int = 5
+    BULK_REPROCESS_CONCURRENCY: int = 4
+    # timeouts por etapa del pipeline de run (0 = sin límite); el snapshot es opcional
+    STAGE_TIMEOUT_SNAPSHOT: float = 5.0
+    STAGE_TIMEOUT_EXTRACT: float = 240.0      # menor que LEASE_TTL_SECONDS
+    STAGE_TIMEOUT_PERSIST: float = 60.0
+
+    # ---- Export en streaming (/invoices/export) ----
+    EXPORT_PAGE_SIZE: int = 500
+
+    # ---- Caché de documentos de factura (get_invoice) ----
+    INVOICE_CACHE_SIZE: int = 5000
+    INVOICE_CACHE_TTL: int = 30
+    INVOICE_CACHE_LISTEN: bool = False     # on_snapshot: coherencia entre instancias
+    INVOICE_CACHE_LISTEN_WINDOW: int = 300 # el listener se reabre con ventana nueva cada N s
+
+    # ---- Entregas duplicadas: single-flight local + lease en Firestore entre instancias ----
+    COALESCE_ENABLED: bool = True
+    LEASE_ENABLED: bool = True
+    LEASE_TTL_SECONDS: int = 300           # debe cubrir una extracción completa
+    LEASE_DONE_TTL_SECONDS: int = 600      # ventana en la que una reentrega reusa el resultado
+
+    # ---- Jobs asíncronos (?async=true en from-upload / reprocess) ----
+    JOBS_STORE: str = "firestore"          # "firestore" (compartido) | "memory" (una instancia / local)
+    JOBS_WORKERS: int = 4
+    JOBS_MAX_ATTEMPTS: int = 3
+    JOBS_BACKOFF_SECONDS: float = 2.0
+    JOBS_STUCK_SECONDS: int = 900          # sin cambios en este tiempo = atascado
+    JOBS_SSE_POLL_SECONDS: float = 1.0
+
+    # ---- Descarga de PDFs: en memoria hasta el límite; los mayores se rechazan (413) ----
+    DOC_INMEM_MAX_BYTES: int = 20 * 1024 * 1024   # no subir de 20 MB: límite de DocAI online
+
+    # ---- Admisión por memoria: reserva base + tamaño*factor antes de descargar ----
+    MEMORY_BUDGET_BYTES: int = 256 * 1024 * 1024     # 0 = sin control (instancia de 512Mi)
+    MEMORY_BASE_BYTES: int = 8 * 1024 * 1024
+    MEMORY_SIZE_FACTOR: float = 6.0                  # PDF + request + respuesta con texto/layout
+    MEMORY_LARGE_OBJECT_BYTES: int = 10 * 1024 * 1024
+    MEMORY_LARGE_CONCURRENCY: int = 1                # PDFs grandes a la vez
+    MEMORY_MAX_WAIT_SECONDS: float = 20.0            # luego 503 + Retry-After
+
+    # ---- Caché de extracciones (hash del PDF + procesador/versión) ----
+    EXTRACTION_CACHE_ENABLED: bool = True
+    EXTRACTION_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    EXTRACTION_CACHE_MEM_ITEMS: int = 256
+
+    # ---- Caché de auth: tokens verificados y snapshots de usuario (roles) ----
+    AUTH_TOKEN_CACHE_SIZE: int = 4096
+    AUTH_TOKEN_CACHE_TTL: float = 300.0
+    USER_CACHE_SIZE: int = 2048
+    USER_CACHE_TTL: float = 60.0
+
+    # ---- Entidades crudas de DocAI fuera del documento (gzip JSON en GCS) ----
+    RAW_OFFLOAD_ENABLED: bool = True
+    RAW_BUCKET: str = ""                      # vacío = GCS_BUCKET; se guarda bajo SYSTEM_PREFIX/raw/
+
+    # ---- URLs firmadas de GCS ----
+    SIGNED_URL_CACHE_SIZE: int = 4096
+    SIGNED_URL_REFRESH_MARGIN: int = 120      # segundos antes de vencer en que se refirma
+
+    # ---- Stats: "aggregate" (count()) o "counters" (contadores fragmentados) ----
+    STATS_MODE: str = "aggregate"
+    STATS_COUNTER_SHARDS: int = 10
+
+    # ---- Rollups mensuales por proveedor (suppliers/{id}/rollups/{aaaa-mm}) ----
+    ROLLUPS_ENABLED: bool = True
+
+    # ---- Búsqueda por prefijo (searchTokens): candidatos por consulta antes de rankear ----
+    SEARCH_MAX_CANDIDATES: int = 200
+
+    # ---- Objetos internos del backend en el bucket (Eventarc los ignora) ----
+    SYSTEM_PREFIX: str = "_system/"
+
+    # ---- Backfill con DocAI batch ----
+    BACKFILL_OUTPUT_BUCKET: str = ""          # vacío = GCS_BUCKET
+    BACKFILL_CHUNK_SIZE: int = 50
+    BACKFILL_MAX_IN_FLIGHT: int = 4
+    BACKFILL_POLL_SECONDS: float = 15.0
+
     # ---- Aliases convenientes para el resto del código ----
     @property
     def project_id(self) -> str:
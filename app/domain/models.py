@@ -1,18 +1,103 @@
-from dataclasses import dataclass, field
-from typing import List, Optional
-from pydantic import BaseModel
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field
+
+# Versión del formato de InvoiceExtraction (forma parte de la clave de caché)
+EXTRACTION_SCHEMA_VERSION = "1.2"
 
 @dataclass
 class Entity:
     type: str
     text: str
     confidence: float
+    # sub-entidades (p. ej. line_item/description, line_item/amount)
+    properties: List["Entity"] = field(default_factory=list)
+    # página del PDF original (0-based) donde aparece; None si DocAI no la informa
+    page: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Entity":
+        return cls(
+            type=data["type"],
+            text=data.get("text", ""),
+            confidence=float(data.get("confidence", 0.0)),
+            properties=[cls.from_dict(p) for p in data.get("properties", [])],
+            page=data.get("page"),
+        )
+
+class LineItem:
+    """Ítem de detalle compacto (sin __dict__: cientos por factura grande)."""
+    __slots__ = ("description", "quantity", "unit", "unit_price", "amount", "product_code", "confidence", "page")
+
+    # line_item/<campo> de DocAI -> atributo
+    _FIELDS = {
+        "description": "description",
+        "quantity": "quantity",
+        "unit": "unit",
+        "unit_price": "unit_price",
+        "amount": "amount",
+        "product_code": "product_code",
+    }
+
+    def __init__(self, description=None, quantity=None, unit=None, unit_price=None,
+                 amount=None, product_code=None, confidence=0.0, page=None):
+        self.description = description
+        self.quantity = quantity
+        self.unit = unit
+        self.unit_price = unit_price
+        self.amount = amount
+        self.product_code = product_code
+        self.confidence = confidence
+        self.page = page
+
+    @classmethod
+    def from_entity(cls, entity: Entity) -> "LineItem":
+        item = cls(description=entity.text or None, confidence=entity.confidence, page=entity.page)
+        best: Dict[str, float] = {}
+        for prop in entity.properties:
+            attr = cls._FIELDS.get(prop.type.rsplit("/", 1)[-1])
+            if attr and prop.text and prop.confidence >= best.get(attr, -1.0):
+                best[attr] = prop.confidence
+                setattr(item, attr, prop.text)
+        return item
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__ if getattr(self, k) is not None}
 
 @dataclass
 class InvoiceExtraction:
     entities: List[Entity] = field(default_factory=list)
     schema_version: str = "1.0"
 
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "InvoiceExtraction":
+        return cls(
+            entities=[Entity.from_dict(e) for e in data.get("entities", [])],
+            schema_version=data.get("schema_version", "1.0"),
+        )
+
+@dataclass
+class ObjectInfo:
+    """Metadatos de un objeto GCS (sin descargar el contenido)."""
+    bucket: str
+    name: str
+    size: int
+    generation: Optional[str] = None
+    crc32c: Optional[str] = None
+    md5_hash: Optional[str] = None
+    content_type: Optional[str] = None
+
+@dataclass
+class BatchResult:
+    """Estado de una operación batch de DocAI: uri de entrada -> prefijo de salida."""
+    done: bool
+    error: Optional[str] = None
+    outputs: Dict[str, str] = field(default_factory=dict)
+    failures: Dict[str, str] = field(default_factory=dict)
+
 class GcsEventData(BaseModel):
     bucket: str
     name: str
@@ -42,6 +127,19 @@ class InvoiceDTO(BaseModel):
     supplierName: Optional[str] = None
     supplierAddress: Optional[str] = None
 
+    # valores tipados (None en facturas anteriores a su introducción)
+    amounts: Optional[Dict[str, Optional[float]]] = None
+    currencyCode: Optional[str] = None
+    period: Optional[str] = None
+
 
 class StatusUpdate(BaseModel):
     status: str
+
+class BulkStatusUpdate(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=500)   # "supplierId/invoiceId"
+    status: str
+
+class BulkReprocess(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=100)
+    force: bool = False
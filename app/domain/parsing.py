@@ -0,0 +1,155 @@
+"""Conversión de textos de DocAI a valores tipados (montos, fechas, moneda).
+
+DocAI devuelve el texto tal como aparece en el PDF ("S/ 1,234.50", "15/01/2025",
+"SOLES"); aquí se normaliza para poder sumar y agrupar en Firestore. Todas las
+funciones retornan None si no reconocen el valor: nunca lanzan.
+"""
+import re
+import unicodedata
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Optional
+
+# símbolo/palabra -> código ISO 4217
+_CURRENCIES = {
+    "PEN": "PEN", "S/": "PEN", "S/.": "PEN", "SOL": "PEN", "SOLES": "PEN", "NUEVOS SOLES": "PEN",
+    "USD": "USD", "US$": "USD", "$": "USD", "DOLAR": "USD", "DOLARES": "USD", "DOLARES AMERICANOS": "USD",
+    "DOLLAR": "USD", "DOLLARS": "USD", "US DOLLAR": "USD", "US DOLLARS": "USD",
+    "EUR": "EUR", "€": "EUR", "EURO": "EUR", "EUROS": "EUR",
+}
+
+_MONTHS = {
+    "ene": 1, "feb": 2, "mar": 3, "abr": 4, "may": 5, "jun": 6,
+    "jul": 7, "ago": 8, "set": 9, "sep": 9, "oct": 10, "nov": 11, "dic": 12,
+    # abreviaturas en inglés que no coinciden con las españolas
+    "jan": 1, "apr": 4, "aug": 8, "dec": 12,
+}
+
+# símbolos de moneda pegados al número ("S/.1,234.50"): su punto no es decimal
+_CURRENCY_SYMBOL_RE = re.compile(r"S/\.?|US\$|\$|€", re.IGNORECASE)
+_AMOUNT_RE = re.compile(r"[-(]?[.,]?\d[\d.,\s]*")
+_NUMERIC_DATE_RE = re.compile(r"(\d{1,4})[/.\-](\d{1,2})[/.\-](\d{1,4})")
+_TEXT_DATE_RE = re.compile(r"(\d{1,2})\s*(?:de\s+|[-/.\s])?([a-z]{3})[a-z]*\.?\s*(?:de(?:l)?\s+|[-/.\s])?(\d{4})")
+# mes primero: "Enero 15, 2025", "Jan 15 2025"
+_MONTH_FIRST_RE = re.compile(r"([a-z]{3})[a-z]*\.?\s+(\d{1,2}),?\s+(?:de(?:l)?\s+)?(\d{4})")
+
+def _strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+def parse_currency(text: Optional[str]) -> Optional[str]:
+    """"S/", "SOLES", "PEN" -> "PEN"; "US$", "DOLARES" -> "USD". None si no se reconoce."""
+    if not text:
+        return None
+    key = _strip_accents(text).upper().strip().rstrip(".")
+    if key in _CURRENCIES:
+        return _CURRENCIES[key]
+    # moneda incrustada en un monto: "S/ 1,234.50", "USD 20"
+    for token in sorted(_CURRENCIES, key=len, reverse=True):
+        if key.startswith(token):
+            return _CURRENCIES[token]
+    return None
+
+def parse_amount(text: Optional[str]) -> Optional[Decimal]:
+    """Monto de factura a Decimal (2 decimales).
+
+    Acepta separador decimal "." o "," ("1,234.50", "1.234,50", "1234,5"), símbolo de
+    moneda y negativos con "-" o paréntesis. Un separador único seguido de 3 dígitos
+    se toma como de miles ("1,234" = 1234).
+    """
+    if not text:
+        return None
+    cleaned = _CURRENCY_SYMBOL_RE.sub(" ", text.replace("\u00a0", " "))
+    match = _AMOUNT_RE.search(cleaned)
+    if not match:
+        return None
+    raw = match.group(0).strip()
+    # el signo puede quedar antes del símbolo de moneda: "-S/ 100", "(S/ 100)"
+    sign = (cleaned[:match.start()].strip()[-1:] or raw[:1])
+    negative = sign == "-" or raw.startswith("-") or (sign == "(" or raw.startswith("(")) and ")" in text
+    digits = re.sub(r"[^\d.,]", "", raw)
+    if not digits:
+        return None
+
+    last_dot, last_comma = digits.rfind("."), digits.rfind(",")
+    if last_dot >= 0 and last_comma >= 0:
+        decimal_sep = "." if last_dot > last_comma else ","
+    elif last_dot >= 0 or last_comma >= 0:
+        sep = "." if last_dot >= 0 else ","
+        tail = digits.rpartition(sep)[2]
+        # "1,234" / "1.234.567": separador de miles; "1234,5" / "12.50": decimal
+        decimal_sep = None if digits.count(sep) > 1 or len(tail) == 3 else sep
+    else:
+        decimal_sep = None
+
+    if decimal_sep:
+        thousands = "," if decimal_sep == "." else "."
+        normalized = digits.replace(thousands, "").replace(decimal_sep, ".")
+    else:
+        normalized = digits.replace(",", "").replace(".", "")
+    try:
+        value = Decimal(normalized).quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None
+    return -value if negative else value
+
+def _safe_date(year: int, month: int, day: int) -> Optional[date]:
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def parse_date(text: Optional[str]) -> Optional[date]:
+    """Fecha de emisión/vencimiento.
+
+    Numéricas con día primero (dd/mm/aaaa) salvo ISO (aaaa-mm-dd); si el segundo
+    número no puede ser mes (01/15/2025) se toma como mm/dd/aaaa. También con el
+    nombre del mes antes o después del día ("15 de enero de 2025", "Enero 15, 2025").
+    """
+    if not text:
+        return None
+    value = _strip_accents(text).lower().strip()
+    match = _NUMERIC_DATE_RE.search(value)
+    if match:
+        a, b, c = match.groups()
+        if len(a) == 4:
+            return _safe_date(int(a), int(b), int(c))
+        if int(b) > 12 >= int(a):
+            return _safe_date(int(c), int(a), int(b))
+        return _safe_date(int(c), int(b), int(a))
+    match = _TEXT_DATE_RE.search(value)
+    if match and match.group(2) in _MONTHS:
+        return _safe_date(int(match.group(3)), _MONTHS[match.group(2)], int(match.group(1)))
+    match = _MONTH_FIRST_RE.search(value)
+    if match and match.group(1) in _MONTHS:
+        return _safe_date(int(match.group(3)), _MONTHS[match.group(1)], int(match.group(2)))
+    return None
+
+def to_timestamp(d: Optional[date]) -> Optional[datetime]:
+    """Firestore no guarda `date`: medianoche UTC."""
+    return datetime(d.year, d.month, d.day, tzinfo=timezone.utc) if d else None
+
+def typed_fields(
+    total: Optional[str],
+    total_tax: Optional[str],
+    net_amount: Optional[str],
+    currency: Optional[str],
+    issue_date: Optional[str],
+    due_date: Optional[str],
+) -> Dict[str, Any]:
+    """Campos tipados de una factura a partir de los textos de DocAI.
+
+    `period` (aaaa-mm de la emisión) agrupa los rollups mensuales; es None si no hay
+    fecha de emisión legible y entonces la factura no suma en ningún rollup.
+    """
+    issued = parse_date(issue_date)
+    amounts = {k: parse_amount(v) for k, v in (("total", total), ("totalTax", total_tax), ("netAmount", net_amount))}
+    code = parse_currency(currency) or parse_currency(total) or parse_currency(net_amount)
+    return {
+        "amounts": {k: float(v) if v is not None else None for k, v in amounts.items()},
+        "currencyCode": code,
+        "issuedAt": to_timestamp(issued),
+        "dueAt": to_timestamp(parse_date(due_date)),
+        "period": issued.strftime("%Y-%m") if issued else None,
+    }
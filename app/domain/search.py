@@ -0,0 +1,76 @@
+"""Tokens de búsqueda por prefijo para facturas (proveedor, RUC, número).
+
+Firestore no tiene búsqueda por prefijo ni texto libre: cada factura guarda en
+`searchTokens` los prefijos normalizados de sus campos buscables y una consulta
+`array_contains` con un token de la búsqueda trae los candidatos por índice.
+"""
+import re
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional
+
+MIN_PREFIX = 2
+MAX_PREFIX = 20
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+def normalize(text: Optional[str]) -> str:
+    """Minúsculas, sin tildes, solo [a-z0-9] separados por un espacio."""
+    if not text:
+        return ""
+    plain = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(" ", plain.lower()).strip()
+
+def _prefixes(word: str, start: int = MIN_PREFIX) -> Iterable[str]:
+    return (word[:n] for n in range(start, min(len(word), MAX_PREFIX) + 1))
+
+def _invoice_parts(invoice_id: Optional[str]) -> List[str]:
+    # "F001-00012345" -> ["f00100012345", "f001", "00012345", "12345"]
+    words = normalize(invoice_id).split()
+    parts = ["".join(words), *words]
+    parts += [w.lstrip("0") for w in words if w.isdigit() and w.lstrip("0")]
+    return list(dict.fromkeys(p for p in parts if p))
+
+def search_tokens(supplier_id: Optional[str], invoice_id: Optional[str], supplier_name: Optional[str]) -> List[str]:
+    """Prefijos (2..20 caracteres) de cada palabra del proveedor, del RUC y del número."""
+    tokens: Dict[str, None] = {}
+    for word in normalize(supplier_name).split():
+        tokens.update(dict.fromkeys(_prefixes(word)))
+    ruc = "".join(normalize(supplier_id).split())
+    if ruc and ruc != "unknown":
+        # un RUC tiene 11 dígitos: prefijos desde 3 para no indexar "10"/"20" en todas
+        tokens.update(dict.fromkeys(_prefixes(ruc, start=3)))
+    for part in _invoice_parts(invoice_id):
+        tokens.update(dict.fromkeys(_prefixes(part, start=1 if part.isdigit() else MIN_PREFIX)))
+    return list(tokens)
+
+def query_tokens(q: str) -> List[str]:
+    """Palabras de la búsqueda, recortadas a MAX_PREFIX (lo más largo que se indexa)."""
+    words = [w[:MAX_PREFIX] for w in normalize(q).split() if len(w) >= MIN_PREFIX or w.isdigit()]
+    return list(dict.fromkeys(words))
+
+def matches(tokens: List[str], doc_tokens: Iterable[str]) -> bool:
+    have = set(doc_tokens or ())
+    return all(t in have for t in tokens)
+
+def rank(doc: Dict[str, Any], tokens: List[str]) -> int:
+    """Relevancia: número exacto > RUC exacto > prefijo de número/RUC > palabras del nombre."""
+    score = 0
+    invoice = _invoice_parts(doc.get("invoiceId"))
+    ruc = "".join(normalize(doc.get("supplierId")).split())
+    name = normalize(doc.get("supplierName")).split()
+    compact = "".join(tokens)
+    if invoice and compact == invoice[0]:
+        score += 100
+    if ruc and compact == ruc:
+        score += 80
+    for t in tokens:
+        if t in invoice:
+            score += 20
+        elif any(p.startswith(t) for p in invoice):
+            score += 10
+        if ruc.startswith(t):
+            score += 15
+        if t in name:
+            score += 8
+        elif any(w.startswith(t) for w in name):
+            score += 4
+    return score
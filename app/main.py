@@ -1,24 +1,43 @@
+from app.shared.startup import timer as startup_timer  # primero: marca el inicio del import
+
 import logging
+import time
+from contextlib import asynccontextmanager
 from typing import Dict, Any, Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from app.config import settings
 from app.domain.models import GcsEvent
+from app.registry import registry
+from app.shared.errors import DocumentTooLargeError, InProgressError, OverloadedError
 from app.shared.logging import setup_logging
-from app.usecases.process_invoice import ProcessInvoiceUseCase
-from app.adapters.outbound.gcs_storage import GCSStorage
-from app.adapters.outbound.docai_invoice import DocAIInvoiceExtractor
-from app.adapters.outbound.firestore_repo import FirestoreRepo
+from app.shared.auth import token_cache
+from app.shared.metrics import http_errors, http_in_flight, http_requests, metrics
+from app.adapters.outbound.firestore_repo import invoice_cache, user_cache
 from app.routers import invoices as invoices_router
 from app.routers import storage as storage_router
+from app.routers import admin as admin_router
+from app.routers import jobs as jobs_router
+from app.routers.storage import url_cache
 
 setup_logging()
 log = logging.getLogger("invoices")
 
-app = FastAPI(title="Invoices Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # los clientes se crean al primer uso; WARM_ON_STARTUP los adelanta (p. ej. con min-instances)
+    if settings.WARM_ON_STARTUP:
+        registry.warm()
+    yield
+    registry.close()
+
+app = FastAPI(title="Invoices Backend", lifespan=lifespan)
 app.include_router(invoices_router.router)
 app.include_router(storage_router.router)  
+app.include_router(admin_router.router)
+app.include_router(jobs_router.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -26,17 +45,106 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-usecase = ProcessInvoiceUseCase(
-    storage=GCSStorage(),
-    extractor=DocAIInvoiceExtractor(),
-    repository=FirestoreRepo(),
-)
+@app.middleware("http")
+async def first_request_timer(request: Request, call_next):
+    response = await call_next(request)
+    if startup_timer.first_request_s is None:
+        startup_timer.mark_first_request(request.url.path)
+    return response
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        with http_in_flight.track():
+            response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # plantilla de la ruta (no la URL concreta) para no disparar la cardinalidad
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        http_requests.observe(time.perf_counter() - start, route=route, method=request.method)
+        if status >= 400:
+            http_errors.inc(route=route, method=request.method, status=status)
+
+def _cache_samples():
+    caches = {"tokens": token_cache, "users": user_cache, "invoices": invoice_cache, "signed_urls": url_cache}
+    extraction = registry.peek("extraction_cache")
+    if extraction:
+        caches["extraction"] = extraction
+    for cache_name, cache in caches.items():
+        for stat, value in cache.stats().items():
+            yield {"cache": cache_name, "stat": stat}, value
+
+def _pool_samples():
+    # peek: exportar métricas no debe construir el pool ni los clientes
+    pool = registry.peek("processing_pool")
+    if pool is not None:
+        yield {}, pool.in_flight
+
+def _job_samples():
+    jobs = registry.peek("jobs")
+    if jobs is not None:
+        yield {"state": "queued"}, jobs.queue.size()
+        yield {"state": "running"}, jobs.running
+
+def _admission_samples():
+    admission = registry.peek("admission")
+    if admission:
+        yield {"state": "reserved"}, admission.reserved
+        yield {"state": "budget"}, admission.budget_bytes
+
+def _admission_waiting_samples():
+    admission = registry.peek("admission")
+    if admission:
+        yield {}, admission.waiting
+
+def _docai_rate_samples():
+    limiter = getattr(registry.peek("extractor"), "limiter", None)
+    if limiter is not None:
+        yield {}, limiter.rate
+
+metrics.gauge("memory_reserved_bytes", "Memoria estimada reservada por facturas en proceso / presupuesto", fn=_admission_samples)
+metrics.gauge("memory_admission_waiting", "Facturas esperando memoria antes de descargar el PDF", fn=_admission_waiting_samples)
+metrics.gauge("docai_limiter_rate", "Tasa actual (req/s) permitida hacia DocAI tras AIMD", fn=_docai_rate_samples)
+metrics.gauge("jobs_local", "Jobs asíncronos de esta instancia (en cola / ejecutándose)", fn=_job_samples)
+metrics.gauge("cache_stats", "Contadores y tamaño de las cachés en proceso", fn=_cache_samples)
+metrics.gauge("processing_in_flight", "Facturas en el pool de procesamiento (en curso + en cola)", fn=_pool_samples)
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    # 503 (o 429 si es cuota de DocAI) + Retry-After: Eventarc y el frontend reintentan más tarde
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(InProgressError)
+async def in_progress_handler(request: Request, exc: InProgressError):
+    # 409 + Retry-After: al reintentar, el lease ya estará "done" y se reutiliza el resultado
+    return JSONResponse(
+        status_code=409,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(DocumentTooLargeError)
+async def too_large_handler(request: Request, exc: DocumentTooLargeError):
+    # 413: reintentar no sirve; el archivo va por el backfill batch
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)})
 
 @app.get("/health")
 def health():
-    return {"ok": True, "env": settings.APP_ENV}
+    return {"ok": True, "env": settings.APP_ENV, "startup": startup_timer.snapshot()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/")
 async def handle_event(payload: GcsEvent):
@@ -44,9 +152,24 @@ async def handle_event(payload: GcsEvent):
         bucket = payload.data.bucket
         name = payload.data.name
         generation = payload.data.generation
-        result = usecase.run(bucket=bucket, name=name, generation=generation)
+        if name.startswith(settings.SYSTEM_PREFIX):
+            # salidas del backfill y demás objetos propios del backend
+            return {"ok": True, "ignored": True}
+        # el caso de uso bloquea (GCS, DocAI, Firestore): se ejecuta en el pool
+        result = await registry.processing_pool.run(
+            registry.usecase.run, bucket=bucket, name=name, generation=generation
+        )
         log.info("processed", extra={"bucket": bucket, "obj_name": name, "result": result})
         return result
+    except OverloadedError:
+        log.warning("overloaded", extra={"in_flight": registry.processing_pool.in_flight})
+        raise
+    except InProgressError:
+        log.info("in_progress_elsewhere", extra={"bucket": bucket, "obj_name": name})
+        raise
+    except DocumentTooLargeError as e:
+        log.warning("document_too_large", extra={"bucket": bucket, "obj_name": name, "error": str(e)})
+        raise
     except Exception as e:
         log.error("error_processing", extra={"error": str(e)})
         raise HTTPException(status_code=400, detail=str(e))
@@ -61,4 +184,6 @@ def env_check():
 
 @app.get("/healthz")
 def healthz():
-    return {"ok": True}
\ No newline at end of file
+    return {"ok": True}
+
+startup_timer.mark_imported()
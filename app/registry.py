@@ -0,0 +1,263 @@
+import threading
+from typing import Any, Callable, Dict
+
+from app.config import settings
+
+class Registry:
+    """Único punto de construcción de clientes y adaptadores.
+
+    Cada dependencia se crea una sola vez, bajo demanda (el import de la app ya no
+    abre canales gRPC ni pools HTTP), y se comparte entre main, routers y CLI. Los
+    imports de las librerías de Google van dentro de cada fábrica por la misma razón.
+    `override` permite inyectar fakes (bench/tests) antes del primer uso.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._items: Dict[str, Any] = {}
+
+    def _get(self, key: str, factory: Callable[[], Any]) -> Any:
+        item = self._items.get(key)
+        if item is None:
+            with self._lock:
+                item = self._items.get(key)
+                if item is None:
+                    item = factory()
+                    self._items[key] = item
+        return item
+
+    def peek(self, key: str) -> Any:
+        """Retorna la dependencia solo si ya se construyó (métricas, diagnóstico)."""
+        item = self._items.get(key)
+        return item or None
+
+    def override(self, **items: Any) -> None:
+        with self._lock:
+            self._items.update(items)
+
+    # ---------- Clientes ----------
+    @property
+    def firebase_app(self):
+        def build():
+            from firebase_admin import initialize_app
+            return initialize_app()
+        return self._get("firebase_app", build)
+
+    @property
+    def firestore_client(self):
+        def build():
+            from google.cloud import firestore
+            return firestore.Client(project=settings.GOOGLE_CLOUD_PROJECT)
+        return self._get("firestore_client", build)
+
+    @property
+    def storage_client(self):
+        def build():
+            from google.cloud import storage
+            return storage.Client()
+        return self._get("storage_client", build)
+
+    @property
+    def docai_client(self):
+        def build():
+            from google.cloud import documentai
+            return documentai.DocumentProcessorServiceClient()
+        return self._get("docai_client", build)
+
+    # ---------- Adaptadores ----------
+    @property
+    def repo(self):
+        def build():
+            from app.adapters.outbound.firestore_repo import FirestoreRepo
+            repo = FirestoreRepo(db=self.firestore_client)
+            if settings.INVOICE_CACHE_LISTEN:
+                repo.start_invoice_listener()
+            return repo
+        return self._get("repo", build)
+
+    @property
+    def storage(self):
+        def build():
+            from app.adapters.outbound.gcs_storage import GCSStorage
+            return GCSStorage(client=self.storage_client)
+        return self._get("storage", build)
+
+    @property
+    def extractor(self):
+        def build():
+            from app.adapters.outbound.docai_invoice import DocAIInvoiceExtractor
+            from app.shared.ratelimit import AdaptiveRateLimiter
+            limiter = None
+            if settings.DOCAI_RATE_LIMIT_RPS > 0:
+                limiter = AdaptiveRateLimiter(
+                    max_rate=settings.DOCAI_RATE_LIMIT_RPS,
+                    burst=settings.DOCAI_RATE_BURST,
+                    min_rate=settings.DOCAI_RATE_MIN_RPS,
+                    max_wait=settings.DOCAI_RATE_MAX_WAIT,
+                    retry_after=settings.PROCESS_RETRY_AFTER,
+                )
+            return DocAIInvoiceExtractor(client=self.docai_client, limiter=limiter)
+        return self._get("extractor", build)
+
+    @property
+    def extraction_cache(self):
+        def build():
+            if not settings.EXTRACTION_CACHE_ENABLED:
+                return False
+            from app.adapters.outbound.extraction_cache import ExtractionCache
+            return ExtractionCache(
+                db=self.firestore_client,
+                namespace=self.extractor.cache_namespace,
+                ttl_seconds=settings.EXTRACTION_CACHE_TTL_SECONDS,
+                mem_items=settings.EXTRACTION_CACHE_MEM_ITEMS,
+            )
+        # False = deshabilitada (None significa "aún no construida")
+        return self._get("extraction_cache", build) or None
+
+    @property
+    def raw_store(self):
+        def build():
+            if not settings.RAW_OFFLOAD_ENABLED:
+                return False
+            from app.adapters.outbound.raw_store import GCSRawStore
+            return GCSRawStore(
+                storage=self.storage,
+                bucket=settings.RAW_BUCKET or settings.GCS_BUCKET,
+                prefix=f"{settings.SYSTEM_PREFIX}raw",
+            )
+        return self._get("raw_store", build) or None
+
+    # ---------- Casos de uso ----------
+    @property
+    def usecase(self):
+        def build():
+            from app.usecases.process_invoice import ProcessInvoiceUseCase
+            from app.shared.singleflight import SingleFlight
+            return ProcessInvoiceUseCase(
+                storage=self.storage,
+                extractor=self.extractor,
+                repository=self.repo,
+                inmem_max_bytes=settings.DOC_INMEM_MAX_BYTES,
+                cache=self.extraction_cache,
+                raw_store=self.raw_store,
+                inflight=SingleFlight() if settings.COALESCE_ENABLED else None,
+                leases=self.repo if settings.LEASE_ENABLED else None,
+                lease_ttl_seconds=settings.LEASE_TTL_SECONDS,
+                lease_done_ttl_seconds=settings.LEASE_DONE_TTL_SECONDS,
+                stage_executor=self.stage_pool,
+                snapshot_timeout=settings.STAGE_TIMEOUT_SNAPSHOT or None,
+                extract_timeout=settings.STAGE_TIMEOUT_EXTRACT or None,
+                persist_timeout=settings.STAGE_TIMEOUT_PERSIST or None,
+                admission=self.admission,
+            )
+        return self._get("usecase", build)
+
+    @property
+    def admission(self):
+        def build():
+            if settings.MEMORY_BUDGET_BYTES <= 0:
+                return False
+            from app.shared.admission import MemoryBudget
+            return MemoryBudget(
+                budget_bytes=settings.MEMORY_BUDGET_BYTES,
+                base_bytes=settings.MEMORY_BASE_BYTES,
+                size_factor=settings.MEMORY_SIZE_FACTOR,
+                large_bytes=settings.MEMORY_LARGE_OBJECT_BYTES,
+                large_concurrency=settings.MEMORY_LARGE_CONCURRENCY,
+                max_wait=settings.MEMORY_MAX_WAIT_SECONDS,
+                retry_after=settings.PROCESS_RETRY_AFTER,
+            )
+        # False = deshabilitada (None significa "aún no construida")
+        return self._get("admission", build) or None
+
+    @property
+    def stage_pool(self):
+        def build():
+            from concurrent.futures import ThreadPoolExecutor
+            # hasta dos etapas a la vez por factura en proceso, venga del pool de
+            # procesamiento o de un worker de jobs: ninguna etapa espera por un hilo
+            callers = settings.PROCESS_WORKERS + settings.JOBS_WORKERS
+            return ThreadPoolExecutor(max_workers=callers * 2, thread_name_prefix="stage")
+        return self._get("stage_pool", build)
+
+    @property
+    def backfill(self):
+        def build():
+            from app.usecases.backfill import BackfillUseCase
+            return BackfillUseCase(
+                storage=self.storage,
+                extractor=self.extractor,
+                repository=self.repo,
+                ingestor=self.usecase,
+                output_bucket=settings.BACKFILL_OUTPUT_BUCKET or settings.GCS_BUCKET,
+                system_prefix=settings.SYSTEM_PREFIX,
+                chunk_size=settings.BACKFILL_CHUNK_SIZE,
+                max_in_flight=settings.BACKFILL_MAX_IN_FLIGHT,
+                poll_interval=settings.BACKFILL_POLL_SECONDS,
+            )
+        return self._get("backfill", build)
+
+    @property
+    def processing_pool(self):
+        def build():
+            from app.shared.executor import BoundedExecutor
+            return BoundedExecutor(
+                max_workers=settings.PROCESS_WORKERS,
+                max_queue=settings.PROCESS_QUEUE_MAX,
+                retry_after=settings.PROCESS_RETRY_AFTER,
+            )
+        return self._get("processing_pool", build)
+
+    @property
+    def jobs(self):
+        def build():
+            from app.shared.errors import InProgressError, OverloadedError
+            from app.shared.jobs import JobRunner, LocalQueue, MemoryJobStore
+            store = self.repo if settings.JOBS_STORE == "firestore" else MemoryJobStore()
+
+            def process_invoice(**params):
+                # por el pool acotado, como las requests síncronas: si está lleno el job
+                # se pospone (OverloadedError) en vez de sumar hilos sin límite
+                return self.processing_pool.submit(self.usecase.run, **params).result()
+
+            return JobRunner(
+                store=store,
+                queue=LocalQueue(),
+                handlers={"process_invoice": process_invoice},
+                workers=settings.JOBS_WORKERS,
+                max_attempts=settings.JOBS_MAX_ATTEMPTS,
+                backoff_seconds=settings.JOBS_BACKOFF_SECONDS,
+                stuck_after=settings.JOBS_STUCK_SECONDS,
+                # lease de otra instancia o pool lleno: reintentar tras su retry_after
+                deferrable=(InProgressError, OverloadedError),
+            )
+        return self._get("jobs", build)
+
+    def warm(self) -> None:
+        """Construye por adelantado lo que usa el camino caliente (opcional al arrancar)."""
+        self.usecase
+        self.firebase_app
+
+    def close(self) -> None:
+        """Libera pools y canales creados (solo los que llegaron a construirse)."""
+        with self._lock:
+            items, self._items = self._items, {}
+        for key in ("processing_pool", "stage_pool"):
+            pool = items.get(key)
+            if pool is not None:
+                pool.shutdown(wait=False)
+        jobs = items.get("jobs")
+        if jobs is not None:
+            jobs.shutdown()
+        repo = items.get("repo")
+        if repo is not None and hasattr(repo, "stop_invoice_listener"):
+            repo.stop_invoice_listener()
+        for key in ("firestore_client", "storage_client"):
+            client = items.get(key)
+            if client is not None and hasattr(client, "close"):
+                client.close()
+        docai = items.get("docai_client")
+        if docai is not None:
+            docai.transport.close()
+
+registry = Registry()
@@ -0,0 +1,95 @@
+import logging
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from typing import List, Optional
+from pydantic import BaseModel
+
+from app.config import settings
+from app.adapters.outbound.firestore_repo import invoice_cache, user_cache
+from app.registry import registry
+from app.shared.auth import require_user, token_cache
+from app.routers.storage import url_cache
+
+log = logging.getLogger("admin")
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+def require_admin(user=Depends(require_user)):
+    if not registry.repo.is_admin(user["uid"]):
+        raise HTTPException(403, "Forbidden")
+    return user
+
+class BackfillBody(BaseModel):
+    bucket: Optional[str] = None
+    prefix: str = ""
+    jobId: Optional[str] = None
+
+def _run_backfill(job_id: str) -> None:
+    try:
+        summary = registry.backfill.run(job_id)
+        log.info("backfill_finished", extra={"job_id": job_id, "status": summary.get("status")})
+    except Exception as e:
+        log.error("backfill_failed", extra={"job_id": job_id, "error": str(e)})
+
+@router.post("/backfill", status_code=202)
+def start_backfill(body: BackfillBody, background: BackgroundTasks, user=Depends(require_admin)):
+    """Registra un backfill sobre bucket/prefijo y lo ejecuta en segundo plano.
+
+    Para miles de archivos es preferible el CLI (`python -m app.cli.backfill`),
+    que no depende de que Cloud Run mantenga CPU tras responder.
+    """
+    job_id = registry.backfill.start(body.bucket or settings.GCS_BUCKET, body.prefix, job_id=body.jobId)
+    background.add_task(_run_backfill, job_id)
+    return {"ok": True, "jobId": job_id}
+
+@router.post("/backfill/{job_id}/resume", status_code=202)
+def resume_backfill(job_id: str, background: BackgroundTasks, user=Depends(require_admin)):
+    if not registry.repo.get_backfill(job_id):
+        raise HTTPException(404, "Not found")
+    background.add_task(_run_backfill, job_id)
+    return {"ok": True, "jobId": job_id}
+
+@router.get("/backfill/{job_id}")
+def backfill_status(job_id: str, user=Depends(require_admin)):
+    job = registry.repo.get_backfill(job_id)
+    if not job:
+        raise HTTPException(404, "Not found")
+    return job | {"jobId": job_id, "chunks": registry.repo.list_backfill_chunks(job_id)}
+
+@router.get("/jobs/stuck")
+def stuck_jobs(limit: int = 100, user=Depends(require_admin)):
+    """Jobs en cola/ejecución sin cambios en JOBS_STUCK_SECONDS (p. ej. instancia reciclada)."""
+    return {"items": registry.jobs.stuck(limit=limit)}
+
+@router.get("/cache/stats")
+def cache_stats(user=Depends(require_admin)):
+    """Contadores hit/miss de las cachés en proceso."""
+    return {
+        "extraction": registry.extraction_cache.stats() if registry.extraction_cache else None,
+        "tokens": token_cache.stats(),
+        "users": user_cache.stats(),
+        "invoices": invoice_cache.stats(),
+        "signedUrls": url_cache.stats(),
+    }
+
+@router.post("/cache/users/{uid}/invalidate")
+def invalidate_user_cache(uid: str, user=Depends(require_admin)):
+    """Hook para cuando cambia el rol o perfil de un usuario (en esta instancia)."""
+    registry.repo.invalidate_user(uid)
+    return {"ok": True, "uid": uid}
+
+class RebuildStatsBody(BaseModel):
+    supplierIds: Optional[List[str]] = None
+
+@router.post("/stats/rebuild")
+def rebuild_stats(body: RebuildStatsBody, user=Depends(require_admin)):
+    """Inicializa/recalcula los contadores de STATS_MODE=counters desde count()."""
+    return registry.repo.rebuild_counters(body.supplierIds)
+
+@router.post("/rollups/rebuild")
+def rebuild_rollups(body: RebuildStatsBody, user=Depends(require_admin)):
+    """Recalcula los rollups mensuales y tipa los montos/fechas de facturas antiguas."""
+    return registry.repo.rebuild_rollups(body.supplierIds)
+
+@router.post("/search/reindex")
+def reindex_search(body: RebuildStatsBody, user=Depends(require_admin)):
+    """Escribe searchTokens en facturas creadas antes de la búsqueda por prefijo."""
+    return registry.repo.reindex_search(body.supplierIds)
@@ -1,30 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import Optional
+import asyncio
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Any, Dict, Iterator, List, Optional
 from pydantic import BaseModel
 
-from app.adapters.outbound.firestore_repo import FirestoreRepo
-from app.adapters.outbound.gcs_storage import GCSStorage
-from app.usecases.process_invoice import ProcessInvoiceUseCase
-from app.adapters.outbound.docai_invoice import DocAIInvoiceExtractor
+from app.adapters.outbound.firestore_repo import EXPORT_FIELDS, ROLLUP_AMOUNTS
+from app.config import settings
+from app.registry import registry
 from app.shared.auth import require_user
-from app.domain.models import InvoiceDTO, StatusUpdate
+from app.shared.errors import InProgressError, OverloadedError
+from app.domain.models import BulkReprocess, BulkStatusUpdate, InvoiceDTO, StatusUpdate
 
 router = APIRouter(prefix="/invoices", tags=["invoices"])
 
-repo = FirestoreRepo()
-usecase = ProcessInvoiceUseCase(
-    storage=GCSStorage(),
-    extractor=DocAIInvoiceExtractor(),
-    repository=repo
-)
-
 class FromUploadBody(BaseModel):
     bucket: str
     name: str
     generation: Optional[str] = None
 
+def _source_of(inv: Dict[str, Any]) -> Dict[str, Any]:
+    # objeto GCS de origen de una factura (facturas antiguas no guardan "source")
+    return inv.get("source", {}) or {
+        "bucket": (inv.get("filePath") or "").replace("gs://", "").split("/", 1)[0],
+        "name": inv.get("name"),
+        "generation": inv.get("generation"),
+    }
+
+async def _enqueue(params: Dict[str, Any], user: Dict[str, Any]) -> JSONResponse:
+    # modo asíncrono: se registra el job y se responde sin esperar a DocAI
+    job = await run_in_threadpool(registry.jobs.submit, "process_invoice", params, user["uid"])
+    status_url = f"/jobs/{job['id']}"
+    return JSONResponse(
+        status_code=202,
+        content={"jobId": job["id"], "status": job["status"], "statusUrl": status_url, "eventsUrl": f"{status_url}/events"},
+        headers={"Location": status_url},
+    )
+
 @router.get("", response_model=list[InvoiceDTO])
 def list_invoices(
+    response: Response,
     status: Optional[str] = Query(None),
     supplierId: Optional[str] = Query(None),   
     limit: int = Query(20, ge=1, le=100),
@@ -32,53 +52,291 @@ def list_invoices(
     user=Depends(require_user)
 ):
     # si viene supplierId y es admin, filtramos por RUC
-    items, _ = repo.list(
+    try:
+        items, next_cursor = registry.repo.list(
+            status=status,
+            limit=limit,
+            cursor=cursor,
+            requester_uid=user["uid"],
+            supplier_id=supplierId
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    # la respuesta sigue siendo una lista; el cursor de la siguiente página va en cabecera
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+@router.get("/search", response_model=list[InvoiceDTO])
+def search_invoices(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=100, description="Nombre de proveedor, prefijo de RUC o número de factura"),
+    supplierId: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    user=Depends(require_user)
+):
+    """Búsqueda por prefijo ordenada por relevancia; mismo formato y paginación que el listado."""
+    try:
+        items, next_cursor = registry.repo.search(
+            q,
+            limit=limit,
+            cursor=cursor,
+            requester_uid=user["uid"],
+            supplier_id=supplierId
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+
+def _cell(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str, ensure_ascii=False)
+    return value
+
+def _export_chunks(pages: Iterator[List[Dict[str, Any]]], fmt: str, columns: List[str]) -> Iterator[bytes]:
+    """Serializa página a página: un chunk por página de Firestore (más la cabecera CSV)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == "csv" else None
+    if writer:
+        writer.writerow(columns)
+        yield buf.getvalue().encode()
+    for rows in pages:
+        buf.seek(0)
+        buf.truncate()
+        for row in rows:
+            if writer:
+                writer.writerow([_cell(row.get(c)) for c in columns])
+            else:
+                buf.write(json.dumps({c: _cell(row.get(c)) for c in columns}, default=str, ensure_ascii=False))
+                buf.write("\n")
+        yield buf.getvalue().encode()
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: formato gzip
+    for chunk in chunks:
+        out = gz.compress(chunk)
+        if out:
+            yield out
+    yield gz.flush()
+
+@router.get("/export")
+def export_invoices(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    status: Optional[str] = Query(None),
+    supplierId: Optional[str] = Query(None),
+    created_from: Optional[datetime] = Query(None, alias="from", description="createdAt >= (ISO 8601)"),
+    created_to: Optional[datetime] = Query(None, alias="to", description="createdAt < (ISO 8601)"),
+    gzip: bool = Query(False, description="Comprime al vuelo (descarga .gz)"),
+    user=Depends(require_user)
+):
+    """Exporta todas las facturas del filtro en CSV o NDJSON, en streaming.
+
+    Pagina la consulta de a EXPORT_PAGE_SIZE con proyección de campos: la memoria no
+    crece con el número de filas y la cabecera sale antes de la primera lectura.
+    """
+    supplier_uid = None
+    if not registry.repo.is_admin(user["uid"]):
+        # igual que el listado: un proveedor solo exporta sus propias facturas
+        supplier_uid, supplierId = user["uid"], None
+
+    pages = registry.repo.iter_invoices(
+        supplier_uid=supplier_uid,
         status=status,
-        limit=limit,
-        cursor=cursor,
-        requester_uid=user["uid"],
-        supplier_id=supplierId
+        supplier_id=supplierId,
+        created_from=created_from,
+        created_to=created_to,
+        fields=EXPORT_FIELDS,
+        page_size=settings.EXPORT_PAGE_SIZE,
+    )
+    columns = ["id", "supplierId", *EXPORT_FIELDS]
+    body = _export_chunks(pages, format, columns)
+    filename = f"invoices.{format}"
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    if gzip:
+        body, filename, media_type = _gzip(body), filename + ".gz", "application/gzip"
+    # generador síncrono: Starlette lo itera en el threadpool (las lecturas no bloquean el loop)
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
     )
-    return items
 
+@router.get("/stats/summary")
+def stats_summary(supplierId: Optional[str] = Query(None), user=Depends(require_user)):
+    """Conteo por estado. Admin: global o por RUC; proveedor: solo sus facturas."""
+    if registry.repo.is_admin(user["uid"]):
+        return registry.repo.stats(supplier_id=supplierId)
+    return registry.repo.stats(supplier_uid=user["uid"])
+
+def _rollup_view(totals: Dict[str, Dict[str, Dict[str, int]]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    # céntimos -> montos, y un "all" por moneda con la suma de todos los estados
+    out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for currency, by_status in totals.items():
+        view: Dict[str, Dict[str, Any]] = {}
+        all_: Dict[str, int] = {"count": 0, **{f"{f}Cents": 0 for f in ROLLUP_AMOUNTS}}
+        for status, fields in by_status.items():
+            if not fields.get("count"):
+                continue  # estados que quedaron en cero tras cambios de estado
+            view[status] = {"count": fields["count"], **{f: fields.get(f"{f}Cents", 0) / 100 for f in ROLLUP_AMOUNTS}}
+            for k in all_:
+                all_[k] += fields.get(k, 0)
+        view["all"] = {"count": all_["count"], **{f: all_[f"{f}Cents"] / 100 for f in ROLLUP_AMOUNTS}}
+        out[currency] = view
+    return out
+
+@router.get("/rollups")
+def rollups(
+    supplierId: str = Query(..., description="RUC del proveedor"),
+    period_from: Optional[str] = Query(None, alias="from", pattern=r"^\d{4}-\d{2}$", description="Mes inicial aaaa-mm"),
+    period_to: Optional[str] = Query(None, alias="to", pattern=r"^\d{4}-\d{2}$", description="Mes final aaaa-mm (inclusive)"),
+    user=Depends(require_user)
+):
+    """Totales mensuales (total, totalTax, netAmount) por moneda y estado de un RUC.
+
+    Lee solo los documentos de rollup del rango, uno por mes, sin recorrer facturas.
+    Admin: cualquier RUC; proveedor: solo RUCs de facturas que subió.
+    """
+    if not registry.repo.is_admin(user["uid"]) and not registry.repo.is_uploader_of(supplierId, user["uid"]):
+        raise HTTPException(403, "Forbidden")
+    docs = registry.repo.get_rollups(supplierId, period_from, period_to)
+    return {
+        "supplierId": supplierId,
+        "from": period_from,
+        "to": period_to,
+        "periods": [{"period": d["period"], "totals": _rollup_view(d.get("totals") or {})} for d in docs],
+    }
+
+@router.post("/bulk/status")
+def bulk_change_status(body: BulkStatusUpdate, user=Depends(require_user)):
+    """Cambia el estado de hasta 500 facturas en transacciones por chunk; resultado por id.
+
+    Solo admin: un proveedor no puede aprobar/pagar en lote facturas de otros.
+    """
+    if not registry.repo.is_admin(user["uid"]):
+        raise HTTPException(403, "Forbidden")
+    items = registry.repo.bulk_update_status(body.ids, body.status, by_uid=user["uid"])
+    updated = sum(1 for r in items.values() if r == "ok")
+    return {"ok": updated == len(items), "status": body.status, "updated": updated, "items": items}
+
+@router.post("/bulk/reprocess")
+async def bulk_reprocess(body: BulkReprocess, user=Depends(require_user)):
+    """Reprocesa hasta 100 facturas repartidas en el pool de procesamiento.
+
+    Como mucho BULK_REPROCESS_CONCURRENCY a la vez por request, para no acaparar
+    el pool que también atiende Eventarc; si el pool está lleno el ítem queda "busy".
+    Admin: cualquier factura; proveedor: solo las que subió (el resto queda "forbidden").
+    """
+    is_admin = await run_in_threadpool(registry.repo.is_admin, user["uid"])
+    invoices = await run_in_threadpool(
+        registry.repo.get_many, body.ids, ["source", "filePath", "name", "generation", "supplierUid"]
+    )
+    gate = asyncio.Semaphore(settings.BULK_REPROCESS_CONCURRENCY)
+
+    async def one(doc_id: str) -> Dict[str, Any]:
+        inv = invoices.get(doc_id)
+        if not inv:
+            return {"ok": False, "error": "not_found"}
+        if not is_admin and inv.get("supplierUid") != user["uid"]:
+            return {"ok": False, "error": "forbidden"}
+        src = _source_of(inv)
+        async with gate:
+            try:
+                return await registry.processing_pool.run(
+                    registry.usecase.run,
+                    bucket=src.get("bucket"),
+                    name=src.get("name"),
+                    generation=src.get("generation"),
+                    uploader_uid=user["uid"],
+                    uploader_email=user.get("email"),
+                    force=body.force,
+                    overwrite=True,
+                )
+            except OverloadedError:
+                return {"ok": False, "error": "busy"}
+            except InProgressError:
+                return {"ok": False, "error": "in_progress"}
+            except Exception as e:
+                return {"ok": False, "error": str(e)}
+
+    ids = list(dict.fromkeys(body.ids))
+    results = await asyncio.gather(*(one(doc_id) for doc_id in ids))
+    return {"items": dict(zip(ids, results))}
 
 @router.post("/from-upload")
-def create_from_upload(body: FromUploadBody, user=Depends(require_user)):
+async def create_from_upload(
+    body: FromUploadBody,
+    run_async: bool = Query(False, alias="async", description="Responde 202 con un jobId en vez de esperar a DocAI"),
+    user=Depends(require_user)
+):
     """Crea/procesa una factura a partir de un PDF ya en GCS."""
-    result = usecase.run(
-        bucket=body.bucket,
-        name=body.name,
-        generation=body.generation,
-        uploader_uid=user["uid"],
-        uploader_email=user.get("email")
-    )
+    params = {
+        "bucket": body.bucket,
+        "name": body.name,
+        "generation": body.generation,
+        "uploader_uid": user["uid"],
+        "uploader_email": user.get("email"),
+    }
+    if run_async:
+        return await _enqueue(params, user)
+    result = await registry.processing_pool.run(registry.usecase.run, **params)
     return result
 
 @router.patch("/{supplierId}/{invoiceId}/status")
 def change_status(supplierId: str, invoiceId: str, body: StatusUpdate, user=Depends(require_user)):
     doc_id = f"{supplierId}/{invoiceId}"
-    if not repo.get(doc_id):
+    # el update lleva precondición de existencia: no hace falta un get previo
+    if not registry.repo.update_status(doc_id, body.status, by_uid=user["uid"]):
         raise HTTPException(404, "Not found")
-    repo.update_status(doc_id, body.status, by_uid=user["uid"])
     return {"ok": True, "doc_id": doc_id, "status": body.status}
 
 @router.post("/{supplierId}/{invoiceId}/reprocess")
-def reprocess(supplierId: str, invoiceId: str, user=Depends(require_user)):
+async def reprocess(
+    supplierId: str,
+    invoiceId: str,
+    force: bool = Query(False, description="Ignora la caché de extracciones y re-ejecuta DocAI"),
+    run_async: bool = Query(False, alias="async", description="Responde 202 con un jobId en vez de esperar a DocAI"),
+    user=Depends(require_user)
+):
     doc_id = f"{supplierId}/{invoiceId}"
-    inv = repo.get(doc_id)
+    inv = await run_in_threadpool(registry.repo.get, doc_id)
     if not inv:
         raise HTTPException(404, "Not found")
 
-    src = inv.get("source", {}) or {
-        "bucket": (inv.get("filePath") or "").replace("gs://", "").split("/", 1)[0],
-        "name": inv.get("name"),
-        "generation": inv.get("generation"),
+    src = _source_of(inv)
+    params = {
+        "bucket": src.get("bucket"),
+        "name": src.get("name"),
+        "generation": src.get("generation"),
+        "uploader_uid": user["uid"],
+        "uploader_email": user.get("email"),
+        "force": force,
+        # reprocesar actualiza la factura (REEXTRACTED) en vez de descartarla como duplicada
+        "overwrite": True,
     }
-    result = usecase.run(
-        bucket=src.get("bucket"),
-        name=src.get("name"),
-        generation=src.get("generation"),
-        uploader_uid=user["uid"],
-        uploader_email=user.get("email")
-    )
+    if run_async:
+        return await _enqueue(params, user)
+    result = await registry.processing_pool.run(registry.usecase.run, **params)
     return result
+
+@router.get("/{supplierId}/{invoiceId}/raw")
+def get_raw(supplierId: str, invoiceId: str, user=Depends(require_user)):
+    """Entidades crudas de DocAI, leídas bajo demanda del blob referenciado."""
+    inv = registry.repo.get(f"{supplierId}/{invoiceId}")
+    if not inv:
+        raise HTTPException(404, "Not found")
+    if inv.get("supplierUid") != user["uid"] and not registry.repo.is_admin(user["uid"]):
+        raise HTTPException(403, "Forbidden")
+
+    raw = inv.get("raw") or {}
+    if raw.get("ref"):
+        if registry.raw_store is None:
+            raise HTTPException(503, "Raw store disabled")
+        return registry.raw_store.get(raw["ref"])
+    # facturas antiguas: raw inline en el documento
+    return {"entities": raw.get("entities", []), "schema_version": inv.get("schemaVersion")}
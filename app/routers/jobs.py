@@ -0,0 +1,56 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import Any, Dict
+
+from app.config import settings
+from app.registry import registry
+from app.shared.auth import require_user
+from app.shared.jobs import TERMINAL
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# comentario SSE para que proxies/balanceadores no corten la conexión ociosa
+KEEPALIVE_SECONDS = 15
+
+def _visible_job(job_id: str, user: Dict[str, Any]) -> Dict[str, Any]:
+    job = registry.jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, "Not found")
+    if job.get("ownerUid") != user["uid"] and not registry.repo.is_admin(user["uid"]):
+        raise HTTPException(403, "Forbidden")
+    return job
+
+@router.get("/{job_id}")
+def get_job(job_id: str, user=Depends(require_user)):
+    """Estado de un job: queued | running | retrying | succeeded | failed (+ stuck)."""
+    return _visible_job(job_id, user)
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, request: Request, user=Depends(require_user)):
+    """Server-Sent Events con cada cambio de estado; se cierra al terminar el job."""
+    job = await run_in_threadpool(_visible_job, job_id, user)
+
+    async def stream():
+        current, last, idle = job, None, 0.0
+        while True:
+            snapshot = (current.get("status"), current.get("attempts"), current.get("stuck"))
+            if snapshot != last:
+                yield f"event: status\ndata: {json.dumps(current, default=str)}\n\n"
+                last, idle = snapshot, 0.0
+            if current.get("status") in TERMINAL or await request.is_disconnected():
+                return
+            await asyncio.sleep(settings.JOBS_SSE_POLL_SECONDS)
+            idle += settings.JOBS_SSE_POLL_SECONDS
+            if idle >= KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                idle = 0.0
+            current = await run_in_threadpool(registry.jobs.get, job_id) or current
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,18 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Dict, List
 from datetime import datetime, timedelta
 from pathlib import Path
 import re
 
-from google.cloud import storage
-
 from app.shared.auth import require_user
-from app.adapters.outbound.firestore_repo import FirestoreRepo
+from app.registry import registry
 from app.config import settings
+from app.shared.cache import TTLCache
 
 router = APIRouter(prefix="/storage", tags=["storage"])
-_repo = FirestoreRepo()
-_storage = storage.Client()
+
+SIGN_MINUTES = 10
+# URLs GET firmadas, reutilizadas hasta SIGNED_URL_REFRESH_MARGIN segundos antes de vencer
+url_cache = TTLCache(
+    maxsize=settings.SIGNED_URL_CACHE_SIZE,
+    ttl=SIGN_MINUTES * 60 - settings.SIGNED_URL_REFRESH_MARGIN,
+)
 
 def _parse_gs_uri(gs_uri: str):
     # gs://bucket/path/to/file.pdf -> (bucket, name)
@@ -23,7 +28,7 @@ def _parse_gs_uri(gs_uri: str):
     return bucket, name
 
 def _sign_get(bucket: str, name: str, minutes: int = 10) -> str:
-    blob = _storage.bucket(bucket).blob(name)
+    blob = registry.storage_client.bucket(bucket).blob(name)
     return blob.generate_signed_url(
         version="v4",
         expiration=timedelta(minutes=minutes),
@@ -31,8 +36,22 @@ def _sign_get(bucket: str, name: str, minutes: int = 10) -> str:
         response_disposition=f'inline; filename="{Path(name).name}"',
     )
 
+def _sign_get_cached(bucket: str, name: str) -> str:
+    key = (bucket, name)
+    url = url_cache.get(key)
+    if url is None:
+        url = _sign_get(bucket, name, minutes=SIGN_MINUTES)
+        url_cache.set(key, url)
+    return url
+
+def _upload_name(uid: str, filename: str, suffix: str = "") -> str:
+    # Ruta destino controlada por el backend (evita colisiones)
+    safe = re.sub(r"[^A-Za-z0-9._-]+", "_", filename or "invoice.pdf")
+    ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return f"uploads/{uid}/{ts}{suffix}-{safe}"
+
 def _sign_put(bucket: str, name: str, minutes: int = 10) -> str:
-    blob = _storage.bucket(bucket).blob(name)
+    blob = registry.storage_client.bucket(bucket).blob(name)
     return blob.generate_signed_url(
         version="v4",
         expiration=timedelta(minutes=minutes),
@@ -43,34 +62,76 @@ def _sign_put(bucket: str, name: str, minutes: int = 10) -> str:
 class UploadUrlBody(BaseModel):
     filename: str
 
+class ViewUrlsBody(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=200)   # "supplierId/invoiceId"
+
+class UploadUrlsBody(BaseModel):
+    filenames: List[str] = Field(..., min_length=1, max_length=50)
+
 
 @router.get("/view-url/{supplier_id}/{invoice_id}")
 def signed_view_url(supplier_id: str, invoice_id: str, user=Depends(require_user)):
     doc_id = f"{supplier_id}/{invoice_id}"
 
-    inv = _repo.get(doc_id)
+    inv = registry.repo.get(doc_id)
     if not inv:
         raise HTTPException(404, "Not found")
 
     # dueño o admin
-    if not _repo.is_admin(user["uid"]) and inv.get("supplierUid") != user["uid"]:
+    if not registry.repo.is_admin(user["uid"]) and inv.get("supplierUid") != user["uid"]:
         raise HTTPException(403, "Forbidden")
 
     bucket, name = _parse_gs_uri(inv.get("filePath", ""))
     if not bucket or not name:
         raise HTTPException(400, "Invalid filePath")
 
-    url = _sign_get(bucket, name, minutes=10)
+    url = _sign_get_cached(bucket, name)
     return {"url": url}
 
 
+@router.post("/view-urls")
+def signed_view_urls(body: ViewUrlsBody, user=Depends(require_user)):
+    """Firma en bloque las URLs de una página de facturas.
+
+    Un solo chequeo de rol y una sola lectura batch (get_all); el resultado es por id:
+    {"url": ...} o {"error": "not_found" | "forbidden" | "invalid_path"}.
+    """
+    is_admin = registry.repo.is_admin(user["uid"])
+    invoices = registry.repo.get_many(body.ids, fields=["filePath", "supplierUid"])
+
+    out: Dict[str, Dict[str, str]] = {}
+    for doc_id in body.ids:
+        inv = invoices.get(doc_id)
+        if not inv:
+            out[doc_id] = {"error": "not_found"}
+            continue
+        if not is_admin and inv.get("supplierUid") != user["uid"]:
+            out[doc_id] = {"error": "forbidden"}
+            continue
+        bucket, name = _parse_gs_uri(inv.get("filePath", ""))
+        if not bucket or not name:
+            out[doc_id] = {"error": "invalid_path"}
+            continue
+        out[doc_id] = {"url": _sign_get_cached(bucket, name)}
+    return {"items": out}
+
+
 @router.post("/upload-url")
 def get_upload_url(body: UploadUrlBody, user=Depends(require_user)):
-    # Ruta destino controlada por el backend (evita colisiones)
-    safe = re.sub(r"[^A-Za-z0-9._-]+", "_", body.filename or "invoice.pdf")
-    ts = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-    name = f"uploads/{user['uid']}/{ts}-{safe}"
+    name = _upload_name(user["uid"], body.filename)
     bucket = settings.GCS_BUCKET
 
-    url = _sign_put(bucket, name, minutes=10)
+    url = _sign_put(bucket, name, minutes=SIGN_MINUTES)
     return {"url": url, "bucket": bucket, "name": name}
+
+
+@router.post("/upload-urls")
+def get_upload_urls(body: UploadUrlsBody, user=Depends(require_user)):
+    """URLs PUT para una subida múltiple, en el mismo orden que `filenames`."""
+    bucket = settings.GCS_BUCKET
+    items = []
+    for i, filename in enumerate(body.filenames):
+        # el índice evita colisiones entre archivos homónimos del mismo segundo
+        name = _upload_name(user["uid"], filename, suffix=f"-{i:02d}")
+        items.append({"url": _sign_put(bucket, name, minutes=SIGN_MINUTES), "bucket": bucket, "name": name})
+    return {"items": items}
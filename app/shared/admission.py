@@ -0,0 +1,79 @@
+import threading
+import time
+from typing import Callable
+
+from app.shared.errors import OverloadedError
+
+class MemoryBudget:
+    """Control de admisión por memoria estimada de las facturas en proceso.
+
+    Cada factura reserva `base_bytes + size * size_factor` (el PDF en
+    bytes, la request a DocAI y la respuesta con texto y layout) antes de descargar
+    nada, con el tamaño que informa stat(). Si la reserva no entra en `budget_bytes`
+    espera hasta `max_wait` segundos a que otras liberen y luego rechaza con
+    OverloadedError (503 + Retry-After). Los objetos desde `large_bytes` pasan además
+    por un carril de `large_concurrency` plazas, para que varios PDFs grandes no
+    coincidan. Una factura que sola supera el presupuesto reserva el presupuesto
+    entero: se procesa, pero sin nadie más a la vez.
+    """
+
+    def __init__(
+        self,
+        budget_bytes: int,
+        base_bytes: int = 8 * 1024 * 1024,
+        size_factor: float = 6.0,
+        large_bytes: int = 10 * 1024 * 1024,
+        large_concurrency: int = 1,
+        max_wait: float = 20.0,
+        retry_after: int = 5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.budget_bytes = budget_bytes
+        self.base_bytes = base_bytes
+        self.size_factor = size_factor
+        self.large_bytes = large_bytes
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._large = threading.BoundedSemaphore(max(1, large_concurrency))
+        self.reserved = 0
+        self.waiting = 0
+
+    def estimate(self, size: int) -> int:
+        return min(self.budget_bytes, self.base_bytes + int(size * self.size_factor))
+
+    def acquire(self, size: int) -> int:
+        """Reserva la memoria estimada para un objeto de `size` bytes; retorna la reserva.
+
+        Bloquea como mucho `max_wait` segundos (carril grande + presupuesto).
+        """
+        cost = self.estimate(size)
+        deadline = self._clock() + self.max_wait
+        large = size >= self.large_bytes
+        if large and not self._large.acquire(timeout=self.max_wait):
+            raise OverloadedError("Carril de PDFs grandes ocupado", retry_after=self.retry_after)
+        try:
+            with self._cond:
+                self.waiting += 1
+                try:
+                    while self.reserved + cost > self.budget_bytes:
+                        remaining = deadline - self._clock()
+                        if remaining <= 0:
+                            raise OverloadedError("Memoria de la instancia comprometida", retry_after=self.retry_after)
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+                self.reserved += cost
+        except BaseException:
+            if large:
+                self._large.release()
+            raise
+        return cost
+
+    def release(self, size: int, cost: int) -> None:
+        with self._cond:
+            self.reserved -= cost
+            self._cond.notify_all()
+        if size >= self.large_bytes:
+            self._large.release()
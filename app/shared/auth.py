@@ -1,14 +1,37 @@
+import hashlib
+import time
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from firebase_admin import auth, initialize_app
+from firebase_admin import auth
+
+from app.config import settings
+from app.registry import registry
+from app.shared.cache import TTLCache
 
-initialize_app()
 security = HTTPBearer(auto_error=True)
 
+# Claims ya verificados, por hash del token. Nunca viven más allá del `exp` del token.
+token_cache = TTLCache(maxsize=settings.AUTH_TOKEN_CACHE_SIZE, ttl=settings.AUTH_TOKEN_CACHE_TTL)
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _verify(token: str) -> dict:
+    # la app de Firebase se inicializa en el primer uso, no al importar
+    decoded = auth.verify_id_token(token, app=registry.firebase_app)
+    user = {"uid": decoded["uid"], "email": decoded.get("email")}
+    ttl = min(token_cache.ttl, float(decoded.get("exp", 0)) - time.time())
+    token_cache.set(_token_key(token), user, ttl=ttl)
+    return user
+
 async def require_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials  # Swagger pondrá "Bearer <token>" y FastAPI extrae el token
-        decoded = auth.verify_id_token(token)
-        return {"uid": decoded["uid"], "email": decoded.get("email")}
+        cached = token_cache.get(_token_key(token))
+        if cached is not None:
+            return dict(cached)
+        # la verificación de firma (y la descarga de certificados) bloquea: fuera del event loop
+        return dict(await run_in_threadpool(_verify, token))
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
@@ -1,2 +1,27 @@
 class BadEventError(Exception):
     pass
+
+class OverloadedError(Exception):
+    """La instancia no admite más trabajo ahora; el cliente debe reintentar."""
+    status_code = 503
+
+    def __init__(self, message: str = "Servicio saturado", retry_after: int = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class QuotaExhaustedError(OverloadedError):
+    """La cuota del servicio externo (DocAI) sigue agotada tras los reintentos."""
+    status_code = 429
+
+class DocumentTooLargeError(ValueError):
+    """El PDF supera lo que admite el procesamiento online de DocAI (413, no se reintenta).
+
+    Esos archivos se procesan con el backfill (batch_process_documents).
+    """
+    status_code = 413
+
+class InProgressError(Exception):
+    """Otra instancia ya está procesando el mismo objeto (lease vigente en Firestore)."""
+    def __init__(self, message: str = "Procesamiento en curso", retry_after: int = 30):
+        super().__init__(message)
+        self.retry_after = retry_after
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from app.shared.errors import OverloadedError
+
+class BoundedExecutor:
+    """Pool de hilos con N workers y una cola acotada.
+
+    Saca el trabajo bloqueante (GCS, DocAI, Firestore) del event loop. Si ya hay
+    `max_workers + max_queue` tareas en vuelo, `submit` rechaza con OverloadedError
+    en lugar de encolar sin límite.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, retry_after: int = 5, name: str = "invoice"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _release(self, _fut: Future) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                raise OverloadedError("Cola de procesamiento llena", retry_after=self.retry_after)
+            self._in_flight += 1
+        try:
+            fut = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        fut.add_done_callback(self._release)
+        return fut
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Ejecuta `fn` en el pool y espera el resultado sin bloquear el event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,223 @@
+import heapq
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Protocol, Tuple
+from uuid import uuid4
+
+from app.shared.cache import TTLCache
+
+log = logging.getLogger("jobs")
+
+QUEUED, RUNNING, RETRYING, SUCCEEDED, FAILED = "queued", "running", "retrying", "succeeded", "failed"
+TERMINAL = (SUCCEEDED, FAILED)
+
+# Puertos
+class JobStore(Protocol):
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]: ...
+    def save_job(self, job_id: str, data: Dict[str, Any]) -> None: ...
+    def list_jobs(self, statuses: List[str], updated_before: float, limit: int = 100) -> List[Dict[str, Any]]: ...
+
+class QueueBackend(Protocol):
+    def put(self, job_id: str, delay: float = 0) -> None: ...
+    def get(self, timeout: float) -> Optional[str]: ...
+    def size(self) -> int: ...
+
+class MemoryJobStore:
+    """Estado de jobs en memoria (una sola instancia o desarrollo local)."""
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 24 * 3600):
+        self._jobs = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def save_job(self, job_id: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs.set(job_id, {**(self._jobs.get(job_id) or {}), **data})
+
+    def list_jobs(self, statuses: List[str], updated_before: float, limit: int = 100) -> List[Dict[str, Any]]:
+        jobs = [j for j in self._jobs.values() if j.get("status") in statuses and j.get("updatedAt", 0) < updated_before]
+        return sorted(jobs, key=lambda j: j.get("updatedAt", 0))[:limit]
+
+class LocalQueue:
+    """Cola en proceso con entregas diferidas (backoff). Sustituto local de Cloud Tasks/PubSub."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def put(self, job_id: str, delay: float = 0) -> None:
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (self._clock() + max(0.0, delay), self._seq, job_id))
+            self._cond.notify()
+
+    def get(self, timeout: float) -> Optional[str]:
+        deadline = self._clock() + timeout
+        with self._cond:
+            while True:
+                now = self._clock()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self._heap:
+                    wait = min(wait, self._heap[0][0] - now)
+                self._cond.wait(wait)
+
+    def size(self) -> int:
+        return len(self._heap)
+
+class JobRunner:
+    """Ejecuta jobs en segundo plano con N workers, reintentos con backoff y detección de atascos.
+
+    `submit` registra el job como "queued" y lo encola; cada worker lo marca
+    "running", invoca el handler de su `kind` y guarda el resultado. Un fallo se
+    reintenta hasta `max_attempts` (backoff exponencial con jitter, nunca menor que
+    el `retry_after` de la excepción); las excepciones de `non_retryable` fallan a la
+    primera. Las de `deferrable` (otra instancia lo procesa, pool lleno) solo
+    posponen el job: no gastan intentos, hasta `max_deferrals` veces. Un job en "queued"/"running" que no se
+    actualiza en `stuck_after` segundos se reporta como atascado (p. ej. la
+    instancia murió con el job en memoria).
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        queue: QueueBackend,
+        handlers: Dict[str, Callable[..., Any]],
+        workers: int = 4,
+        max_attempts: int = 3,
+        backoff_seconds: float = 2.0,
+        stuck_after: float = 900,
+        non_retryable: Tuple[type, ...] = (ValueError,),
+        deferrable: Tuple[type, ...] = (),
+        max_deferrals: int = 20,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.store = store
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.stuck_after = stuck_after
+        self.non_retryable = non_retryable
+        self.deferrable = deferrable
+        self.max_deferrals = max_deferrals
+        self._clock = clock
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.running = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, kind: str, params: Dict[str, Any], owner_uid: Optional[str] = None) -> Dict[str, Any]:
+        if kind not in self.handlers:
+            raise ValueError(f"tipo de job desconocido: {kind}")
+        self.start()
+        job_id = uuid4().hex
+        now = self._clock()
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "params": params,
+            "ownerUid": owner_uid,
+            "status": QUEUED,
+            "attempts": 0,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+        self.store.save_job(job_id, job)
+        self.queue.put(job_id)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.store.get_job(job_id)
+        if job is not None:
+            job["stuck"] = self._is_stuck(job)
+        return job
+
+    def stuck(self, limit: int = 100) -> List[Dict[str, Any]]:
+        cutoff = self._clock() - self.stuck_after
+        return [j | {"stuck": True} for j in self.store.list_jobs([QUEUED, RUNNING, RETRYING], cutoff, limit)]
+
+    def _is_stuck(self, job: Dict[str, Any]) -> bool:
+        if job.get("status") in TERMINAL:
+            return False
+        # los reintentos programados se cuentan desde su próxima ejecución
+        since = max(job.get("updatedAt", 0), job.get("nextAttemptAt", 0))
+        return self._clock() - since > self.stuck_after
+
+    def _backoff(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        base = self.backoff_seconds * (2 ** (attempt - 1))
+        delay = base + random.uniform(0, base / 2)
+        # InProgressError/OverloadedError indican cuándo tiene sentido volver a intentar
+        return max(delay, float(getattr(error, "retry_after", 0) or 0))
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            job_id = self.queue.get(timeout=1.0)
+            if job_id is None:
+                continue
+            try:
+                self._execute(job_id)
+            except Exception as e:  # el worker nunca debe morir por un job
+                log.error("job_worker_error", extra={"job_id": job_id, "error": str(e)})
+
+    def _execute(self, job_id: str) -> None:
+        job = self.store.get_job(job_id)
+        if job is None or job.get("status") in TERMINAL:
+            return
+        attempt = int(job.get("attempts", 0)) + 1
+        self.store.save_job(job_id, {"status": RUNNING, "attempts": attempt, "startedAt": self._clock(), "updatedAt": self._clock()})
+        with self._lock:
+            self.running += 1
+        try:
+            result = self.handlers[job["kind"]](**job.get("params", {}))
+        except Exception as e:
+            deferrals = int(job.get("deferrals", 0))
+            deferred = isinstance(e, self.deferrable) and deferrals < self.max_deferrals
+            retry = deferred or (attempt < self.max_attempts and not isinstance(e, self.non_retryable))
+            if retry:
+                delay = self._backoff(attempt, e)
+                update = {
+                    "status": RETRYING,
+                    "error": str(e),
+                    "nextAttemptAt": self._clock() + delay,
+                    "updatedAt": self._clock(),
+                }
+                if deferred:
+                    # pospuesto, no fallido: el intento no cuenta
+                    update |= {"attempts": attempt - 1, "deferrals": deferrals + 1}
+                self.store.save_job(job_id, update)
+                self.queue.put(job_id, delay=delay)
+            else:
+                self.store.save_job(job_id, {"status": FAILED, "error": str(e), "finishedAt": self._clock(), "updatedAt": self._clock()})
+            log.warning("job_failed", extra={"job_id": job_id, "attempt": attempt, "retry": retry, "deferred": deferred, "error": str(e)})
+            return
+        finally:
+            with self._lock:
+                self.running -= 1
+        self.store.save_job(job_id, {"status": SUCCEEDED, "result": result, "error": None, "finishedAt": self._clock(), "updatedAt": self._clock()})
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
@@ -2,6 +2,9 @@ import logging
 import json
 import sys
 
+# Atributos propios de LogRecord: todo lo demás en record.__dict__ viene de extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
 class JsonFormatter(logging.Formatter):
     def format(self, record):
         base = {
@@ -11,7 +14,12 @@ class JsonFormatter(logging.Formatter):
         }
         if record.args and isinstance(record.args, dict):
             base.update(record.args)
-        return json.dumps(base)
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key not in base:
+                base[key] = value
+        if record.exc_info:
+            base["exception"] = self.formatException(record.exc_info)
+        return json.dumps(base, default=str)
 
 def setup_logging():
     handler = logging.StreamHandler(sys.stdout)
@@ -0,0 +1,238 @@
+"""Métricas en formato de texto de Prometheus, sin dependencias externas.
+
+Contadores, gauges e histogramas con etiquetas, seguros entre hilos. `span()` mide
+una etapa, la observa en un histograma y la anota en la traza en curso (`trace()`),
+de modo que cada factura procesada puede loguear su desglose GCS/DocAI/Firestore.
+"""
+import functools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+log = logging.getLogger("metrics")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# segundos: cubre desde lecturas de caché hasta extracciones largas de DocAI
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _fmt_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs)
+    return "{" + body + "}"
+
+def _fmt_value(v: float) -> str:
+    if math.isinf(v):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(_key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    """Gauge con valor propio o calculado al exportar (`fn` → [(labels, valor)])."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], Iterable[Tuple[Dict[str, Any], float]]]] = None):
+        super().__init__(name, help)
+        self._values: Dict[LabelKey, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, **labels: Any) -> None:
+        with self._lock:
+            self._values[_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels: Any) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = list(self._values.items())
+        if self._fn is not None:
+            try:
+                items += [(_key(labels), value) for labels, value in self._fn()]
+            except Exception as e:  # un collector roto no debe tumbar /metrics
+                log.warning("gauge_collect_failed", extra={"metric": self.name, "error": str(e)})
+        return [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # por etiquetas: [conteos por bucket..., suma, total]
+        self._series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(_key(labels))
+        return int(series[-1]) if series else 0
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        lines = []
+        for key, series in items:
+            for bound, n in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', _fmt_value(bound))])} {n}")
+            lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', '+Inf')])} {int(series[-1])}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(series[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {int(series[-1])}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._add(Counter(name, help))
+
+    def gauge(self, name: str, help: str, fn=None) -> Gauge:
+        return self._add(Gauge(name, help, fn=fn))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, buckets=buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+# ---------- Métricas del servicio ----------
+http_requests = metrics.histogram("http_request_duration_seconds", "Latencia de requests HTTP por ruta")
+http_in_flight = metrics.gauge("http_requests_in_flight", "Requests HTTP en curso")
+http_errors = metrics.counter("http_errors_total", "Respuestas 4xx/5xx y excepciones por ruta")
+stage_seconds = metrics.histogram("invoice_stage_duration_seconds", "Duración de cada etapa del procesamiento de una factura")
+firestore_seconds = metrics.histogram("firestore_op_duration_seconds", "Duración de cada método de FirestoreRepo")
+firestore_errors = metrics.counter("firestore_op_errors_total", "Errores por método de FirestoreRepo")
+docai_pages = metrics.counter("docai_pages_total", "Páginas devueltas por DocAI")
+docai_documents = metrics.counter("docai_documents_total", "Documentos procesados por DocAI")
+docai_queue_seconds = metrics.histogram("docai_limiter_wait_seconds", "Espera en el limitador antes de llamar a DocAI")
+docai_retries = metrics.counter("docai_retries_total", "Reintentos de llamadas a DocAI por tipo (throttle/transient)")
+
+# ---------- Trazas por etapa ----------
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_trace", default=None)
+
+@contextmanager
+def trace() -> Iterator[Dict[str, float]]:
+    """Acumula los spans de este hilo/contexto en un dict {etapa: segundos}."""
+    spans: Dict[str, float] = {}
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+
+@contextmanager
+def span(name: str, histogram: Histogram = stage_seconds, label: str = "stage") -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, **{label: name})
+        spans = _trace.get()
+        if spans is not None:
+            spans[name] = round(spans.get(name, 0) + elapsed, 6)
+
+def instrumented(prefix: str, histogram: Histogram, errors: Counter) -> Callable[[type], type]:
+    """Decorador de clase: envuelve cada método público en un span `prefix.metodo`."""
+    def wrap(method_name: str, fn: Callable) -> Callable:
+        span_name = f"{prefix}.{method_name}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, histogram=histogram, label="method"):
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    errors.inc(method=span_name)
+                    raise
+        return wrapper
+
+    def decorate(cls: type) -> type:
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or not callable(value) or isinstance(value, (staticmethod, classmethod)):
+                continue
+            setattr(cls, attr, wrap(attr, value))
+        return cls
+    return decorate
@@ -0,0 +1,122 @@
+import contextvars
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+log = logging.getLogger("pipeline")
+
+# cada cuánto se mira si una etapa encolada ya arrancó (para empezar a contar su timeout)
+_QUEUED_POLL = 0.05
+
+class StageTimeoutError(TimeoutError):
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"la etapa '{stage}' superó {timeout:g}s")
+        self.stage = stage
+        self.timeout = timeout
+
+@dataclass
+class Stage:
+    """Etapa del pipeline: `fn` recibe los resultados de sus dependencias por nombre."""
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    deps: Tuple[str, ...] = ()
+    timeout: Optional[float] = None   # None/0 = sin límite
+    # opcional: si falla o vence, su resultado es None y el pipeline sigue
+    optional: bool = False
+
+def _check(stages: Sequence[Stage]) -> None:
+    names = {s.name for s in stages}
+    for s in stages:
+        missing = set(s.deps) - names
+        if missing:
+            raise ValueError(f"la etapa '{s.name}' depende de etapas inexistentes: {sorted(missing)}")
+
+def run_stages(
+    stages: Sequence[Stage],
+    executor: Optional[Executor] = None,
+    on_abandoned: Optional[Callable[[List[Future]], None]] = None,
+) -> Dict[str, Any]:
+    """Ejecuta las etapas respetando dependencias; las independientes van en paralelo.
+
+    Sin `executor` corre todo en el hilo actual, en orden, sin timeouts. Con executor
+    cada etapa se lanza en cuanto sus dependencias terminan, y el contexto (trazas de
+    métricas) se propaga a los hilos. El timeout cuenta desde que la etapa empieza a
+    ejecutarse, no desde que se encola: la espera por un hilo libre del executor no
+    la hace vencer. Un timeout no puede interrumpir el hilo: la etapa sigue en
+    segundo plano y su resultado se descarta. `on_abandoned` recibe esos futures
+    (vencidos o aún corriendo cuando otra etapa falló), para que el llamador no
+    suelte recursos que la etapa todavía usa.
+    """
+    _check(stages)
+    results: Dict[str, Any] = {}
+    if executor is None:
+        pending = list(stages)
+        while pending:
+            stage = next((s for s in pending if all(d in results for d in s.deps)), None)
+            if stage is None:
+                raise ValueError(f"dependencias circulares entre {[s.name for s in pending]}")
+            pending.remove(stage)
+            try:
+                results[stage.name] = stage.fn({d: results[d] for d in stage.deps})
+            except Exception as e:
+                if not stage.optional:
+                    raise
+                log.warning("optional_stage_failed", extra={"stage": stage.name, "error": str(e)})
+                results[stage.name] = None
+        return results
+
+    pending: List[Stage] = list(stages)
+    running: Dict[Future, Stage] = {}
+    abandoned: List[Future] = []
+    # instante en que cada etapa empezó a ejecutarse en el executor (lo escribe su hilo)
+    started: Dict[str, float] = {}
+
+    def _timed(stage: Stage, deps: Dict[str, Any]) -> Any:
+        started[stage.name] = time.monotonic()
+        return stage.fn(deps)
+
+    try:
+        while pending or running:
+            for stage in [s for s in pending if all(d in results for d in s.deps)]:
+                pending.remove(stage)
+                ctx = contextvars.copy_context()
+                deps = {d: results[d] for d in stage.deps}
+                running[executor.submit(ctx.run, _timed, stage, deps)] = stage
+            if not running:
+                raise ValueError(f"dependencias circulares entre {[s.name for s in pending]}")
+
+            now = time.monotonic()
+            deadlines = [started[s.name] + s.timeout - now for s in running.values() if s.timeout and s.name in started]
+            if any(s.timeout and s.name not in started for s in running.values()):
+                # etapa con timeout aún en cola: se revisa a menudo para arrancar su reloj
+                deadlines.append(_QUEUED_POLL)
+            done, _ = wait(list(running), timeout=max(0.0, min(deadlines)) if deadlines else None,
+                           return_when=FIRST_COMPLETED)
+
+            for fut in done:
+                stage = running.pop(fut)
+                try:
+                    results[stage.name] = fut.result()
+                except Exception as e:
+                    if not stage.optional:
+                        raise
+                    log.warning("optional_stage_failed", extra={"stage": stage.name, "error": str(e)})
+                    results[stage.name] = None
+
+            now = time.monotonic()
+            for fut, stage in list(running.items()):
+                if stage.timeout and stage.name in started and now - started[stage.name] >= stage.timeout:
+                    running.pop(fut)
+                    if not fut.cancel():
+                        abandoned.append(fut)
+                    if not stage.optional:
+                        raise StageTimeoutError(stage.name, stage.timeout)
+                    log.warning("optional_stage_timeout", extra={"stage": stage.name, "timeout": stage.timeout})
+                    results[stage.name] = None
+    finally:
+        abandoned.extend(fut for fut in running if not fut.cancel())
+        if abandoned and on_abandoned is not None:
+            on_abandoned(abandoned)
+    return results
@@ -0,0 +1,122 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple, Type
+
+from app.shared.errors import OverloadedError, QuotaExhaustedError
+
+class AdaptiveRateLimiter:
+    """Token bucket compartido entre hilos con tasa adaptativa (AIMD).
+
+    `acquire` reserva un token y duerme lo necesario (las reservas quedan en orden
+    de llegada). Cada éxito suma `increase` req/s hasta `max_rate`; un throttle
+    (429 / RESOURCE_EXHAUSTED) multiplica la tasa por `decrease`, como mucho una
+    vez por `cooldown` segundos para que una ráfaga de 429 simultáneos no la hunda.
+    """
+
+    def __init__(
+        self,
+        max_rate: float,
+        burst: float,
+        min_rate: float = 0.5,
+        increase: float = 0.05,
+        decrease: float = 0.5,
+        cooldown: float = 1.0,
+        max_wait: float = 30.0,
+        retry_after: int = 5,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.burst = max(1.0, burst)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+        self._last_decrease = float("-inf")
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Toma un token; retorna los segundos esperados. OverloadedError si la espera excede max_wait."""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > self.max_wait:
+                raise OverloadedError("Cuota de DocAI saturada", retry_after=self.retry_after)
+            self._tokens -= 1  # puede quedar negativo: reserva para quien espera
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            now = self._clock()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._last_decrease = now
+
+def call_with_retry(
+    fn: Callable[[], Any],
+    limiter: Optional[AdaptiveRateLimiter],
+    throttle_errors: Tuple[Type[BaseException], ...],
+    transient_errors: Tuple[Type[BaseException], ...],
+    max_attempts: int = 4,
+    backoff: float = 1.0,
+    backoff_max: float = 20.0,
+    sleep: Callable[[float], None] = time.sleep,
+    on_wait: Optional[Callable[[float], None]] = None,
+    on_retry: Optional[Callable[[str], None]] = None,
+) -> Any:
+    """Ejecuta `fn` pasando por el limitador; reintenta throttles y errores transitorios.
+
+    Backoff exponencial con full jitter. Si se agotan los intentos: QuotaExhaustedError
+    (429) tras un throttle, OverloadedError (503) tras un error transitorio; ambos con
+    Retry-After para que Eventarc/el cliente reintenten más tarde.
+    """
+    last: Optional[BaseException] = None
+    for attempt in range(1, max_attempts + 1):
+        if limiter is not None:
+            waited = limiter.acquire()
+            if on_wait is not None:
+                on_wait(waited)
+        try:
+            result = fn()
+        except throttle_errors as e:
+            last = e
+            if limiter is not None:
+                limiter.on_throttle()
+            kind = "throttle"
+        except transient_errors as e:
+            last = e
+            kind = "transient"
+        else:
+            if limiter is not None:
+                limiter.on_success()
+            return result
+        if attempt < max_attempts:
+            if on_retry is not None:
+                on_retry(kind)
+            sleep(random.uniform(0, min(backoff_max, backoff * 2 ** (attempt - 1))))
+
+    retry_after = limiter.retry_after if limiter is not None else 5
+    if isinstance(last, throttle_errors):
+        raise QuotaExhaustedError(f"Cuota agotada tras {max_attempts} intentos: {last}", retry_after=retry_after) from last
+    raise OverloadedError(f"Servicio no disponible tras {max_attempts} intentos: {last}", retry_after=retry_after) from last
@@ -0,0 +1,33 @@
+import logging
+import time
+from typing import Dict, Optional
+
+# Se fija al importar este módulo, que app.main importa antes que todo lo demás
+_T0 = time.perf_counter()
+
+log = logging.getLogger("startup")
+
+class StartupTimer:
+    """Mide el arranque en frío: import de la app y primera request atendida."""
+
+    def __init__(self, t0: float):
+        self.t0 = t0
+        self.import_s: Optional[float] = None
+        self.first_request_s: Optional[float] = None
+
+    def mark_imported(self) -> None:
+        self.import_s = time.perf_counter() - self.t0
+
+    def mark_first_request(self, path: str) -> None:
+        if self.first_request_s is not None:
+            return
+        self.first_request_s = time.perf_counter() - self.t0
+        log.info("cold_start", extra=self.snapshot() | {"path": path})
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        return {
+            "import_ms": round(self.import_s * 1000, 1) if self.import_s is not None else None,
+            "first_request_ms": round(self.first_request_s * 1000, 1) if self.first_request_s is not None else None,
+        }
+
+timer = StartupTimer(_T0)
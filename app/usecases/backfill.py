@@ -0,0 +1,207 @@
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Protocol, Tuple
+
+from google.cloud import firestore
+
+from app.domain.models import BatchResult, InvoiceExtraction, ObjectInfo
+from app.usecases.process_invoice import ProcessInvoiceUseCase
+
+log = logging.getLogger("backfill")
+
+# Puertos
+class BackfillStoragePort(Protocol):
+    def list_objects(self, bucket: str, prefix: str = "") -> Iterator[ObjectInfo]: ...
+    def download_bytes(self, bucket: str, name: str, max_bytes: Optional[int] = None) -> bytes: ...
+
+class BatchDocAIPort(Protocol):
+    def batch_submit(self, gcs_uris: List[str], output_uri: str) -> str: ...
+    def batch_status(self, operation_name: str) -> BatchResult: ...
+    def extraction_from_json(self, data: bytes) -> InvoiceExtraction: ...
+
+class BackfillRepositoryPort(Protocol):
+    def get_backfill(self, job_id: str) -> Optional[Dict[str, Any]]: ...
+    def save_backfill(self, job_id: str, data: Dict[str, Any]) -> None: ...
+    def list_backfill_chunks(self, job_id: str) -> List[Dict[str, Any]]: ...
+    def save_backfill_chunk(self, job_id: str, index: int, data: Dict[str, Any]) -> None: ...
+
+def _split_gs_uri(uri: str) -> Tuple[str, str]:
+    rest = uri[5:] if uri.startswith("gs://") else uri
+    bucket, _, path = rest.partition("/")
+    return bucket, path
+
+def _is_pdf(obj: ObjectInfo) -> bool:
+    return obj.content_type == "application/pdf" or obj.name.lower().endswith(".pdf")
+
+@dataclass
+class BackfillUseCase:
+    """Re-extrae todos los PDFs de un bucket/prefijo con DocAI batch_process_documents.
+
+    El progreso vive en Firestore (`backfills/{job}` + subcolección `chunks`), así que
+    `run` se puede relanzar: los chunks terminados se saltan y las operaciones ya
+    enviadas se vuelven a consultar por nombre en lugar de reenviarse.
+    """
+    storage: BackfillStoragePort
+    extractor: BatchDocAIPort
+    repository: BackfillRepositoryPort
+    ingestor: ProcessInvoiceUseCase
+    output_bucket: str
+    system_prefix: str = "_system/"
+    chunk_size: int = 50
+    max_in_flight: int = 4
+    poll_interval: float = 15.0
+    poll_timeout: float = 6 * 3600
+    sleep: Callable[[float], None] = time.sleep
+    clock: Callable[[], float] = time.monotonic
+
+    def start(self, bucket: str, prefix: str = "", job_id: Optional[str] = None) -> str:
+        """Lista los PDFs del prefijo y registra el job con sus chunks (idempotente por job_id)."""
+        job_id = job_id or uuid.uuid4().hex[:12]
+        if self.repository.get_backfill(job_id):
+            return job_id
+
+        objects = [
+            o for o in self.storage.list_objects(bucket, prefix)
+            if _is_pdf(o) and not o.name.startswith(self.system_prefix)
+        ]
+        chunks = [objects[i:i + self.chunk_size] for i in range(0, len(objects), self.chunk_size)]
+        for index, chunk in enumerate(chunks):
+            self.repository.save_backfill_chunk(job_id, index, {
+                "status": "pending",
+                "items": [{"name": o.name, "generation": o.generation} for o in chunk],
+            })
+        self.repository.save_backfill(job_id, {
+            "bucket": bucket,
+            "prefix": prefix,
+            "status": "pending",
+            "total": len(objects),
+            "chunks": len(chunks),
+            "processed": 0,
+            "failed": 0,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+        })
+        log.info("backfill_started", extra={"job_id": job_id, "total": len(objects), "chunks": len(chunks)})
+        return job_id
+
+    def run(self, job_id: str) -> Dict[str, Any]:
+        """Envía los chunks pendientes (máx `max_in_flight` a la vez), espera y persiste resultados."""
+        job = self.repository.get_backfill(job_id)
+        if not job:
+            raise ValueError(f"Backfill {job_id} no existe")
+        bucket = job["bucket"]
+        self.repository.save_backfill(job_id, {"status": "running", "updatedAt": firestore.SERVER_TIMESTAMP})
+
+        pending = deque(c for c in self.repository.list_backfill_chunks(job_id) if c.get("status") != "done")
+        in_flight: List[Dict[str, Any]] = []
+        started = self.clock()
+
+        while pending or in_flight:
+            while pending and len(in_flight) < self.max_in_flight:
+                chunk = pending.popleft()
+                # los chunks "submitted" de una corrida anterior se reanudan por nombre de operación
+                if chunk.get("status") != "submitted" or not chunk.get("operation"):
+                    chunk = self._submit(job_id, bucket, chunk)
+                in_flight.append(chunk)
+
+            still_running = []
+            for chunk in in_flight:
+                try:
+                    status = self.extractor.batch_status(chunk["operation"])
+                except Exception as e:
+                    # operación expirada o desconocida: se vuelve a enviar
+                    log.warning("backfill_operation_lost", extra={"job_id": job_id, "index": chunk["index"], "error": str(e)})
+                    pending.append(chunk | {"status": "pending", "operation": None})
+                    continue
+                if status.done:
+                    self._collect(job_id, bucket, chunk, status)
+                else:
+                    still_running.append(chunk)
+
+            progressed = len(still_running) < len(in_flight)
+            in_flight = still_running
+            if in_flight and not progressed:
+                if self.clock() - started > self.poll_timeout:
+                    # se deja en "paused": la próxima corrida retoma las operaciones en vuelo
+                    self.repository.save_backfill(job_id, {"status": "paused", "updatedAt": firestore.SERVER_TIMESTAMP})
+                    return self.repository.get_backfill(job_id) or {}
+                self.sleep(self.poll_interval)
+
+        self.repository.save_backfill(job_id, {
+            "status": self._final_status(job_id),
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        })
+        return self.repository.get_backfill(job_id) or {}
+
+    def _final_status(self, job_id: str) -> str:
+        """"done" si todo se ingirió; "failed" si ningún chunk terminó; si no, "partial".
+
+        Un chunk en "error" (falló la operación entera) o con archivos fallidos deja el
+        job en "partial": resume reintenta solo los chunks que no quedaron "done".
+        """
+        chunks = self.repository.list_backfill_chunks(job_id)
+        finished = [c for c in chunks if c.get("status") == "done"]
+        if chunks and not finished:
+            return "failed"
+        if len(finished) < len(chunks) or any(c.get("failed") for c in finished):
+            return "partial"
+        return "done"
+
+    def _submit(self, job_id: str, bucket: str, chunk: Dict[str, Any]) -> Dict[str, Any]:
+        index = chunk["index"]
+        output_uri = f"gs://{self.output_bucket}/{self.system_prefix}backfill/{job_id}/{index:06d}/"
+        uris = [f"gs://{bucket}/{item['name']}" for item in chunk["items"]]
+        operation = self.extractor.batch_submit(uris, output_uri)
+        update = {"status": "submitted", "operation": operation, "outputUri": output_uri}
+        self.repository.save_backfill_chunk(job_id, index, update)
+        return chunk | update
+
+    def _collect(self, job_id: str, bucket: str, chunk: Dict[str, Any], status: BatchResult) -> None:
+        index = chunk["index"]
+        if status.error:
+            # error de toda la operación: el chunk queda reintentable en la próxima corrida
+            self.repository.save_backfill_chunk(job_id, index, {"status": "error", "error": status.error})
+            log.error("backfill_chunk_error", extra={"job_id": job_id, "index": index, "error": status.error})
+            return
+
+        processed, errors = 0, {}
+        for item in chunk["items"]:
+            name = item["name"]
+            uri = f"gs://{bucket}/{name}"
+            out = status.outputs.get(uri)
+            if out is None:
+                errors[name] = status.failures.get(uri, "sin salida de DocAI")
+                continue
+            try:
+                extraction = self._read_output(out)
+                self.ingestor.ingest(extraction, bucket, name, item.get("generation"), overwrite=True)
+                processed += 1
+            except Exception as e:
+                errors[name] = str(e)
+
+        self.repository.save_backfill_chunk(job_id, index, {
+            "status": "done",
+            "processed": processed,
+            "failed": len(errors),
+            "errors": errors,
+        })
+        self.repository.save_backfill(job_id, {
+            "processed": firestore.Increment(processed),
+            "failed": firestore.Increment(len(errors)),
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        })
+
+    def _read_output(self, output_uri: str) -> InvoiceExtraction:
+        # DocAI puede partir un documento en varios shards JSON: se unen en orden
+        out_bucket, out_prefix = _split_gs_uri(output_uri)
+        shards = sorted(o.name for o in self.storage.list_objects(out_bucket, out_prefix) if o.name.endswith(".json"))
+        if not shards:
+            raise ValueError(f"Sin shards en {output_uri}")
+        merged = InvoiceExtraction()
+        for shard in shards:
+            part = self.extractor.extraction_from_json(self.storage.download_bytes(out_bucket, shard))
+            merged.entities.extend(part.entities)
+            merged.schema_version = part.schema_version
+        return merged
@@ -1,33 +1,96 @@
-from typing import Protocol, Optional, Dict, Any
-from dataclasses import dataclass
-from app.domain.models import InvoiceExtraction, Entity
+import logging
+import threading
+import time
+from concurrent.futures import Executor, Future
+from typing import Callable, List, Protocol, Optional, Dict, Any, Tuple
+from dataclasses import asdict, dataclass, field as dc_field
+from uuid import uuid4
+from app.domain.models import InvoiceExtraction, Entity, LineItem, ObjectInfo
+from app.domain.parsing import typed_fields
+from app.shared.admission import MemoryBudget
+from app.shared.errors import DocumentTooLargeError, InProgressError
+from app.shared.metrics import span, trace
+from app.shared.pipeline import Stage, run_stages
+from app.shared.singleflight import SingleFlight
 from google.cloud import firestore
 
+log = logging.getLogger("invoices")
+
 # Puertos
 class StoragePort(Protocol):
-    def download_to_tmp(self, bucket: str, name: str) -> str: ...
+    def stat(self, bucket: str, name: str) -> ObjectInfo: ...
+    def download_bytes(self, bucket: str, name: str, max_bytes: Optional[int] = None) -> bytes: ...
 
 class DocAIPort(Protocol):
-    def extract_invoice(self, local_pdf_path: str) -> InvoiceExtraction: ...
+    def extract_invoice_bytes(self, content: bytes, mime_type: str = "application/pdf") -> InvoiceExtraction: ...
+
+class ExtractionCachePort(Protocol):
+    def key_for(self, info: ObjectInfo) -> Optional[str]: ...
+    def get(self, key: str) -> Optional[InvoiceExtraction]: ...
+    def put(self, key: str, extraction: InvoiceExtraction) -> None: ...
+
+class RawStorePort(Protocol):
+    def put(self, supplier_id: str, invoice_id: str, version: str, extraction: InvoiceExtraction) -> Dict[str, Any]: ...
+    def delete(self, ref: str) -> None: ...
 
 class RepositoryPort(Protocol):
-    def invoice_exists(self, supplier_id: str, invoice_id: str) -> bool: ...
-    def save_invoice(self, supplier_id: str, invoice_id: str, payload: dict) -> None: ...
+    def create_invoice(self, supplier_id: str, invoice_id: str, payload: dict, event: dict) -> bool: ...
+    def save_invoice_with_event(self, supplier_id: str, invoice_id: str, payload: dict, event: dict) -> None: ...
     def add_event(self, invoice_id: str, event: dict) -> None: ...
     # NUEVO
     def get_user_snapshot(self, uid: str) -> Optional[Dict[str, Any]]: ...
 
+class LeasePort(Protocol):
+    def claim_lease(self, key: str, owner: str, ttl_seconds: float, reuse_done: bool = True) -> Tuple[str, Optional[Dict[str, Any]]]: ...
+    def complete_lease(self, key: str, owner: str, result: Dict[str, Any], ttl_seconds: float) -> None: ...
+    def release_lease(self, key: str, owner: str) -> None: ...
+
+def _index_entities(entities: List[Entity]) -> Tuple[Dict[str, Entity], List[LineItem]]:
+    """Una sola pasada: mejor candidato (mayor confianza, con texto) por tipo + line items."""
+    best: Dict[str, Entity] = {}
+    line_items: List[LineItem] = []
+    for e in entities:
+        if e.type == "line_item":
+            line_items.append(LineItem.from_entity(e))
+            continue
+        if not e.text:
+            continue
+        current = best.get(e.type)
+        if current is None or e.confidence > current.confidence:
+            best[e.type] = e
+    return best, line_items
+
+# Campos que una re-extracción (overwrite) no debe pisar
+_PRESERVED_ON_OVERWRITE = ("status", "createdAt", "supplierUid", "createdBy", "supplierSnapshot")
+
 @dataclass
 class ProcessInvoiceUseCase:
     storage: StoragePort
     extractor: DocAIPort
     repository: RepositoryPort
-
-    def _find(self, entities: list[Entity], etype: str) -> Optional[str]:
-        for e in entities:
-            if e.type == etype:
-                return e.text
-        return None
+    # PDFs hasta este tamaño van directo a memoria y a DocAI online; los mayores se
+    # rechazan antes de descargar (el límite online de DocAI es 20 MB: van por backfill)
+    inmem_max_bytes: int = 20 * 1024 * 1024
+    # caché opcional por hash de contenido: evita llamar a DocAI por PDFs repetidos
+    cache: Optional[ExtractionCachePort] = None
+    # si está, las entidades crudas van a un blob aparte y la factura solo guarda la referencia
+    raw_store: Optional[RawStorePort] = None
+    # entregas duplicadas del mismo objeto: en este proceso comparten una sola ejecución
+    # (inflight) y entre instancias se deduplican con un lease en Firestore (leases)
+    inflight: Optional[SingleFlight] = None
+    leases: Optional[LeasePort] = None
+    lease_ttl_seconds: float = 300
+    lease_done_ttl_seconds: float = 600
+    instance_id: str = dc_field(default_factory=lambda: uuid4().hex)
+    # etapas independientes (snapshot del uploader vs. descarga + DocAI) en paralelo;
+    # sin executor el pipeline corre en serie en el hilo actual
+    stage_executor: Optional[Executor] = None
+    snapshot_timeout: Optional[float] = None
+    extract_timeout: Optional[float] = None
+    persist_timeout: Optional[float] = None
+    # admisión por memoria: cada descarga + extracción reserva su costo estimado
+    # según el tamaño del objeto (stat) antes de bajar el PDF
+    admission: Optional[MemoryBudget] = None
 
     def _normalize(
         self,
@@ -38,19 +101,24 @@ class ProcessInvoiceUseCase:
         uploader_uid: Optional[str] = None,
         uploader_email: Optional[str] = None,
         supplier_snapshot: Optional[Dict[str, Any]] = None,
-    ) -> Dict[str, Any]:
+    ) -> Tuple[str, str, Dict[str, Any]]:
         es = extraction.entities
+        best, line_items = _index_entities(es)
 
-        supplier_id      = self._find(es, "supplier_tax_id") or "unknown"
-        invoice_id       = self._find(es, "invoice_id") or f"{name}"
-        total            = self._find(es, "total_amount")
-        total_tax        = self._find(es, "total_tax_amount")
-        net_amount       = self._find(es, "net_amount")
-        currency         = self._find(es, "currency")               # "SOLES", "PEN", etc.
-        issue_date       = self._find(es, "invoice_date")           # fecha de emisión
-        due_date         = self._find(es, "due_date")               # vencimiento (si viene)
-        supplier_name    = self._find(es, "supplier_name")
-        supplier_address = self._find(es, "supplier_address")
+        def field(etype: str) -> Optional[str]:
+            e = best.get(etype)
+            return e.text if e else None
+
+        supplier_id      = field("supplier_tax_id") or "unknown"
+        invoice_id       = field("invoice_id") or f"{name}"
+        total            = field("total_amount")
+        total_tax        = field("total_tax_amount")
+        net_amount       = field("net_amount")
+        currency         = field("currency")               # "SOLES", "PEN", etc.
+        issue_date       = field("invoice_date")           # fecha de emisión
+        due_date         = field("due_date")               # vencimiento (si viene)
+        supplier_name    = field("supplier_name")
+        supplier_address = field("supplier_address")
 
         normalized = {
             "supplierId": supplier_id,
@@ -69,6 +137,10 @@ class ProcessInvoiceUseCase:
             "dueDate": due_date,
             "supplierName": supplier_name,  
             "supplierAddress": supplier_address, 
+            "lineItems": [li.to_dict() for li in line_items],
+            # versiones tipadas de los textos de arriba (amounts, currencyCode, issuedAt,
+            # dueAt, period): Firestore puede filtrar/ordenar por ellas y alimentan los rollups
+            **typed_fields(total, total_tax, net_amount, currency, issue_date, due_date),
 
             "supplierUid": uploader_uid,
             "supplierSnapshot": supplier_snapshot or {},
@@ -76,11 +148,51 @@ class ProcessInvoiceUseCase:
             "status": "parsed",
             "createdAt": firestore.SERVER_TIMESTAMP,
             "updatedAt": firestore.SERVER_TIMESTAMP,
-
-            "raw": {"entities": [e.__dict__ for e in es]},
         }
         return supplier_id, invoice_id, normalized
 
+    def _extract(self, bucket: str, name: str, force: bool = False, info: Optional[ObjectInfo] = None) -> InvoiceExtraction:
+        if info is None:
+            with span("stat"):
+                info = self.storage.stat(bucket, name)
+        if info.size > self.inmem_max_bytes:
+            raise DocumentTooLargeError(
+                f"gs://{bucket}/{name} pesa {info.size} bytes (máx {self.inmem_max_bytes} online); "
+                "procesarlo con el backfill batch"
+            )
+        cache_key = self.cache.key_for(info) if self.cache else None
+        if cache_key and not force:
+            with span("cache_lookup"):
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        extraction = self._download_and_extract(info)
+        if cache_key:
+            with span("cache_store"):
+                self.cache.put(cache_key, extraction)
+        return extraction
+
+    def _download_and_extract(self, info: ObjectInfo) -> InvoiceExtraction:
+        if self.admission is None:
+            return self._download_and_extract_admitted(info)
+        # la espera por memoria queda como etapa propia en invoice_stages
+        with span("admission"):
+            cost = self.admission.acquire(info.size)
+        try:
+            return self._download_and_extract_admitted(info)
+        finally:
+            self.admission.release(info.size, cost)
+
+    def _download_and_extract_admitted(self, info: ObjectInfo) -> InvoiceExtraction:
+        bucket, name = info.bucket, info.name
+        mime_type = info.content_type or "application/pdf"
+        # el tamaño ya se validó con stat() en _extract: no hace falta otro reload del blob
+        with span("download"):
+            content = self.storage.download_bytes(bucket, name)
+        with span("extract"):
+            return self.extractor.extract_invoice_bytes(content, mime_type=mime_type)
+
     def run(
         self,
         bucket: str,
@@ -88,13 +200,157 @@ class ProcessInvoiceUseCase:
         generation: Optional[str] = None,
         uploader_uid: Optional[str] = None,
         uploader_email: Optional[str] = None,
+        force: bool = False,
+        overwrite: bool = False,
     ) -> dict:
-        local_path  = self.storage.download_to_tmp(bucket, name)
-        extraction  = self.extractor.extract_invoice(local_path)
+        # force=True ignora la caché de extracciones y vuelve a llamar a DocAI;
+        # overwrite=True guarda la extracción sobre la factura existente (reproceso)
+        start = time.perf_counter()
+        with trace() as spans:
+            info: Optional[ObjectInfo] = None
+            try:
+                if not generation:
+                    # from-upload no trae generación y el evento de Eventarc del mismo
+                    # objeto sí: sin resolverla tendrían claves distintas y se procesaría dos veces
+                    with span("stat"):
+                        info = self.storage.stat(bucket, name)
+                    generation = info.generation
+                key = f"{bucket}:{name}:{generation or 'nog'}"
+
+                def _leased() -> dict:
+                    return self._run_leased(key, bucket, name, generation, uploader_uid, uploader_email, force, overwrite, info)
+
+                if self.inflight is None:
+                    return _leased()
+                # un reproceso (force/overwrite) no debe recibir el resultado de una entrega
+                # normal en curso del mismo objeto, ni al revés
+                flight_key = key + (":force" if force else "") + (":overwrite" if overwrite else "")
+                result, shared = self.inflight.do(flight_key, _leased)
+                return {**result, "coalesced": True} if shared else result
+            finally:
+                # desglose por etapa (GCS / DocAI / Firestore) de esta factura en un solo log
+                log.info("invoice_stages", extra={
+                    "key": f"{bucket}:{name}:{generation or 'nog'}",
+                    "total_s": round(time.perf_counter() - start, 6),
+                    "stages": dict(spans),
+                })
+
+    def _run_leased(
+        self,
+        key: str,
+        bucket: str,
+        name: str,
+        generation: Optional[str],
+        uploader_uid: Optional[str],
+        uploader_email: Optional[str],
+        force: bool,
+        overwrite: bool = False,
+        info: Optional[ObjectInfo] = None,
+    ) -> dict:
+        if self.leases is None:
+            return self._process(bucket, name, generation, uploader_uid, uploader_email, force, overwrite, info)
+
+        with span("dedup_check"):
+            # un reproceso pide una extracción nueva: no sirve el resultado "done" reciente
+            state, previous = self.leases.claim_lease(
+                key, self.instance_id, self.lease_ttl_seconds, reuse_done=not (force or overwrite),
+            )
+        if state == "done":
+            # reentrega de un objeto ya procesado: se responde con el resultado guardado
+            return {**(previous or {}), "deduplicated": True}
+        if state == "running":
+            raise InProgressError(f"{key} ya se está procesando en otra instancia")
+
+        abandoned: List[Future] = []
+        try:
+            result = self._process(bucket, name, generation, uploader_uid, uploader_email, force, overwrite, info,
+                                   on_abandoned=abandoned.extend)
+        except BaseException:
+            if abandoned:
+                # una etapa vencida (p. ej. DocAI) sigue corriendo: si se soltara el lease ya,
+                # una reentrega lanzaría otra extracción del mismo objeto en paralelo
+                self._release_lease_when_done(key, abandoned)
+            else:
+                self.leases.release_lease(key, self.instance_id)
+            raise
+        self.leases.complete_lease(key, self.instance_id, result, self.lease_done_ttl_seconds)
+        return result
+
+    def _release_lease_when_done(self, key: str, futures: List[Future]) -> None:
+        """Suelta el lease cuando terminan todas las etapas abandonadas (o vence por TTL)."""
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def _done(_fut: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                try:
+                    self.leases.release_lease(key, self.instance_id)
+                except Exception as e:
+                    log.warning("lease_release_failed", extra={"key": key, "error": str(e)})
 
-        snap = None
-        if uploader_uid:
-            snap = self.repository.get_user_snapshot(uploader_uid)  # {supplierProfile:{...}, email,...}
+        log.warning("lease_held_for_abandoned_stages", extra={"key": key, "stages": len(futures)})
+        for fut in futures:
+            fut.add_done_callback(_done)
+
+    def _process(
+        self,
+        bucket: str,
+        name: str,
+        generation: Optional[str],
+        uploader_uid: Optional[str],
+        uploader_email: Optional[str],
+        force: bool,
+        overwrite: bool = False,
+        info: Optional[ObjectInfo] = None,
+        on_abandoned: Optional[Callable[[List[Future]], None]] = None,
+    ) -> dict:
+        def snapshot(_deps) -> Dict[str, Any]:
+            if not uploader_uid:
+                return {}
+            with span("snapshot_lookup"):
+                return self.repository.get_user_snapshot(uploader_uid) or {}
+
+        def persist(deps) -> dict:
+            # el snapshot es opcional: si falló o venció, la factura se guarda sin él
+            return self.ingest(
+                deps["extraction"], bucket, name, generation,
+                uploader_uid=uploader_uid,
+                uploader_email=uploader_email,
+                overwrite=overwrite,
+                user_snapshot=deps["snapshot"] or {},
+            )
+
+        results = run_stages([
+            Stage("snapshot", snapshot, timeout=self.snapshot_timeout, optional=True),
+            Stage("extraction", lambda _deps: self._extract(bucket, name, force=force, info=info), timeout=self.extract_timeout),
+            Stage("persist", persist, deps=("extraction", "snapshot"), timeout=self.persist_timeout),
+        ], executor=self.stage_executor, on_abandoned=on_abandoned)
+        return results["persist"]
+
+    def ingest(
+        self,
+        extraction: InvoiceExtraction,
+        bucket: str,
+        name: str,
+        generation: Optional[str] = None,
+        uploader_uid: Optional[str] = None,
+        uploader_email: Optional[str] = None,
+        overwrite: bool = False,
+        user_snapshot: Optional[Dict[str, Any]] = None,
+    ) -> dict:
+        """Normaliza una extracción ya hecha y la persiste (usado por run y por el backfill).
+
+        Con `overwrite=True` una factura existente se actualiza con la nueva extracción
+        conservando su estado y datos de creación, en lugar de marcarse como duplicada.
+        `user_snapshot` evita releer users/{uid} si el llamador ya lo trajo.
+        """
+        snap = user_snapshot
+        if snap is None and uploader_uid:
+            with span("snapshot_lookup"):
+                snap = self.repository.get_user_snapshot(uploader_uid)  # {supplierProfile:{...}, email,...}
 
         supplier_id, invoice_id, payload = self._normalize(
             extraction, bucket, name, generation,
@@ -103,19 +359,47 @@ class ProcessInvoiceUseCase:
             supplier_snapshot=(snap or {}).get("supplierProfile", {})
         )
 
+        raw_ref = None
+        if self.raw_store:
+            with span("raw_store"):
+                payload["raw"] = self.raw_store.put(supplier_id, invoice_id, generation or "nog", extraction)
+            raw_ref = payload["raw"]["ref"]
+        else:
+            payload["raw"] = {"entities": [asdict(e) for e in extraction.entities]}
+
         unique_id = f"{bucket}:{name}:{generation or 'nog'}"
-        if self.repository.invoice_exists(supplier_id, invoice_id):
+        # create-if-absent + evento EXTRACTED en un solo commit; si ya existe no escribe nada
+        with span("save"):
+            created = self.repository.create_invoice(supplier_id, invoice_id, payload, {
+                "action": "EXTRACTED",
+                "note": unique_id,
+                "at": firestore.SERVER_TIMESTAMP
+            })
+        if created:
+            return {"ok": True, "doc_id": f"{supplier_id}/{invoice_id}", "skipped": False}
+
+        if overwrite:
+            for key in _PRESERVED_ON_OVERWRITE:
+                payload.pop(key, None)
+            if raw_ref:
+                # set(merge=True) fusiona mapas: hay que borrar explícitamente el raw inline antiguo
+                payload["raw"]["entities"] = firestore.DELETE_FIELD
+            with span("save"):
+                self.repository.save_invoice_with_event(supplier_id, invoice_id, payload, {
+                    "action": "REEXTRACTED",
+                    "note": unique_id,
+                    "at": firestore.SERVER_TIMESTAMP
+                })
+            return {"ok": True, "doc_id": f"{supplier_id}/{invoice_id}", "skipped": False}
+
+        if raw_ref:
+            # el blob recién escrito (nombre único): la factura existente apunta a otro
+            with span("raw_store"):
+                self.raw_store.delete(raw_ref)
+        with span("event"):
             self.repository.add_event(invoice_id, {
                 "action": "SKIPPED_DUPLICATE",
                 "note": unique_id,
                 "at": firestore.SERVER_TIMESTAMP
             })
-            return {"ok": True, "doc_id": f"{supplier_id}/{invoice_id}", "skipped": True}
-
-        self.repository.save_invoice(supplier_id, invoice_id, payload)
-        self.repository.add_event(invoice_id, {
-            "action": "EXTRACTED",
-            "note": unique_id,
-            "at": firestore.SERVER_TIMESTAMP
-        })
-        return {"ok": True, "doc_id": f"{supplier_id}/{invoice_id}", "skipped": False}
+        return {"ok": True, "doc_id": f"{supplier_id}/{invoice_id}", "skipped": True}
@@ -0,0 +1,434 @@
+"""Fakes en memoria de los puertos (StoragePort, DocAIPort, BatchDocAIPort, RepositoryPort) y de require_user.
+
+Cada fake acepta una `Latency` que simula el tiempo de red del servicio real
+(media + jitter, bloqueando el hilo como lo haría el cliente de Google), así el
+benchmark ejercita el pool de procesamiento y el threadpool de FastAPI con
+tiempos realistas sin tocar GCP.
+
+    from bench.fakes import install
+    fakes = install(app, storage_ms=20, docai_ms=800, firestore_ms=15)
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from app.adapters.outbound.firestore_repo import STATUSES, FirestoreRepo, _add_rollup, _rollup_acc
+from app.domain.models import BatchResult, Entity, InvoiceExtraction, ObjectInfo
+from app.domain.search import matches, query_tokens, rank, search_tokens
+
+@dataclass
+class Latency:
+    mean_ms: float = 0.0
+    jitter_ms: float = 0.0
+
+    def sleep(self) -> None:
+        if self.mean_ms <= 0 and self.jitter_ms <= 0:
+            return
+        delay = max(0.0, random.gauss(self.mean_ms, self.jitter_ms)) if self.jitter_ms else self.mean_ms
+        time.sleep(delay / 1000)
+
+class FakeStorage:
+    """Objetos GCS en memoria; los que no existen se sintetizan con `default_size` bytes."""
+
+    def __init__(self, latency: Optional[Latency] = None, default_size: int = 200 * 1024):
+        self.latency = latency or Latency()
+        self.default_size = default_size
+        self._objects: Dict[Tuple[str, str], bytes] = {}
+        self._lock = threading.Lock()
+
+    def _content(self, bucket: str, name: str) -> bytes:
+        with self._lock:
+            data = self._objects.get((bucket, name))
+        if data is None:
+            head = f"%PDF-fake gs://{bucket}/{name}\n".encode()
+            data = head + b"\0" * max(0, self.default_size - len(head))
+        return data
+
+    def stat(self, bucket: str, name: str) -> ObjectInfo:
+        self.latency.sleep()
+        data = self._content(bucket, name)
+        return ObjectInfo(
+            bucket=bucket, name=name, size=len(data), generation="1",
+            md5_hash=hashlib.md5(data).hexdigest(), content_type="application/pdf",
+        )
+
+    def list_objects(self, bucket: str, prefix: str = "") -> List[ObjectInfo]:
+        self.latency.sleep()
+        with self._lock:
+            keys = [k for k in self._objects if k[0] == bucket and k[1].startswith(prefix)]
+        return [self.stat(b, n) for b, n in keys]
+
+    def download_bytes(self, bucket: str, name: str, max_bytes: Optional[int] = None) -> bytes:
+        self.latency.sleep()
+        data = self._content(bucket, name)
+        if max_bytes is not None and len(data) > max_bytes:
+            raise ValueError(f"gs://{bucket}/{name} pesa {len(data)} bytes (máx {max_bytes})")
+        return data
+
+    def upload_bytes(self, bucket: str, name: str, data: bytes, content_type: str = "application/octet-stream") -> None:
+        self.latency.sleep()
+        with self._lock:
+            self._objects[(bucket, name)] = data
+
+    def delete(self, bucket: str, name: str) -> None:
+        self.latency.sleep()
+        with self._lock:
+            self._objects.pop((bucket, name), None)
+
+    def gcs_uri(self, bucket: str, name: str) -> str:
+        return f"gs://{bucket}/{name}"
+
+class FakeExtractor:
+    """DocAI simulado: entidades deterministas a partir del contenido (mismo PDF = misma factura)."""
+
+    cache_namespace = "fake@bench"
+
+    def __init__(self, latency: Optional[Latency] = None, line_items: int = 10, storage: Optional[FakeStorage] = None):
+        self.latency = latency or Latency()
+        # el batch lee las entradas de aquí y escribe los shards de salida, como DocAI con GCS
+        self.storage = storage
+        self.line_items = line_items
+        self.calls = 0
+        # batch: cada operación responde "en curso" `batch_polls` veces antes de terminar;
+        # batch_errors[n] hace fallar entera la n-ésima operación enviada (desde 1) y las
+        # URIs de batch_failures fallan individualmente
+        self.batch_polls = 0
+        self.batch_errors: Dict[int, str] = {}
+        self.batch_failures: Dict[str, str] = {}
+        self.operations: Dict[str, Dict[str, Any]] = {}
+
+    def extract_invoice_bytes(self, content: bytes, mime_type: str = "application/pdf") -> InvoiceExtraction:
+        self.latency.sleep()
+        self.calls += 1
+        digest = hashlib.sha1(content).hexdigest()
+        ents = [
+            Entity("supplier_tax_id", f"20{int(digest[:8], 16) % 10**9:09d}", 0.98),
+            Entity("invoice_id", f"F001-{digest[8:16]}", 0.97),
+            Entity("total_amount", "1180.00", 0.95),
+            Entity("total_tax_amount", "180.00", 0.93),
+            Entity("net_amount", "1000.00", 0.93),
+            Entity("currency", "PEN", 0.9),
+            Entity("invoice_date", "2025-01-15", 0.92),
+            Entity("supplier_name", "Proveedor Bench SAC", 0.9),
+        ]
+        for i in range(self.line_items):
+            ents.append(Entity("line_item", f"Item {i}", 0.9, properties=[
+                Entity("line_item/description", f"Item {i}", 0.9),
+                Entity("line_item/quantity", "1", 0.9),
+                Entity("line_item/amount", "100.00", 0.9),
+            ]))
+        return InvoiceExtraction(entities=ents)
+
+    # ---------- Batch (backfill) ----------
+    def batch_submit(self, gcs_uris: List[str], output_uri: str) -> str:
+        self.latency.sleep()
+        name = f"operations/fake-{len(self.operations) + 1}"
+        self.operations[name] = {"uris": list(gcs_uris), "output": output_uri, "polls": 0,
+                                 "error": self.batch_errors.get(len(self.operations) + 1)}
+        return name
+
+    def batch_status(self, operation_name: str) -> BatchResult:
+        op = self.operations.get(operation_name)
+        if op is None:
+            raise KeyError(f"Operación desconocida: {operation_name}")
+        op["polls"] += 1
+        if op["polls"] <= self.batch_polls:
+            return BatchResult(done=False)
+        if op["error"]:
+            return BatchResult(done=True, error=op["error"])
+        if "result" not in op:
+            # como DocAI: un prefijo de salida por documento con su shard JSON
+            result = BatchResult(done=True)
+            out_bucket, _, out_prefix = op["output"][5:].partition("/")
+            for i, uri in enumerate(op["uris"]):
+                if uri in self.batch_failures:
+                    result.failures[uri] = self.batch_failures[uri]
+                    continue
+                bucket, _, name = uri[5:].partition("/")
+                extraction = self.extract_invoice_bytes(self.storage.download_bytes(bucket, name))
+                shard = f"{out_prefix}{i}/doc-0.json"
+                self.storage.upload_bytes(out_bucket, shard, json.dumps(extraction.to_dict()).encode())
+                result.outputs[uri] = f"gs://{out_bucket}/{out_prefix}{i}/"
+            op["result"] = result
+        return op["result"]
+
+    def extraction_from_json(self, data: bytes) -> InvoiceExtraction:
+        return InvoiceExtraction.from_dict(json.loads(data))
+
+class FakeRepo:
+    """Subconjunto de FirestoreRepo en memoria: lo que usan el caso de uso y los routers."""
+
+    def __init__(self, latency: Optional[Latency] = None, admins: Tuple[str, ...] = ()):
+        self.latency = latency or Latency()
+        self._lock = threading.Lock()
+        self.invoices: Dict[str, Dict[str, Any]] = {}
+        self.events: Dict[str, List[Dict[str, Any]]] = {}
+        self.users: Dict[str, Dict[str, Any]] = {uid: {"role": "admin"} for uid in admins}
+        self.leases: Dict[str, Dict[str, Any]] = {}
+        self.backfills: Dict[str, Dict[str, Any]] = {}
+        self.backfill_chunks: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._seq = 0
+
+    # ---------- Usuarios ----------
+    def get_user_snapshot(self, uid: str) -> Optional[Dict[str, Any]]:
+        self.latency.sleep()
+        return self.users.get(uid)
+
+    def invalidate_user(self, uid: Optional[str] = None) -> None:
+        pass
+
+    def is_admin(self, uid: str) -> bool:
+        return (self.users.get(uid) or {}).get("role") == "admin"
+
+    # ---------- Escritura ----------
+    def _stamp(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        # SERVER_TIMESTAMP no es serializable: se reemplaza por un orden creciente
+        self._seq += 1
+        return {**data, "createdAt": self._seq, "updatedAt": self._seq}
+
+    def create_invoice(self, supplier_id: str, invoice_id: str, data: Dict[str, Any], event: Dict[str, Any]) -> bool:
+        self.latency.sleep()
+        doc_id = f"{supplier_id}/{invoice_id}"
+        with self._lock:
+            if doc_id in self.invoices:
+                return False
+            self.invoices[doc_id] = self._stamp(data)
+            self.events.setdefault(invoice_id, []).append(event)
+        return True
+
+    def save_invoice_with_event(self, supplier_id: str, invoice_id: str, data: Dict[str, Any], event: Dict[str, Any]) -> None:
+        self.latency.sleep()
+        doc_id = f"{supplier_id}/{invoice_id}"
+        with self._lock:
+            self.invoices[doc_id] = {**self.invoices.get(doc_id, {}), **self._stamp(data)}
+            self.events.setdefault(invoice_id, []).append(event)
+
+    def add_event(self, invoice_id: str, event: Dict[str, Any]) -> None:
+        self.latency.sleep()
+        with self._lock:
+            self.events.setdefault(invoice_id, []).append(event)
+
+    def update_status(self, doc_id: str, status: str, by_uid: Optional[str] = None) -> bool:
+        self.latency.sleep()
+        with self._lock:
+            inv = self.invoices.get(doc_id)
+            if inv is None:
+                return False
+            inv["status"] = status
+            self.events.setdefault(doc_id.split("/", 1)[-1], []).append({"action": "STATUS_CHANGED", "status": status})
+        return True
+
+    def bulk_update_status(self, doc_ids: List[str], status: str, by_uid: Optional[str] = None, chunk_size: int = 100) -> Dict[str, str]:
+        return {d: "ok" if self.update_status(d, status, by_uid) else "not_found" for d in dict.fromkeys(doc_ids)}
+
+    # ---------- Lectura ----------
+    def _project(self, doc_id: str, fields: Optional[List[str]]) -> Dict[str, Any]:
+        inv = self.invoices[doc_id]
+        data = {k: inv.get(k) for k in fields} if fields else dict(inv)
+        return {"id": doc_id, **data}
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        self.latency.sleep()
+        return self._project(doc_id, None) if doc_id in self.invoices else None
+
+    def get_many(self, doc_ids: List[str], fields: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        self.latency.sleep()
+        return {d: self._project(d, fields) for d in doc_ids if d in self.invoices}
+
+    def list(self, status=None, limit: int = 20, cursor: Optional[str] = None, *, requester_uid=None, supplier_id=None):
+        self.latency.sleep()
+        with self._lock:
+            rows = sorted(self.invoices.items(), key=lambda kv: kv[1]["createdAt"], reverse=True)
+        if requester_uid and not self.is_admin(requester_uid):
+            rows = [r for r in rows if r[1].get("supplierUid") == requester_uid]
+        elif supplier_id:
+            rows = [r for r in rows if r[1].get("supplierId") == supplier_id]
+        if status:
+            rows = [r for r in rows if r[1].get("status") == status]
+        start = int(cursor or 0)
+        page = rows[start:start + limit]
+        next_cursor = str(start + limit) if start + limit < len(rows) else None
+        return [self._project(doc_id, None) for doc_id, _ in page], next_cursor
+
+    def search(self, q: str, limit: int = 20, cursor: Optional[str] = None, *, requester_uid=None, supplier_id=None):
+        # sin índice: recorre todo, pero con los mismos tokens y ranking que FirestoreRepo
+        tokens = query_tokens(q)
+        if not tokens:
+            raise ValueError("búsqueda vacía")
+        rows, _ = self.list(None, len(self.invoices) or 1, None, requester_uid=requester_uid, supplier_id=supplier_id)
+        hits = [r for r in rows
+                if matches(tokens, search_tokens(r.get("supplierId"), r.get("invoiceId"), r.get("supplierName")))]
+        hits.sort(key=lambda r: rank(r, tokens), reverse=True)
+        start = int(cursor or 0)
+        next_cursor = str(start + limit) if start + limit < len(hits) else None
+        return hits[start:start + limit], next_cursor
+
+    def iter_invoices(self, supplier_uid=None, status=None, supplier_id=None, created_from=None,
+                      created_to=None, fields=None, page_size: int = 500):
+        rows, cursor = self.list(status, page_size, None, requester_uid=supplier_uid, supplier_id=supplier_id)
+        while rows:
+            yield [{"id": r["id"], "supplierId": r["id"].split("/", 1)[0], **({k: r.get(k) for k in fields} if fields else r)} for r in rows]
+            if cursor is None:
+                return
+            rows, cursor = self.list(status, page_size, cursor, requester_uid=supplier_uid, supplier_id=supplier_id)
+
+    def stats(self, supplier_id: Optional[str] = None, supplier_uid: Optional[str] = None) -> Dict[str, Any]:
+        self.latency.sleep()
+        out: Dict[str, int] = {s: 0 for s in STATUSES}
+        for inv in list(self.invoices.values()):
+            if supplier_id and inv.get("supplierId") != supplier_id:
+                continue
+            if supplier_uid and inv.get("supplierUid") != supplier_uid:
+                continue
+            out[inv.get("status")] = out.get(inv.get("status"), 0) + 1
+        out["total"] = sum(out.values())
+        return out
+
+    def get_rollups(self, supplier_id: str, period_from: Optional[str] = None, period_to: Optional[str] = None) -> List[Dict[str, Any]]:
+        # se calcula recorriendo las facturas: mismo resultado que los rollups incrementales
+        self.latency.sleep()
+        acc = _rollup_acc()
+        for inv in list(self.invoices.values()):
+            if inv.get("supplierId") == supplier_id:
+                _add_rollup(acc, inv, 1)
+        periods = sorted(p for p in acc if (not period_from or p >= period_from) and (not period_to or p <= period_to))
+        return [{"supplierId": supplier_id, "period": p, "totals": FirestoreRepo._rollup_totals(acc[p])} for p in periods]
+
+    def is_uploader_of(self, supplier_id: str, uid: str) -> bool:
+        return any(inv.get("supplierId") == supplier_id and inv.get("supplierUid") == uid for inv in list(self.invoices.values()))
+
+    # ---------- Leases ----------
+    def claim_lease(self, key: str, owner: str, ttl_seconds: float, reuse_done: bool = True):
+        self.latency.sleep()
+        now = time.monotonic()
+        with self._lock:
+            lease = self.leases.get(key)
+            alive = lease is not None and lease["expiresAt"] > now
+            if alive and lease["status"] == "done" and reuse_done:
+                return "done", lease["result"]
+            if alive and lease["status"] == "running" and lease["owner"] != owner:
+                return "running", None
+            self.leases[key] = {"owner": owner, "status": "running", "expiresAt": now + ttl_seconds}
+        return "acquired", None
+
+    def complete_lease(self, key: str, owner: str, result: Dict[str, Any], ttl_seconds: float) -> None:
+        self.latency.sleep()
+        with self._lock:
+            self.leases[key] = {"owner": owner, "status": "done", "result": result, "expiresAt": time.monotonic() + ttl_seconds}
+
+    def release_lease(self, key: str, owner: str) -> None:
+        with self._lock:
+            if (self.leases.get(key) or {}).get("owner") == owner:
+                del self.leases[key]
+
+    # ---------- Backfill ----------
+    @staticmethod
+    def _merge(current: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+        # set(merge=True) de Firestore, con Increment resuelto y sin SERVER_TIMESTAMP
+        out = dict(current)
+        for k, v in data.items():
+            if isinstance(v, firestore.Increment):
+                out[k] = (out.get(k) or 0) + v.value
+            elif v is not firestore.SERVER_TIMESTAMP:
+                out[k] = v
+        return out
+
+    def get_backfill(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self.backfills.get(job_id)
+            return dict(job) if job is not None else None
+
+    def save_backfill(self, job_id: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self.backfills[job_id] = self._merge(self.backfills.get(job_id, {}), data)
+
+    def list_backfill_chunks(self, job_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            chunks = self.backfill_chunks.get(job_id, {})
+            return [dict(chunks[i]) for i in sorted(chunks)]
+
+    def save_backfill_chunk(self, job_id: str, index: int, data: Dict[str, Any]) -> None:
+        with self._lock:
+            chunks = self.backfill_chunks.setdefault(job_id, {})
+            chunks[index] = self._merge(chunks.get(index, {}), data | {"index": index})
+
+def fake_user(uid: str = "bench-user", email: str = "bench@example.com"):
+    """Dependencia que reemplaza require_user (sin token ni Firebase)."""
+    async def _require_user():
+        return {"uid": uid, "email": email}
+    return _require_user
+
+@dataclass
+class Fakes:
+    storage: FakeStorage
+    extractor: FakeExtractor
+    repo: FakeRepo
+
+def install(
+    app,
+    storage_ms: float = 0,
+    docai_ms: float = 0,
+    firestore_ms: float = 0,
+    jitter: float = 0.2,
+    uid: str = "bench-user",
+    admin: bool = True,
+    workers: Optional[int] = None,
+    queue_max: Optional[int] = None,
+    memory_budget: Optional[int] = None,
+) -> Fakes:
+    """Inyecta los fakes en el registry y en la app; `jitter` es la fracción de la media."""
+    from app.config import settings
+    from app.registry import registry
+    from app.shared.admission import MemoryBudget
+    from app.shared.auth import require_user
+    from app.shared.executor import BoundedExecutor
+    from app.shared.singleflight import SingleFlight
+    from app.usecases.process_invoice import ProcessInvoiceUseCase
+
+    storage = FakeStorage(Latency(storage_ms, storage_ms * jitter))
+    fakes = Fakes(
+        storage=storage,
+        extractor=FakeExtractor(Latency(docai_ms, docai_ms * jitter), storage=storage),
+        repo=FakeRepo(Latency(firestore_ms, firestore_ms * jitter), admins=(uid,) if admin else ()),
+    )
+    usecase = ProcessInvoiceUseCase(
+        storage=fakes.storage,
+        extractor=fakes.extractor,
+        repository=fakes.repo,
+        inmem_max_bytes=settings.DOC_INMEM_MAX_BYTES,
+        inflight=SingleFlight(),
+        leases=fakes.repo,
+        stage_executor=ThreadPoolExecutor(max_workers=(workers or settings.PROCESS_WORKERS) * 2),
+        admission=MemoryBudget(
+            budget_bytes=memory_budget,
+            base_bytes=settings.MEMORY_BASE_BYTES,
+            size_factor=settings.MEMORY_SIZE_FACTOR,
+            large_bytes=settings.MEMORY_LARGE_OBJECT_BYTES,
+            large_concurrency=settings.MEMORY_LARGE_CONCURRENCY,
+            max_wait=settings.MEMORY_MAX_WAIT_SECONDS,
+            retry_after=settings.PROCESS_RETRY_AFTER,
+        ) if memory_budget else None,
+    )
+    registry.override(
+        storage=fakes.storage,
+        extractor=fakes.extractor,
+        repo=fakes.repo,
+        usecase=usecase,
+        admission=usecase.admission or False,
+        extraction_cache=False,
+        raw_store=False,
+        processing_pool=BoundedExecutor(
+            max_workers=workers or settings.PROCESS_WORKERS,
+            max_queue=settings.PROCESS_QUEUE_MAX if queue_max is None else queue_max,
+            retry_after=settings.PROCESS_RETRY_AFTER,
+        ),
+    )
+    app.dependency_overrides[require_user] = fake_user(uid)
+    return fakes
@@ -0,0 +1,161 @@
+"""Prueba de carga de la app ASGI completa con los puertos simulados (bench.fakes).
+
+    python -m bench.load --scenario event list status --concurrency 1 8 32 \\
+        --requests 400 --docai-ms 800 --storage-ms 20 --firestore-ms 15 --workers 8
+
+Las requests pasan por middlewares, validación, dependencias y el pool de
+procesamiento reales (httpx.ASGITransport, sin red). Por escenario y nivel de
+concurrencia reporta throughput, p50/p95/p99, errores y el RSS pico del proceso;
+sirve para dimensionar la concurrencia y la memoria de Cloud Run y para comparar
+antes/después de un cambio con las mismas latencias simuladas. Requiere httpx
+(pip install -r requirements-dev.txt), que no es dependencia de runtime.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import resource
+import statistics
+import sys
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List
+
+# la app exige estas variables al importar settings; en el bench no se usan
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "bench")
+os.environ.setdefault("DOCAI_PROCESSOR_ID", "bench")
+os.environ.setdefault("GCS_BUCKET", "bench-bucket")
+
+import httpx
+
+from app.main import app
+from bench.fakes import Fakes, Latency, install
+
+STATUSES = ("observed", "approved", "paid", "parsed")
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss: KiB en Linux, bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+async def _drive(client: httpx.AsyncClient, make: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]],
+                 total: int, concurrency: int) -> Dict[str, object]:
+    counter = itertools.count()
+    latencies: List[float] = []
+    codes: Counter = Counter()
+
+    async def worker() -> None:
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            start = time.perf_counter()
+            try:
+                resp = await make(client, i)
+                codes[resp.status_code] += 1
+            except Exception as e:
+                codes[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": total / elapsed if elapsed else 0.0,
+        "p50": _percentile(latencies, 50) * 1000,
+        "p95": _percentile(latencies, 95) * 1000,
+        "p99": _percentile(latencies, 99) * 1000,
+        "mean": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        "codes": dict(codes),
+    }
+
+def _scenarios(run_id: str, doc_ids: List[str]) -> Dict[str, Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]]:
+    def event(client: httpx.AsyncClient, i: int):
+        # un objeto distinto por request: sin coalescing ni duplicados
+        return client.post("/", json={"data": {"bucket": "bench-bucket", "name": f"uploads/{run_id}/{i}.pdf", "generation": "1"}})
+
+    def list_(client: httpx.AsyncClient, i: int):
+        return client.get("/invoices", params={"limit": 20})
+
+    def status(client: httpx.AsyncClient, i: int):
+        doc_id = doc_ids[i % len(doc_ids)]
+        return client.patch(f"/invoices/{doc_id}/status", json={"status": STATUSES[i % len(STATUSES)]})
+
+    def summary(client: httpx.AsyncClient, i: int):
+        return client.get("/invoices/stats/summary")
+
+    def search(client: httpx.AsyncClient, i: int):
+        return client.get("/invoices/search", params={"q": "proveedor bench", "limit": 20})
+
+    return {"event": event, "list": list_, "status": status, "summary": summary, "search": search}
+
+async def _seed(client: httpx.AsyncClient, fakes: Fakes, n: int) -> List[str]:
+    # la siembra no se mide: se hace sin latencia simulada
+    ports = (fakes.storage, fakes.extractor, fakes.repo)
+    saved = [p.latency for p in ports]
+    for p in ports:
+        p.latency = Latency()
+    try:
+        ids = []
+        for i in range(n):
+            resp = await client.post("/", json={"data": {"bucket": "bench-bucket", "name": f"seed/{i}.pdf", "generation": "1"}})
+            resp.raise_for_status()
+            ids.append(resp.json()["doc_id"])
+        return ids
+    finally:
+        for p, latency in zip(ports, saved):
+            p.latency = latency
+
+async def main_async(args, fakes: Fakes) -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        doc_ids = await _seed(client, fakes, args.seed)
+        print(f"{'scenario':>9} {'conc':>5} {'reqs':>6} {'rps':>9} {'p50_ms':>9} {'p95_ms':>9} "
+              f"{'p99_ms':>9} {'rss_mb':>8}  codes")
+        for name in args.scenario:
+            for conc in args.concurrency:
+                make = _scenarios(f"{name}-{conc}", doc_ids)[name]
+                r = await _drive(client, make, args.requests, conc)
+                print(f"{name:>9} {conc:>5} {args.requests:>6} {r['rps']:>9.1f} {r['p50']:>9.1f} "
+                      f"{r['p95']:>9.1f} {r['p99']:>9.1f} {_peak_rss_mb():>8.1f}  {r['codes']}")
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", nargs="+", default=["event", "list", "status"],
+                        choices=["event", "list", "status", "summary", "search"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=200, help="facturas creadas antes de medir")
+    parser.add_argument("--storage-ms", type=float, default=20)
+    parser.add_argument("--docai-ms", type=float, default=300)
+    parser.add_argument("--firestore-ms", type=float, default=15)
+    parser.add_argument("--jitter", type=float, default=0.2, help="fracción de la media")
+    parser.add_argument("--workers", type=int, default=None, help="PROCESS_WORKERS (por defecto el de settings)")
+    parser.add_argument("--queue-max", type=int, default=None, help="PROCESS_QUEUE_MAX (por defecto el de settings)")
+    parser.add_argument("--memory-budget-mb", type=float, default=0, help="MEMORY_BUDGET_BYTES en MiB (0 = sin admisión)")
+    args = parser.parse_args(argv)
+
+    # los logs por request distorsionan la medición
+    logging.getLogger().setLevel(logging.WARNING)
+    fakes = install(
+        app,
+        storage_ms=args.storage_ms,
+        docai_ms=args.docai_ms,
+        firestore_ms=args.firestore_ms,
+        jitter=args.jitter,
+        workers=args.workers,
+        queue_max=args.queue_max,
+        memory_budget=int(args.memory_budget_mb * 1024 * 1024),
+    )
+    asyncio.run(main_async(args, fakes))
+
+if __name__ == "__main__":
+    main()
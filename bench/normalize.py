@@ -0,0 +1,90 @@
+"""Microbenchmark de ProcessInvoiceUseCase._normalize con extracciones sintéticas.
+
+    python -m bench.normalize --entities 50 200 800 --line-items 100 --repeat 200
+
+Columnas (µs por extracción):
+  legacy_fields_us  patrón anterior: un escaneo lineal por campo, primer match
+  legacy_full_us    lo mismo + construir los LineItem (el mismo trabajo que index_us)
+  index_us          _index_entities: una pasada que elige campos por confianza y
+                    construye los LineItem
+  normalize_us      _normalize completo (índice + payload)
+index_us se compara con legacy_full_us; legacy_fields_us no construye line items.
+También reporta el tamaño de los line items compactos frente a los dicts crudos.
+"""
+import argparse
+import json
+import random
+import time
+from dataclasses import asdict
+
+from app.domain.models import Entity, InvoiceExtraction, LineItem
+from app.usecases.process_invoice import ProcessInvoiceUseCase, _index_entities
+
+FIELDS = [
+    "supplier_tax_id", "invoice_id", "total_amount", "total_tax_amount", "net_amount",
+    "currency", "invoice_date", "due_date", "supplier_name", "supplier_address",
+]
+NOISE = ["receiver_name", "receiver_address", "payment_terms", "purchase_order", "ship_to_address"]
+
+def synthetic_extraction(n_entities: int, n_line_items: int, seed: int = 7) -> InvoiceExtraction:
+    rnd = random.Random(seed)
+    ents = []
+    for i in range(n_line_items):
+        ents.append(Entity("line_item", f"Producto {i} x {i % 7 + 1}", rnd.random(), properties=[
+            Entity("line_item/description", f"Producto {i}", rnd.random()),
+            Entity("line_item/quantity", str(i % 7 + 1), rnd.random()),
+            Entity("line_item/unit_price", f"S/ {rnd.randint(1, 999)}.00", rnd.random()),
+            Entity("line_item/amount", f"S/ {rnd.randint(1, 9999)}.50", rnd.random()),
+        ]))
+    # como en DocAI: cada campo 0-2 veces (due_date suele faltar) y el resto ruido
+    for etype in FIELDS:
+        for _ in range(0 if etype == "due_date" else rnd.randint(1, 2)):
+            ents.append(Entity(etype, f"{etype}-{len(ents)}", rnd.random()))
+    while len(ents) < n_entities + n_line_items:
+        etype = rnd.choice(NOISE)
+        ents.append(Entity(etype, f"{etype}-{len(ents)}", rnd.random()))
+    rnd.shuffle(ents)
+    return InvoiceExtraction(entities=ents)
+
+def _legacy_find(entities, etype):
+    for e in entities:
+        if e.type == etype:
+            return e.text
+    return None
+
+def legacy_fields(extraction: InvoiceExtraction):
+    return {f: _legacy_find(extraction.entities, f) for f in FIELDS}
+
+def legacy_full(extraction: InvoiceExtraction):
+    line_items = [LineItem.from_entity(e) for e in extraction.entities if e.type == "line_item"]
+    return legacy_fields(extraction), line_items
+
+def _timeit(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entities", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--line-items", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    usecase = ProcessInvoiceUseCase(storage=None, extractor=None, repository=None)
+    print(f"{'entities':>9} {'legacy_fields_us':>17} {'legacy_full_us':>15} {'index_us':>9} {'normalize_us':>13} "
+          f"{'raw_li_bytes':>13} {'compact_li_bytes':>17}")
+    for n in args.entities:
+        ext = synthetic_extraction(n, args.line_items)
+        legacy = _timeit(lambda: legacy_fields(ext), args.repeat)
+        full = _timeit(lambda: legacy_full(ext), args.repeat)
+        index = _timeit(lambda: _index_entities(ext.entities), args.repeat)
+        current = _timeit(lambda: usecase._normalize(ext, "bucket", "f.pdf", "1"), args.repeat)
+        _, _, payload = usecase._normalize(ext, "bucket", "f.pdf", "1")
+        raw_li = [asdict(e) for e in ext.entities if e.type == "line_item"]
+        print(f"{n:>9} {legacy:>17.1f} {full:>15.1f} {index:>9.1f} {current:>13.1f} "
+              f"{len(json.dumps(raw_li)):>13} {len(json.dumps(payload['lineItems'])):>17}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+import os
+
+# settings exige estas variables al importarse; los tests no tocan GCP
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "test-project")
+os.environ.setdefault("DOCAI_PROCESSOR_ID", "test-processor")
+os.environ.setdefault("GCS_BUCKET", "test-bucket")
@@ -0,0 +1,85 @@
+from bench.fakes import FakeExtractor, FakeRepo, FakeStorage
+from app.usecases.backfill import BackfillUseCase
+from app.usecases.process_invoice import ProcessInvoiceUseCase
+
+def _backfill(pdfs: int = 4, **kwargs) -> BackfillUseCase:
+    storage = FakeStorage()
+    for i in range(pdfs):
+        storage.upload_bytes("b", f"uploads/f{i}.pdf", f"%PDF {i}".encode(), "application/pdf")
+    extractor = FakeExtractor(storage=storage, line_items=1)
+    repo = FakeRepo()
+    return BackfillUseCase(
+        storage=storage,
+        extractor=extractor,
+        repository=repo,
+        ingestor=ProcessInvoiceUseCase(storage=storage, extractor=extractor, repository=repo),
+        output_bucket="out",
+        chunk_size=2,
+        max_in_flight=2,
+        sleep=lambda _s: None,
+        **kwargs,
+    )
+
+def test_submit_poll_collect():
+    bf = _backfill()
+    bf.extractor.batch_polls = 2
+    job_id = bf.start("b", "uploads/")
+    summary = bf.run(job_id)
+    assert summary["status"] == "done"
+    assert (summary["total"], summary["processed"], summary["failed"]) == (4, 4, 0)
+    assert len(bf.repository.invoices) == 4
+    assert len(bf.extractor.operations) == 2
+
+def test_start_is_idempotent_by_job_id():
+    bf = _backfill()
+    assert bf.start("b", "uploads/", job_id="j1") == "j1"
+    bf.storage.upload_bytes("b", "uploads/late.pdf", b"%PDF late", "application/pdf")
+    bf.start("b", "uploads/", job_id="j1")
+    assert bf.repository.get_backfill("j1")["total"] == 4
+
+def test_failed_chunk_leaves_job_partial_and_resume_retries_it():
+    bf = _backfill()
+    bf.extractor.batch_errors = {1: "INTERNAL"}
+    job_id = bf.start("b", "uploads/")
+    summary = bf.run(job_id)
+    assert summary["status"] == "partial"
+    assert summary["processed"] == 2
+    chunks = bf.repository.list_backfill_chunks(job_id)
+    assert [c["status"] for c in chunks] == ["error", "done"]
+
+    summary = bf.run(job_id)
+    assert summary["status"] == "done"
+    assert summary["processed"] == 4
+    # solo se reenvía el chunk fallido
+    assert len(bf.extractor.operations) == 3
+
+def test_all_chunks_failed():
+    bf = _backfill()
+    bf.extractor.batch_errors = {1: "INTERNAL", 2: "INTERNAL"}
+    summary = bf.run(bf.start("b", "uploads/"))
+    assert summary["status"] == "failed"
+    assert summary["processed"] == 0
+
+def test_failed_document_leaves_job_partial():
+    bf = _backfill()
+    bf.extractor.batch_failures = {"gs://b/uploads/f1.pdf": "Unsupported"}
+    job_id = bf.start("b", "uploads/")
+    summary = bf.run(job_id)
+    assert summary["status"] == "partial"
+    assert (summary["processed"], summary["failed"]) == (3, 1)
+    chunk = bf.repository.list_backfill_chunks(job_id)[0]
+    assert chunk["errors"] == {"uploads/f1.pdf": "Unsupported"}
+
+def test_resume_after_pause_adopts_submitted_operations():
+    clock = iter(range(0, 10_000, 10))
+    bf = _backfill(poll_timeout=15, clock=lambda: next(clock))
+    bf.extractor.batch_polls = 3
+    job_id = bf.start("b", "uploads/")
+    assert bf.run(job_id)["status"] == "paused"
+    assert [c["status"] for c in bf.repository.list_backfill_chunks(job_id)] == ["submitted", "submitted"]
+
+    summary = bf.run(job_id)
+    assert summary["status"] == "done"
+    assert summary["processed"] == 4
+    # las operaciones en vuelo se consultan por nombre, no se reenvían
+    assert len(bf.extractor.operations) == 2
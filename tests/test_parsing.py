@@ -0,0 +1,80 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app.domain.parsing import parse_amount, parse_currency, parse_date, typed_fields
+
+@pytest.mark.parametrize("text, expected", [
+    ("S/ 1,234.50", "1234.50"),
+    ("S/.1,234.50", "1234.50"),
+    ("S/. 1,234.50", "1234.50"),
+    ("US$ 99.9", "99.90"),
+    ("1.234,50", "1234.50"),
+    ("1234,5", "1234.50"),
+    ("12.50", "12.50"),
+    (".50", "0.50"),
+    ("1 234,50", "1234.50"),
+    ("1.234.567", "1234567.00"),
+    ("1,234,567.89", "1234567.89"),
+    # un solo separador seguido de 3 dígitos se toma como de miles
+    ("1,234", "1234.00"),
+    ("1.234", "1234.00"),
+    ("-12", "-12.00"),
+    ("(45.10)", "-45.10"),
+    ("-S/ 100.00", "-100.00"),
+    ("(S/ 100.00)", "-100.00"),
+    ("Total: 99", "99.00"),
+])
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == Decimal(expected)
+
+@pytest.mark.parametrize("text", [None, "", "abc", "S/"])
+def test_parse_amount_unrecognized(text):
+    assert parse_amount(text) is None
+
+@pytest.mark.parametrize("text, expected", [
+    ("2025-01-15", date(2025, 1, 15)),
+    ("15/01/2025", date(2025, 1, 15)),
+    ("15-01-2025", date(2025, 1, 15)),
+    ("15.01.25", date(2025, 1, 15)),
+    ("01/15/2025", date(2025, 1, 15)),
+    ("15 de enero de 2025", date(2025, 1, 15)),
+    ("15 de Enero del 2025", date(2025, 1, 15)),
+    ("3-Set-2024", date(2024, 9, 3)),
+    ("Enero 15, 2025", date(2025, 1, 15)),
+    ("Jan 15 2025", date(2025, 1, 15)),
+])
+def test_parse_date(text, expected):
+    assert parse_date(text) == expected
+
+@pytest.mark.parametrize("text", [None, "", "31/02/2025", "sin fecha"])
+def test_parse_date_unrecognized(text):
+    assert parse_date(text) is None
+
+@pytest.mark.parametrize("text, expected", [
+    ("PEN", "PEN"),
+    ("SOLES", "PEN"),
+    ("S/.", "PEN"),
+    ("S/ 1,234.50", "PEN"),
+    ("Dólares", "USD"),
+    ("US DOLLAR", "USD"),
+    ("USD 20", "USD"),
+    ("US$", "USD"),
+    ("EUR", "EUR"),
+    ("XYZ", None),
+    (None, None),
+])
+def test_parse_currency(text, expected):
+    assert parse_currency(text) == expected
+
+def test_typed_fields():
+    out = typed_fields("S/.1,180.00", "S/ 180.00", None, None, "15/01/2025", "Febrero 14, 2025")
+    assert out["amounts"] == {"total": 1180.0, "totalTax": 180.0, "netAmount": None}
+    # sin texto de moneda se toma del símbolo del monto
+    assert out["currencyCode"] == "PEN"
+    assert out["period"] == "2025-01"
+    assert out["dueAt"].date() == date(2025, 2, 14)
+
+def test_typed_fields_without_issue_date_has_no_period():
+    assert typed_fields("10", None, None, "PEN", None, None)["period"] is None
@@ -0,0 +1,103 @@
+import dataclasses
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bench.fakes import FakeExtractor, FakeRepo, FakeStorage
+from app.shared.errors import DocumentTooLargeError, InProgressError
+from app.shared.pipeline import StageTimeoutError
+from app.shared.singleflight import SingleFlight
+from app.usecases.process_invoice import ProcessInvoiceUseCase
+
+def _usecase(**kwargs) -> ProcessInvoiceUseCase:
+    storage = FakeStorage()
+    repo = FakeRepo()
+    return ProcessInvoiceUseCase(
+        storage=storage,
+        extractor=FakeExtractor(storage=storage),
+        repository=repo,
+        inflight=SingleFlight(),
+        leases=repo,
+        **kwargs,
+    )
+
+def test_redelivery_is_deduplicated():
+    uc = _usecase()
+    uc.run("b", "s/f.pdf", "1")
+    again = uc.run("b", "s/f.pdf", "1")
+    assert again["deduplicated"] is True
+    assert uc.extractor.calls == 1
+
+def test_reprocess_right_after_ingest_extracts_again():
+    uc = _usecase()
+    first = uc.run("b", "s/f.pdf", "1")
+    again = uc.run("b", "s/f.pdf", "1", overwrite=True)
+    assert "deduplicated" not in again
+    assert again["doc_id"] == first["doc_id"]
+    assert again["skipped"] is False
+    assert uc.extractor.calls == 2
+    forced = uc.run("b", "s/f.pdf", "1", force=True, overwrite=True)
+    assert "deduplicated" not in forced
+    assert uc.extractor.calls == 3
+
+def test_reprocess_does_not_join_an_inflight_delivery():
+    uc = _usecase()
+    entered, release = threading.Event(), threading.Event()
+    extract = uc.extractor.extract_invoice_bytes
+
+    def slow_extract(content, mime_type="application/pdf"):
+        entered.set()
+        release.wait(5)
+        return extract(content, mime_type=mime_type)
+
+    uc.extractor.extract_invoice_bytes = slow_extract
+    results = {}
+    delivery = threading.Thread(target=lambda: results.setdefault("event", uc.run("b", "s/f.pdf", "1")))
+    delivery.start()
+    assert entered.wait(5)
+    reprocess = threading.Thread(target=lambda: results.setdefault("reprocess", uc.run("b", "s/f.pdf", "1", overwrite=True)))
+    reprocess.start()
+    release.set()
+    delivery.join(5)
+    reprocess.join(5)
+    assert "coalesced" not in results["reprocess"]
+    assert uc.extractor.calls == 2
+
+def test_oversized_pdf_is_rejected_before_download():
+    uc = _usecase(inmem_max_bytes=1024)
+    uc.storage.upload_bytes("b", "s/big.pdf", b"%PDF" + b"\0" * 2048)
+    downloads = []
+    download = uc.storage.download_bytes
+    uc.storage.download_bytes = lambda *a, **kw: downloads.append(a) or download(*a, **kw)
+    with pytest.raises(DocumentTooLargeError):
+        uc.run("b", "s/big.pdf", "1")
+    assert downloads == []
+    assert uc.extractor.calls == 0
+
+def test_lease_is_held_until_a_timed_out_extraction_finishes():
+    pool = ThreadPoolExecutor(max_workers=4)
+    uc = _usecase(stage_executor=pool, extract_timeout=0.05)
+    other = dataclasses.replace(uc, instance_id="other-instance", inflight=SingleFlight())
+    release = threading.Event()
+    extract = uc.extractor.extract_invoice_bytes
+
+    def slow_extract(content, mime_type="application/pdf"):
+        release.wait(5)
+        return extract(content, mime_type=mime_type)
+
+    uc.extractor.extract_invoice_bytes = slow_extract
+    with pytest.raises(StageTimeoutError):
+        uc.run("b", "s/f.pdf", "1")
+    # DocAI sigue en curso: una reentrega en otra instancia no lanza una segunda extracción
+    with pytest.raises(InProgressError):
+        other.run("b", "s/f.pdf", "1")
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while uc.repository.leases and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert uc.repository.leases == {}
+    assert other.run("b", "s/f.pdf", "1")["ok"] is True
+    pool.shutdown()